@@ -1,21 +1,57 @@
 import os
-import logging
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+import logging_setup
+from records import Record
+
+# Configure logging: LOG_LEVEL (default DEBUG), LOG_FORMAT=json for queued JSON lines
+logging_setup.configure()
+
+class RecordJSONProvider(DefaultJSONProvider):
+    """Serialize slotted DataStore records through their mapping view"""
+    def default(self, o):
+        if isinstance(o, Record):
+            return dict(o)
+        return super().default(o)
 
 # Create the app
 app = Flask(__name__)
+app.json = RecordJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-mukuru-loyalty")
 
 # Enable CORS for API endpoints
 CORS(app)
 
+# Behind nginx or a load balancer, trust that many X-Forwarded-* hops so request.remote_addr
+# (which keys rate limits before login) is the client rather than the proxy. Leave it 0 when
+# clients connect directly, or they could pick their own address.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS,
+                            x_host=TRUSTED_PROXY_HOPS)
+
 # Import routes after app creation to avoid circular imports
 from routes import *
 
+# Optional timing layer and /metrics endpoint (METRICS_ENABLED=1); a no-op when off
+from instrumentation import init_app as init_instrumentation
+init_instrumentation(app, data_store)
+
+# {% cache %} fragments keyed on data versions, with every template compiled at startup
+from fragments import init_app as init_fragments
+init_fragments(app)
+
+# Fingerprinted, minified and precompressed static files with immutable caching (ASSETS_ENABLED=0 turns off)
+from assets import init_app as init_assets
+init_assets(app)
+
+# Token-bucket limits and load shedding on write endpoints (RATE_LIMIT_ENABLED=0 turns them off)
+from ratelimit import init_app as init_rate_limits
+init_rate_limits(app, identify=token_auth.customer_id)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
 
@@ -0,0 +1,265 @@
+"""Static asset pipeline: fingerprint, minify, precompress and serve with immutable caching.
+
+build() copies every file under static/ into static/dist/ under a
+content-hashed name (css/style.3f9c2a1b7e.css). Along the way it minifies
+CSS and JS, rewrites url(...) references in CSS to the hashed names, writes
+.gz (and .br when the brotli package is installed) variants of text
+assets, and adds a resized WebP variant of the hero image when Pillow is
+installed. A manifest.json maps logical names to the built ones.
+
+init_app() runs the build at startup, points url_for('static', ...) at
+the hashed files, and serves them with immutable Cache-Control. It picks
+the smallest variant the client accepts. Files that weren't built fall
+through to Flask's normal static handling. ASSETS_ENABLED=0 turns all of
+this off.
+
+    python assets.py        # build ahead of time, e.g. in a Docker image
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import request, send_from_directory
+
+import startup
+
+# Optional: only gzip variants without it
+brotli = startup.optional_import("brotli")
+
+# Optional: no WebP hero without it
+Image = startup.optional_import("PIL.Image")
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+# Images that also get a WebP variant, resized to at most this many pixels wide
+WEBP_IMAGES = {"brand/hero.jpg": 1600}
+
+# Serving order when the client accepts several encodings
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*.*?\*/)|([^"\'/]+|/)', re.S)
+_CSS_URL = re.compile(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)')
+
+
+def minify_css(text):
+    """Drop comments and redundant whitespace; quoted strings are left untouched"""
+    out, code = [], []
+
+    def flush():
+        chunk = re.sub(r"\s+", " ", "".join(code))
+        chunk = re.sub(r"\s*([{};,>])\s*", r"\1", chunk)
+        # Only after a colon: a space before one can be a descendant selector (".card :hover")
+        out.append(re.sub(r":\s+", ":", chunk))
+        code.clear()
+
+    for string, comment, other in _CSS_TOKENS.findall(text):
+        if string:
+            flush()
+            out.append(string)
+        elif other:
+            code.append(other)
+    flush()
+    return "".join(out).replace(";}", "}").strip()
+
+
+def minify_js(text):
+    """Conservative JS minifier: strips indentation, blank lines and whole-line comments only"""
+    lines = []
+    in_block_comment = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if in_block_comment:
+            in_block_comment = "*/" not in stripped
+            continue
+        if stripped.startswith("/*"):
+            in_block_comment = "*/" not in stripped
+            continue
+        if not stripped or stripped.startswith("//"):
+            continue
+        lines.append(stripped)
+    return "\n".join(lines) + "\n"
+
+
+def _fingerprinted(path, content):
+    root, ext = posixpath.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:10]}{ext}"
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _write_variants(path, content):
+    """Precompressed siblings, kept only when they actually save bytes"""
+    gz = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(gz) < len(content):
+        _write(path + ".gz", gz)
+    if brotli is not None:
+        br = brotli.compress(content, quality=11)
+        if len(br) < len(content):
+            _write(path + ".br", br)
+
+
+def _webp(content, max_width):
+    image = Image.open(io.BytesIO(content))
+    if image.width > max_width:
+        image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, "WEBP", quality=80, method=6)
+    return out.getvalue()
+
+
+def build(static_folder):
+    """Build static/dist and return the manifest {logical path: built path}"""
+    dist = os.path.join(static_folder, DIST)
+    sources = []
+    for directory, subdirs, files in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder):
+            subdirs[:] = [d for d in subdirs if d != DIST]
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(directory, name), static_folder).replace(os.sep, "/")
+            sources.append(path)
+
+    # CSS goes last so its url(...) references can point at already-hashed files
+    sources.sort(key=lambda path: path.endswith(".css"))
+    manifest, webp = {}, {}
+    # Per-process scratch names: several gunicorn workers may build at once
+    built = os.path.join(static_folder, f"{DIST}.tmp{os.getpid()}")
+    shutil.rmtree(built, ignore_errors=True)
+
+    for path in sources:
+        with open(os.path.join(static_folder, path), "rb") as f:
+            content = f.read()
+        ext = posixpath.splitext(path)[1].lower()
+        if ext == ".css":
+            content = minify_css(_rewrite_css_urls(content.decode("utf-8"), path, manifest)).encode("utf-8")
+        elif ext == ".js":
+            content = minify_js(content.decode("utf-8")).encode("utf-8")
+
+        target = _fingerprinted(path, content)
+        manifest[path] = target
+        _write(os.path.join(built, target), content)
+        if ext in COMPRESSIBLE:
+            _write_variants(os.path.join(built, target), content)
+        if path in WEBP_IMAGES and Image is not None:
+            webp_content = _webp(content, WEBP_IMAGES[path])
+            if len(webp_content) < len(content):
+                # Stored beside the hashed original and chosen per request by Accept
+                _write(os.path.join(built, target + ".webp"), webp_content)
+                webp[target] = target + ".webp"
+
+    _write(os.path.join(built, MANIFEST), json.dumps({"files": manifest, "webp": webp}, indent=2).encode())
+    # Swap the finished build in whole so a running server never sees half of it
+    old = os.path.join(static_folder, f"{DIST}.old{os.getpid()}")
+    try:
+        if os.path.exists(dist):
+            os.replace(dist, old)
+        os.replace(built, dist)
+    except OSError:
+        # Another worker swapped its build in first; names are content hashes, so it's the same
+        shutil.rmtree(built, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def _rewrite_css_urls(text, css_path, manifest):
+    base = posixpath.dirname(css_path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return match.group(0)
+        target = manifest.get(posixpath.normpath(posixpath.join(base, url)))
+        if target is None:
+            return match.group(0)
+        # The built CSS sits in the same relative layout, so keep the reference relative
+        return f"url({quote}{posixpath.relpath(target, base)}{quote})"
+
+    return _CSS_URL.sub(replace, text)
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def init_app(app, enabled=None, build_on_startup=None):
+    """Serve fingerprinted assets; returns the manifest, or None when disabled or not built"""
+    if enabled is None:
+        enabled = os.environ.get("ASSETS_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+    if build_on_startup is None:
+        # Off by default under STARTUP_PROFILE=lean, which expects a prebuilt dist/
+        build_on_startup = startup.flag("ASSETS_BUILD_ON_STARTUP")
+    if not enabled:
+        return None
+
+    static_folder = app.static_folder
+    if build_on_startup:
+        try:
+            build(static_folder)
+        except OSError as e:
+            # e.g. a read-only checkout: use a prebuilt dist/ if there is one
+            logging.warning("Static asset build failed: %s", e)
+    manifest = load_manifest(static_folder)
+    if manifest is None:
+        return None
+    files, webp = manifest["files"], manifest["webp"]
+    built = set(files.values())
+    dist = os.path.join(static_folder, DIST)
+
+    @app.url_defaults
+    def _fingerprint_static(endpoint, values):
+        if endpoint == "static" and values.get("filename") in files:
+            values["filename"] = f"{DIST}/{files[values['filename']]}"
+
+    original_static = app.view_functions["static"]
+
+    def static(filename):
+        name = filename[len(DIST) + 1:] if filename.startswith(DIST + "/") else None
+        if name not in built:
+            return original_static(filename=filename)
+
+        served, encoding, mimetype = name, None, None
+        if name in webp and "image/webp" in request.headers.get("Accept", ""):
+            served, mimetype = webp[name], "image/webp"
+        else:
+            for candidate, suffix in ENCODINGS:
+                if candidate in request.accept_encodings and os.path.exists(os.path.join(dist, name + suffix)):
+                    served, encoding = name + suffix, candidate
+                    break
+
+        # Typed after the logical file, not the .gz/.br on disk
+        response = send_from_directory(dist, served, max_age=31536000,
+                                       mimetype=mimetype or mimetypes.guess_type(name)[0])
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        response.headers["Vary"] = "Accept" if name in webp else "Accept-Encoding"
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    app.view_functions["static"] = static
+    app.extensions["assets"] = manifest
+    return manifest
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    for logical, built_name in build(os.path.join(here, "static")).items():
+        print(f"{logical} -> {DIST}/{built_name}")
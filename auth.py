@@ -0,0 +1,108 @@
+"""Who is making the request: a bearer token for API clients, the session cookie for the web UI.
+
+Tokens are stateless: "<customer_id>.<expiry>.<signature>" signed with
+HMAC-SHA256 under the app's secret key, so any worker can check one
+without a lookup. A verified token is remembered for a short while
+(at most until it expires), so repeat requests from the same client skip
+the HMAC.
+
+    @app.route('/api/thing', methods=['POST'])
+    @login_required(token_auth)
+    def thing():
+        g.customer ...
+
+The customer is resolved once per request and kept on `g`.
+"""
+from collections import OrderedDict
+import base64
+import functools
+import hashlib
+import hmac
+import threading
+import time
+
+from flask import flash, g, jsonify, redirect, request, session, url_for
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+class TokenAuth:
+    def __init__(self, store, secret, ttl=3600, cache_ttl=60, cache_size=10000):
+        self.store = store
+        self._key = hashlib.sha256(f"api-token:{secret}".encode()).digest()
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._verified = OrderedDict()   # token -> (customer_id, remember until)
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self._key, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, customer_id):
+        """A fresh token for `customer_id`; returns (token, seconds until it expires)"""
+        payload = f"{customer_id}.{int(time.time()) + self.ttl}"
+        return f"{payload}.{self._sign(payload)}", self.ttl
+
+    def verify(self, token):
+        """The customer id a valid, unexpired token was issued for, else None"""
+        now = time.time()
+        with self._lock:
+            cached = self._verified.get(token)
+            if cached and cached[1] > now:
+                return cached[0]
+
+        payload, _, signature = token.rpartition(".")
+        customer_id, _, expires = payload.rpartition(".")
+        if not customer_id or not expires.isdigit() or int(expires) <= now:
+            return None
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+
+        with self._lock:
+            self._verified[token] = (customer_id, min(now + self.cache_ttl, int(expires)))
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return customer_id
+
+    def customer_id(self):
+        """The caller's customer id (bearer token first, then session), worked out once per request"""
+        if "customer_id" not in g:
+            scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                g.customer_id = self.verify(token.strip())
+            else:
+                g.customer_id = session.get("customer_id")
+        return g.customer_id
+
+    def customer(self):
+        """The caller's customer record, or None; loaded at most once per request"""
+        if "customer" not in g:
+            customer_id = self.customer_id()
+            g.customer = self.store.get_customer(customer_id) if customer_id else None
+        return g.customer
+
+
+def login_required(auth, page=False):
+    """Route decorator: load the caller into g.customer / g.customer_id or turn them away.
+
+    Pages redirect to the landing page; everything else gets a JSON 401
+    (or 404 if the customer no longer exists).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not auth.customer_id():
+                if page:
+                    return redirect(url_for('index'))
+                return jsonify({'success': False, 'message': 'Not logged in'}), 401
+            if not auth.customer():
+                if page:
+                    flash('Customer not found', 'error')
+                    return redirect(url_for('index'))
+                return jsonify({'success': False, 'message': 'Customer not found'}), 404
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
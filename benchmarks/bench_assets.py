@@ -0,0 +1,87 @@
+"""Bytes transferred per page view for the app's own static assets, with the asset pipeline off vs on.
+
+For each page, a first view downloads the HTML and every /static asset it
+references. A repeat view models a browser with a warm cache. Assets
+served with max-age are not requested again. Anything else is revalidated
+with If-None-Match, which costs a round trip and a 304. Bytes are body
+plus response headers. CDN assets (Bootstrap, Font Awesome) are not
+counted.
+
+Run from the repository root:
+    python benchmarks/bench_assets.py
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+PAGES = ["/", "/dashboard", "/rewards", "/leaderboard", "/transaction_history"]
+ASSET_URL = re.compile(r'(?:href|src)="(/static/[^"]+)"')
+REQUEST_HEADERS = {"Accept-Encoding": "gzip, br", "Accept": "image/webp,image/*,*/*"}
+
+
+def response_bytes(response):
+    headers = sum(len(key) + len(value) + 4 for key, value in response.headers.items())
+    return len(response.get_data()) + headers
+
+
+def measure():
+    sys.path.insert(0, ROOT)
+    from app import app
+
+    logging.disable(logging.CRITICAL)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["customer_id"] = "1"
+
+    results = {}
+    for page in PAGES:
+        html = client.get(page, headers=REQUEST_HEADERS)
+        first = repeat = response_bytes(html)
+        repeat_requests = 0
+        for url in dict.fromkeys(ASSET_URL.findall(html.get_data(as_text=True))):
+            asset = client.get(url, headers=REQUEST_HEADERS)
+            first += response_bytes(asset)
+            if "max-age" not in asset.headers.get("Cache-Control", ""):
+                revalidated = client.get(url, headers=dict(REQUEST_HEADERS, **{"If-None-Match": asset.headers.get("ETag", "")}))
+                repeat += response_bytes(revalidated)
+                repeat_requests += 1
+                revalidated.close()
+            asset.close()
+        results[page] = {"first_view_bytes": first, "repeat_view_bytes": repeat, "repeat_view_requests": repeat_requests}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure()))
+        return
+
+    # Each mode runs in its own process so the app is configured from scratch
+    runs = {}
+    for mode, enabled in (("off", "0"), ("on", "1")):
+        env = dict(os.environ, ASSETS_ENABLED=enabled, RATE_LIMIT_ENABLED="0")
+        output = subprocess.run([sys.executable, __file__, "--child"], env=env, cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        runs[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'page':22s} {'first view (off/on)':>24s} {'repeat view (off/on)':>24s} {'repeat requests':>16s}")
+    for page in PAGES:
+        off, on = runs["off"][page], runs["on"][page]
+        print(f"{page:22s} {off['first_view_bytes']:>11,} / {on['first_view_bytes']:<10,} "
+              f"{off['repeat_view_bytes']:>11,} / {on['repeat_view_bytes']:<10,} "
+              f"{off['repeat_view_requests']:>7} / {on['repeat_view_requests']:<6}")
+
+
+if __name__ == "__main__":
+    main()
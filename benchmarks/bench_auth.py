@@ -0,0 +1,98 @@
+"""Per-request cost of working out who the caller is: session cookie vs bearer token.
+
+Two measurements:
+
+* the auth step on its own: decoding and verifying the session cookie,
+  and checking a bearer token with and without the verified-token cache;
+* whole requests to a minimal route behind login_required, through the
+  Flask test client. Anonymous requests to the same route with no auth
+  are the baseline.
+
+Run from the repository root:
+    python benchmarks/bench_auth.py --requests 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g  # noqa: E402
+
+from auth import TokenAuth, login_required  # noqa: E402
+from models import DataStore  # noqa: E402
+
+
+def per_call_us(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def make_app(store, cache_ttl):
+    app = Flask("bench_auth")
+    app.secret_key = "bench-secret"
+    auth = TokenAuth(store, app.secret_key, cache_ttl=cache_ttl)
+
+    @app.route("/open")
+    def open_route():
+        return "ok"
+
+    @app.route("/me")
+    @login_required(auth)
+    def me():
+        return g.customer["id"]
+
+    return app, auth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    count = args.requests
+
+    store = DataStore()
+    app, auth = make_app(store, cache_ttl=60)
+    uncached_app, uncached_auth = make_app(store, cache_ttl=0)
+    token, _ = auth.issue("1")
+
+    # The auth step alone
+    session_client = app.test_client()
+    with session_client.session_transaction() as session:
+        session["customer_id"] = "1"
+    cookie = session_client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value
+    serializer = app.session_interface.get_signing_serializer(app)
+    print(f"{'auth step':36s} {'us/call':>8s}")
+    print(f"{'session cookie decode + verify':36s} {per_call_us(lambda: serializer.loads(cookie), count):8.2f}")
+    print(f"{'bearer token, HMAC every call':36s} {per_call_us(lambda: uncached_auth.verify(token), count):8.2f}")
+    print(f"{'bearer token, verified-token cache':36s} {per_call_us(lambda: auth.verify(token), count):8.2f}")
+
+    # Whole requests
+    bearer = {"Authorization": f"Bearer {token}"}
+    anonymous = app.test_client()
+    uncached_client = uncached_app.test_client()
+    cases = [
+        ("no auth (baseline)", lambda: anonymous.get("/open")),
+        ("session cookie", lambda: session_client.get("/me")),
+        ("bearer, HMAC every request", lambda: uncached_client.get("/me", headers=bearer)),
+        ("bearer, cached", lambda: anonymous.get("/me", headers=bearer)),
+    ]
+    for _, call in cases:
+        assert call().status_code == 200
+    # Cases take turns over several rounds and keep their best, so drift hits them all alike
+    best = {name: float("inf") for name, _ in cases}
+    for _ in range(args.rounds):
+        for name, call in cases:
+            best[name] = min(best[name], per_call_us(call, count // args.rounds))
+    baseline = best[cases[0][0]]
+    print(f"\n{'request':36s} {'us/req':>8s} {'auth us':>8s}")
+    for name, _ in cases:
+        print(f"{name:36s} {best[name]:8.1f} {best[name] - baseline:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
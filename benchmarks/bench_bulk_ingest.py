@@ -0,0 +1,78 @@
+"""Compare remittance throughput: one /process_remittance POST per row vs /api/remittances/bulk.
+
+Run from the repository root:
+    python benchmarks/bench_bulk_ingest.py --rows 5000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PARTNER_API_KEY", "bench-key")
+# The one-POST-per-row baseline would trip per-customer velocity limits
+os.environ.setdefault("VELOCITY_ENABLED", "0")
+
+from app import app  # noqa: E402
+from models import data_store  # noqa: E402
+
+COUNTRIES = ["ZW", "KE", "ZM", "MZ", "MW", "GH"]
+
+
+def make_rows(count, seed=1):
+    rng = random.Random(seed)
+    customer_ids = [customer["id"] for customer in data_store.get_all_customers()]
+    return [
+        {
+            "customer_id": rng.choice(customer_ids),
+            "amount": rng.randrange(50, 5000),
+            "recipient": f"Recipient {i}",
+            "destination_country": rng.choice(COUNTRIES),
+        }
+        for i in range(count)
+    ]
+
+
+def bench_single(client, rows):
+    start = time.perf_counter()
+    for row in rows:
+        with client.session_transaction() as session:
+            session["customer_id"] = row["customer_id"]
+        client.post("/process_remittance", data=row)
+    return time.perf_counter() - start
+
+
+def bench_bulk(client, rows, ndjson):
+    headers = {"X-API-Key": os.environ["PARTNER_API_KEY"]}
+    start = time.perf_counter()
+    if ndjson:
+        body = "\n".join(json.dumps(row) for row in rows)
+        client.post("/api/remittances/bulk", data=body, content_type="application/x-ndjson", headers=headers)
+    else:
+        client.post("/api/remittances/bulk", json=rows, headers=headers)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    client = app.test_client()
+    rows = make_rows(args.rows)
+
+    results = {
+        "single": bench_single(client, rows),
+        "bulk_json": bench_bulk(client, rows, ndjson=False),
+        "bulk_ndjson": bench_bulk(client, rows, ndjson=True),
+    }
+    for name, seconds in results.items():
+        print(f"{name:12s} {args.rows / seconds:12.0f} rows/s  ({seconds:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Pending-collection lookups, claims and expiry sweeps as the ledger grows.
+
+--entries collections are spread over --recipients recipients, with a
+share already collected. Three setups answer a recipient's first page
+of pending entries and a claim:
+
+* linear scan: one list, filtered by recipient and status per request,
+  as a plain list-backed ledger would;
+* DataStore: the ledger's (recipient, status) index;
+* SQLDataStore on SQLite, through the (recipient_key, status, timestamp)
+  index.
+
+Also reports one sweep that expires --expiring entries out of the whole
+ledger.
+
+Run from the repository root:
+    python benchmarks/bench_collections.py --entries 200000 --recipients 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import DataStore  # noqa: E402
+from records import now_us  # noqa: E402
+from sql_store import SQLDataStore  # noqa: E402
+
+
+def per_call_us(fn, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def fill(store, args, rng):
+    expiring = set(rng.sample(range(args.entries), args.expiring))
+    entries = []
+    for i in range(args.entries):
+        entry = store.add_collection(f"r{rng.randrange(args.recipients)}", "money", f"Sender {i}",
+                                     amount=100, ttl=0 if i in expiring else 3600)
+        entries.append(entry)
+    for entry in rng.sample(entries, args.entries // 4):
+        store.claim_collection(entry["id"], [entry["recipient_key"]])
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=200000)
+    parser.add_argument("--recipients", type=int, default=20000)
+    parser.add_argument("--expiring", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    lookups = [([f"r{rng.randrange(args.recipients)}"],) for _ in range(args.lookups)]
+
+    print(f"{'setup':16s} {'fill s':>8s} {'page us':>10s} {'claim us':>10s} {'sweep ms':>10s}")
+    for name in ("linear scan", "DataStore", "SQLite"):
+        store = SQLDataStore("sqlite://", seed=False) if name == "SQLite" else DataStore(sample_customers=False)
+        began = time.perf_counter()
+        entries = fill(store, args, random.Random(2))
+        filled = time.perf_counter() - began
+
+        if name == "linear scan":
+            def page(ids, entries=entries):
+                rows = [entry for entry in entries
+                        if entry["recipient_key"] in ids and entry["status"] == "pending"]
+                return rows[:10], len(rows)
+
+            def claim(collection_id, ids, entries=entries):
+                for entry in entries:
+                    if entry["id"] == collection_id and entry["recipient_key"] in ids and entry["status"] == "pending":
+                        entry["status"] = "collected"
+                        return entry
+                return None
+
+            def sweep(now, entries=entries):
+                due = [entry for entry in entries if entry["status"] == "pending" and entry.expires_us <= now]
+                for entry in due:
+                    entry["status"] = "expired"
+                return len(due)
+        else:
+            def page(ids, store=store):
+                return store.get_pending_collections(ids, 0, 10)
+            claim, sweep = store.claim_collection, store.expire_collections
+        page_us = per_call_us(page, lookups)
+
+        claims = []
+        for (ids,) in lookups:
+            rows, _ = page(ids)
+            if rows:
+                claims.append((rows[0]["id"], ids))
+        claim_us = per_call_us(claim, claims)
+
+        began = time.perf_counter()
+        sweep(now_us())
+        sweep_ms = (time.perf_counter() - began) * 1000
+        print(f"{name:16s} {filled:8.2f} {page_us:10.1f} {claim_us:10.1f} {sweep_ms:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Journal write throughput (group commit) and recovery time for the in-memory DataStore.
+
+Run from the repository root:
+    python benchmarks/bench_journal.py --writes 20000 --threads 16
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import DataStore  # noqa: E402
+
+
+def write_load(store, writes, threads):
+    def one(i):
+        customer_id = str(i % 3 + 1)
+        store.add_transaction(customer_id, 250.0, "Recipient", 2, "ZW")
+        store.update_customer_points(customer_id, 2)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(writes)))
+    return time.perf_counter() - start
+
+
+def bench_writes(writes, threads, commit_delay):
+    directory = tempfile.mkdtemp()
+    try:
+        store = DataStore.open(directory, snapshot_interval=0, commit_delay=commit_delay)
+        seconds = write_load(store, writes, threads)
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+    # Each iteration journals two records
+    return 2 * writes / seconds
+
+
+def bench_recovery(writes, tail_fraction):
+    directory = tempfile.mkdtemp()
+    try:
+        store = DataStore.open(directory, snapshot_interval=0)
+        snapshot_at = int(writes * (1 - tail_fraction))
+        write_load(store, snapshot_at, threads=8)
+        if snapshot_at:
+            store.snapshot()
+        write_load(store, writes - snapshot_at, threads=8)
+        store.close()
+
+        start = time.perf_counter()
+        recovered = DataStore.open(directory, snapshot_interval=0)
+        seconds = time.perf_counter() - start
+        assert len(recovered.transactions) == writes
+        recovered.close()
+    finally:
+        shutil.rmtree(directory)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writes", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    print("write throughput (durable, journal records/s)")
+    for threads in (1, args.threads):
+        for delay in (0.0, 0.001):
+            rate = bench_writes(args.writes, threads, delay)
+            print(f"  threads={threads:<3d} commit_delay={delay:<6} {rate:10.0f}")
+
+    print("recovery time")
+    for tail in (1.0, 0.1, 0.0):
+        seconds = bench_recovery(args.writes, tail)
+        print(f"  tail={tail:<4.0%} of journal after snapshot  {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Points rules: per-request lookup cost and bulk re-scoring throughput.
+
+Generates --campaigns random campaigns (corridor, tier and time-window
+filters with multipliers or bonuses), then measures:
+
+* one remittance priced from the compiled table vs by checking every
+  campaign in turn;
+* re-scoring --rows historical transactions with score_batch(), in a
+  Python loop and with NumPy (if installed).
+
+Run from the repository root:
+    python benchmarks/bench_points_rules.py --rows 1000000 --campaigns 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import points_rules  # noqa: E402
+from points_rules import Campaign, RuleSet  # noqa: E402
+
+COUNTRIES = ["ZW", "KE", "ZM", "MZ", "MW", "GH", "UG", "TZ", "BW", "LS"]
+DAY_US = 86400 * 1_000_000
+NOW_US = 1_800_000_000_000_000
+
+
+def make_campaigns(count, rng):
+    campaigns = []
+    for i in range(count):
+        starts = NOW_US - rng.randrange(0, 365) * DAY_US
+        campaigns.append(Campaign(
+            name=f"campaign {i}",
+            multiplier=rng.choice([1.0, 1.1, 1.25, 1.5, 2.0]),
+            bonus=rng.choice([0, 0, 5, 10]),
+            countries=frozenset(rng.sample(COUNTRIES, rng.randrange(1, 4))) if rng.random() < 0.8 else None,
+            tiers=frozenset(rng.sample(points_rules.TIERS, rng.randrange(1, 3))) if rng.random() < 0.5 else None,
+            starts_us=starts,
+            ends_us=starts + rng.randrange(7, 120) * DAY_US,
+        ))
+    return campaigns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    rules = RuleSet(make_campaigns(args.campaigns, rng))
+
+    # Per-request path
+    requests = [(rng.randrange(50, 20000), rng.choice(COUNTRIES), rng.choice(points_rules.TIERS))
+                for _ in range(1000)]
+    rules.points(100, "ZW", "Bronze", at_us=NOW_US)
+    print(f"{'per request':32s} {'us/call':>8s}")
+    for name, price in (
+        ("compiled table", lambda a, c, t: rules.points(a, c, t, at_us=NOW_US)),
+        ("check every campaign", lambda a, c, t: points_rules._apply(
+            points_rules.base_points(a), *rules._effect_at(c, t, NOW_US))),
+    ):
+        start = time.perf_counter()
+        for i in range(args.lookups):
+            price(*requests[i % len(requests)])
+        print(f"{name:32s} {(time.perf_counter() - start) / args.lookups * 1e6:8.2f}")
+
+    # Bulk re-scoring
+    amounts = [rng.randrange(50, 20000) for _ in range(args.rows)]
+    countries = [rng.choice(COUNTRIES) for _ in range(args.rows)]
+    tiers = [rng.choice(points_rules.TIERS) for _ in range(args.rows)]
+    created = [NOW_US - rng.randrange(0, 365 * DAY_US) for _ in range(args.rows)]
+    print(f"\n{'re-score ' + format(args.rows, ','):32s} {'seconds':>8s} {'rows/s':>12s}")
+    modes = [("python loop", False)] + ([("numpy", True)] if points_rules.np is not None else [])
+    results = {}
+    for name, use_numpy in modes:
+        start = time.perf_counter()
+        results[name] = rules.score_batch(amounts, countries, tiers, created, use_numpy=use_numpy)
+        elapsed = time.perf_counter() - start
+        print(f"{name:32s} {elapsed:8.2f} {args.rows / elapsed:12,.0f}")
+    if len(results) == 2:
+        assert results["python loop"] == results["numpy"]
+    else:
+        print("(NumPy not installed: vectorized mode skipped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Tail latency of normal /process_remittance traffic during a request flood.
+
+Models a server with a fixed pool of worker threads. Requests queue for a
+worker, and the time they spent waiting is passed in X-Request-Start the
+way a proxy would stamp it. Accepted writes hold their worker for an extra
+--work-ms to stand in for downstream I/O. Rejected requests return at once.
+
+Paced "normal" customers run alongside an open-loop flood offered at a
+fixed rate, above what the workers can serve at --work-ms. The normal
+customers' latency is measured with no flood and during the flood, with
+the limiter and load shedder off and then on.
+
+Run from the repository root:
+    python benchmarks/bench_rate_limit.py --duration 10 --flood-rate 1000
+    python benchmarks/bench_rate_limit.py --flood-customers 200   # flood spread over many buckets: shedding takes over
+"""
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+os.environ["RATE_LIMIT_ENABLED"] = "1"
+# Only the rate limiter is under test; velocity limits would reject the flood for their own reasons
+os.environ["VELOCITY_ENABLED"] = "0"
+
+from seed import seed_store  # noqa: E402
+from bench_routes import percentile  # noqa: E402
+
+FORM = {"amount": "500", "recipient": "Recipient", "destination_country": "ZW"}
+
+
+def logged_in_client(app, customer_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["customer_id"] = customer_id
+    return client
+
+
+def run_phase(app, pool, args, normal_ids, flood_ids, flood):
+    stop = threading.Event()
+    normal_latencies, normal_status, flood_status = [], Counter(), Counter()
+
+    def serve(client, enqueued):
+        if stop.is_set():
+            return None   # phase over: drain the backlog without running it
+        response = client.post("/process_remittance", data=FORM,
+                               headers={"X-Request-Start": f"t={int(enqueued * 1e6)}"})
+        if response.status_code == 200:
+            time.sleep(args.work_ms / 1000)
+        return response.status_code
+
+    def normal_user(customer_id):
+        client = logged_in_client(app, customer_id)
+        while not stop.is_set():
+            enqueued = time.time()
+            status = pool.submit(serve, client, enqueued).result()
+            if status is None:
+                break
+            normal_latencies.append(time.time() - enqueued)
+            normal_status[status] += 1
+            stop.wait(args.think)
+
+    def count_flood(future):
+        if future.result() is not None:
+            flood_status[future.result()] += 1
+
+    def flooder():
+        # Open loop: a flood doesn't slow down because the server does
+        clients = [logged_in_client(app, customer_id) for customer_id in flood_ids]
+        interval = 1 / args.flood_rate
+        next_at = time.perf_counter()
+        i = 0
+        while not stop.is_set():
+            pool.submit(serve, clients[i % len(clients)], time.time()).add_done_callback(count_flood)
+            i += 1
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    threads = [threading.Thread(target=normal_user, args=(customer_id,)) for customer_id in normal_ids]
+    if flood:
+        threads.append(threading.Thread(target=flooder))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(normal_latencies)
+    return {
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "normal_ok": normal_status[200] / max(1, sum(normal_status.values())),
+        "flood_rps": sum(flood_status.values()) / args.duration,   # requests served, not offered
+        "flood_status": dict(flood_status),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=10, help="seconds per phase")
+    parser.add_argument("--workers", type=int, default=4, help="simulated server worker threads")
+    parser.add_argument("--work-ms", type=float, default=5, help="extra time an accepted write holds its worker")
+    parser.add_argument("--users", type=int, default=32, help="paced normal customers")
+    parser.add_argument("--think", type=float, default=1.0, help="seconds between a normal customer's requests")
+    parser.add_argument("--flood-rate", type=float, default=1000, help="flood requests offered per second")
+    parser.add_argument("--flood-customers", type=int, default=1, help="customers the flood is spread over")
+    parser.add_argument("--max-queue-wait", type=float, default=0.05, help="shed writes queued longer than this")
+    args = parser.parse_args()
+
+    from app import app
+    from models import data_store
+
+    logging.disable(logging.CRITICAL)
+    customer_ids = seed_store(data_store, args.users + args.flood_customers, 0)
+    normal_ids, flood_ids = customer_ids[:args.users], customer_ids[args.users:]
+
+    limiter = app.extensions["rate_limiter"]
+    limits = limiter.limits
+    limiter.shedder.max_queue_wait = args.max_queue_wait
+
+    print(f"{'limiter':8s} {'phase':9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'ok %':>6s} {'flood req/s':>12s}  flood status")
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for mode in ("off", "on"):
+            # "off" leaves the hooks installed but limits no endpoint, so nothing is limited or shed
+            limiter.limits = limits if mode == "on" else {}
+            for phase in ("baseline", "flood"):
+                r = run_phase(app, pool, args, normal_ids, flood_ids, flood=phase == "flood")
+                print(f"{mode:8s} {phase:9s} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+                      f"{r['normal_ok'] * 100:6.1f} {r['flood_rps']:12.0f}  {r['flood_status']}")
+
+
+if __name__ == "__main__":
+    main()
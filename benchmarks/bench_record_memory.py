@@ -0,0 +1,66 @@
+"""Memory per transaction: the old 10-key dict vs the slotted Transaction record.
+
+Run from the repository root:
+    python benchmarks/bench_record_memory.py --count 200000
+"""
+import argparse
+from datetime import datetime
+import os
+import sys
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Transaction, new_uuid_int, now_us  # noqa: E402
+
+
+def make_dict(i):
+    return {
+        "id": str(uuid.uuid4()),
+        "customer_id": str(i % 1000),
+        "amount": 100.0 + i,
+        "recipient": "Recipient",
+        "points_earned": i % 50,
+        "destination_country": "ZW",
+        "verification_method": None,
+        "verification_value": None,
+        "timestamp": datetime.now().isoformat(),
+        "type": "remittance"
+    }
+
+
+def make_record(i):
+    return Transaction(
+        uuid_int=new_uuid_int(),
+        customer_id=str(i % 1000),
+        amount=100.0 + i,
+        recipient="Recipient",
+        points_earned=i % 50,
+        destination_country="ZW",
+        created_us=now_us()
+    )
+
+
+def measure(factory, count):
+    tracemalloc.start()
+    items = [factory(i) for i in range(count)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return current / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200000)
+    args = parser.parse_args()
+
+    dict_bytes = measure(make_dict, args.count)
+    record_bytes = measure(make_record, args.count)
+    print(f"dict       {dict_bytes:8.0f} bytes/transaction")
+    print(f"Transaction{record_bytes:8.0f} bytes/transaction  ({record_bytes / dict_bytes:.0%} of dict)")
+
+
+if __name__ == "__main__":
+    main()
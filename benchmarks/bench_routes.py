@@ -0,0 +1,264 @@
+"""Latency, throughput and memory benchmark for the main Flask routes.
+
+Seeds the DataStore with synthetic customers and remittances, then drives
+each route either in-process through the Flask test client or over HTTP
+against a local gunicorn. Reports p50/p95/p99 latency, requests/s and
+memory per route, and can save or compare a JSON baseline.
+
+Run from the repository root:
+    python benchmarks/bench_routes.py --customers 10000 --transactions 100000
+    python benchmarks/bench_routes.py --mode gunicorn --workers 4 --threads 8
+    python benchmarks/bench_routes.py --save baseline.json
+    python benchmarks/bench_routes.py --compare baseline.json --tolerance 0.25
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.parse
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from seed import bench_email, seed_store  # noqa: E402
+
+# Benchmark clients hammer one customer per thread, so keep the per-customer rate and velocity limits out of the numbers
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("VELOCITY_ENABLED", "0")
+
+PASSWORD = "demo123"
+
+# name -> (method, path, form data factory)
+ROUTES = {
+    "login": ("POST", "/login", lambda rng, i: {"email": bench_email(i), "password": PASSWORD}),
+    "dashboard": ("GET", "/dashboard", None),
+    "process_remittance": ("POST", "/process_remittance", lambda rng, i: {
+        "amount": str(rng.randrange(100, 5000)), "recipient": "Recipient", "destination_country": "ZW"}),
+    "redeem_reward": ("POST", "/redeem_reward", lambda rng, i: {"reward_id": "1"}),
+    "leaderboard": ("GET", "/leaderboard", None),
+    "transaction_history": ("GET", "/transaction_history", None),
+    "rewards": ("GET", "/rewards", None),
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+# --- In-process (Flask test client) -------------------------------------------
+
+def run_client(args):
+    from app import app
+    from models import data_store
+
+    logging.disable(logging.CRITICAL)
+    started = time.perf_counter()
+    seed_store(data_store, args.customers, args.transactions)
+    print(f"seeded {args.customers} customers / {args.transactions} transactions "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    results = {}
+    for name in args.routes:
+        method, path, make_data = ROUTES[name]
+
+        def worker(thread_index, count):
+            # Each thread is one logged-in customer with its own cookie jar
+            rng = random.Random(thread_index)
+            client = app.test_client()
+            customer = thread_index % max(args.customers, 1)
+            client.post("/login", data={"email": bench_email(customer), "password": PASSWORD})
+            latencies = []
+            for i in range(count):
+                data = make_data(rng, customer) if make_data else None
+                start = time.perf_counter()
+                client.open(path, method=method, data=data)
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        # tracemalloc slows every allocation, so peak-allocation tracking is opt-in
+        if args.trace_memory:
+            tracemalloc.start()
+        elapsed, latencies = drive(worker, args.requests, args.threads)
+        memory = {"rss_kb": process_tree_rss_kb(os.getpid())}
+        if args.trace_memory:
+            memory["peak_alloc_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        results[name] = dict(summarize(latencies, elapsed), **memory)
+    return results
+
+
+# --- Over HTTP against gunicorn ----------------------------------------------
+
+def run_gunicorn(args):
+    env = dict(os.environ, BENCH_CUSTOMERS=str(args.customers), BENCH_TRANSACTIONS=str(args.transactions))
+    # --preload seeds once in the master so every worker forks with identical data
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--chdir", HERE, "--preload",
+         "--workers", str(args.workers), "--threads", str(args.threads),
+         "--bind", f"127.0.0.1:{args.port}", "--log-level", "warning", "seeded_app:app"],
+        env=env,
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_for_server(base, timeout=args.startup_timeout)
+        results = {}
+        for name in args.routes:
+            method, path, make_data = ROUTES[name]
+
+            def worker(thread_index, count):
+                rng = random.Random(thread_index)
+                opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+                customer = thread_index % max(args.customers, 1)
+                http_call(opener, base + "/login", {"email": bench_email(customer), "password": PASSWORD})
+                latencies = []
+                for i in range(count):
+                    data = make_data(rng, customer) if make_data else None
+                    start = time.perf_counter()
+                    http_call(opener, base + path, data if method == "POST" else None)
+                    latencies.append(time.perf_counter() - start)
+                return latencies
+
+            elapsed, latencies = drive(worker, args.requests, args.threads)
+            results[name] = dict(summarize(latencies, elapsed), rss_kb=process_tree_rss_kb(server.pid))
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def http_call(opener, url, form=None):
+    body = urllib.parse.urlencode(form).encode() if form is not None else None
+    try:
+        with opener.open(url, data=body, timeout=30) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        e.read()
+
+
+def wait_for_server(base, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base + "/demo", timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start within {timeout}s")
+
+
+def process_tree_rss_kb(pid):
+    """Resident memory of a process plus its children, e.g. gunicorn's workers (Linux /proc only)"""
+    total = 0
+    pids = [pid]
+    try:
+        children = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True).stdout.split()
+        pids += [int(child) for child in children]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+# --- Shared -------------------------------------------------------------------
+
+def drive(worker, requests, threads):
+    per_thread = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        chunks = list(pool.map(worker, range(threads), per_thread))
+    elapsed = time.perf_counter() - start
+    return elapsed, [latency for chunk in chunks for latency in chunk]
+
+
+def compare(results, baseline, tolerance):
+    """Print regressions of p95 latency or throughput beyond `tolerance`; returns True if any"""
+    regressed = False
+    for name, current in results.items():
+        previous = baseline["routes"].get(name)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            print(f"REGRESSION {name}: p95 {previous['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+            regressed = True
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            print(f"REGRESSION {name}: throughput {previous['throughput_rps']:.0f} -> {current['throughput_rps']:.0f} req/s")
+            regressed = True
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["client", "gunicorn"], default="client")
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per route")
+    parser.add_argument("--threads", type=int, default=4, help="client threads (and gunicorn threads per worker)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--routes", nargs="+", choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument("--trace-memory", action="store_true", help="also record peak Python allocations per route (slow)")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_client(args) if args.mode == "client" else run_gunicorn(args)
+
+    print(f"{'route':22s} {'req/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'RSS KB':>10s}")
+    for name, r in results.items():
+        print(f"{name:22s} {r['throughput_rps']:9.0f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} {r['rss_kb']:10.0f}")
+
+    report = {
+        "mode": args.mode,
+        "customers": args.customers,
+        "transactions": args.transactions,
+        "requests": args.requests,
+        "threads": args.threads,
+        "workers": args.workers if args.mode == "gunicorn" else None,
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "routes": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
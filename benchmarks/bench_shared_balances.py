@@ -0,0 +1,110 @@
+"""Balances across worker processes: per-process stores vs the shared balance table vs SQLite.
+
+Each of 1..--workers processes runs the same mix against --customers
+customers: mostly balance reads (get_customer), with --write-ratio of
+credits (update_customer_points). Three setups are compared:
+
+* per-process DataStore: fast, but each worker only sees its own
+  credits, which is the bug SHARED_BALANCES fixes;
+* DataStore over one BalanceTable file (SHARED_BALANCES);
+* SQLDataStore on a SQLite file (DATABASE_URL), a database round trip
+  per call.
+
+Reports aggregate ops/s and how many of all credits one worker can see.
+
+Run from the repository root:
+    python benchmarks/bench_shared_balances.py --workers 4 --ops 20000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import DataStore  # noqa: E402
+from records import Customer  # noqa: E402
+from shared_balances import BalanceTable  # noqa: E402
+
+
+def make_store(mode, path, ids):
+    if mode == "sqlite":
+        from sql_store import SQLDataStore
+        return SQLDataStore(f"sqlite:///{path}")
+    store = DataStore(balances=BalanceTable(path) if mode == "shared table" else None)
+    # Every worker knows the same customers, as if loaded from the same source
+    for customer_id in ids:
+        store.customers[customer_id] = Customer(id=customer_id, name=customer_id, email=f"{customer_id}@example.com")
+    store._rebuild_indexes()
+    return store
+
+
+def worker(mode, path, ids, ops, write_ratio, seed, start, results):
+    store = make_store(mode, path, ids)
+    rng = random.Random(seed)
+    plan = [(rng.choice(ids), rng.random() < write_ratio) for _ in range(ops)]
+    start.wait()
+    began = time.perf_counter()
+    credited = 0
+    for customer_id, write in plan:
+        if write:
+            store.update_customer_points(customer_id, 1)
+            credited += 1
+        else:
+            store.get_customer(customer_id)["points_balance"]
+    elapsed = time.perf_counter() - began
+    seen = sum(store.get_customer(customer_id)["points_balance"] for customer_id in ids)
+    results.put((ops / elapsed, credited, seen))
+
+
+def run(mode, workers, ops, args, directory):
+    path = os.path.join(directory, f"{mode.replace(' ', '-')}-{workers}")
+    ids = [f"c{i}" for i in range(args.customers)]
+    if mode == "sqlite":
+        # The customers are created once; the workers share the database
+        seeded = make_store(mode, path, ids)
+        ids = [seeded.add_customer(customer_id, f"{customer_id}@example.com")["id"] for customer_id in ids]
+    ctx = multiprocessing.get_context("fork")
+    start = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(mode, path, ids, ops, args.write_ratio, i, start, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    rate = sum(row[0] for row in rows)
+    credited = sum(row[1] for row in rows)
+    # Every balance started at 0, so a worker that sees all credits sees them summed
+    seen = max(row[2] for row in rows)
+    return rate, seen, credited
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=20000, help="operations per worker")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{'setup':22s} {'workers':>7s} {'ops/s':>10s} {'credits seen':>16s}")
+        for mode in ("per-process", "shared table", "sqlite"):
+            for workers in sorted({1, args.workers}):
+                # A round trip per call: a tenth of the operations keeps the run short
+                ops = args.ops // 10 if mode == "sqlite" else args.ops
+                rate, seen, credited = run(mode, workers, ops, args, directory)
+                print(f"{mode:22s} {workers:7d} {rate:10,.0f} {f'{seen}/{credited}':>16s}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
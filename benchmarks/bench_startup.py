@@ -0,0 +1,114 @@
+"""Cold start time per startup profile, and logging cost on the request thread per log format.
+
+* cold start: a fresh `python -c "import app"`, then its first request,
+  default profile vs STARTUP_PROFILE=lean. The median of --starts runs
+  is reported;
+* logging: the caller's cost per logging.error() with arguments, as
+  text written on the calling thread (logging.basicConfig, as before) vs
+  LOG_FORMAT=json through the queue. Output goes to a temp file, then
+  to a sink that blocks --slow-ms per write (a backed-up pipe to a log
+  collector). Also reports whole requests to a route that logs one line,
+  through the Flask test client, with logging disabled as the baseline.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py --starts 7 --calls 50000
+"""
+import argparse
+import io
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+
+import logging_setup  # noqa: E402
+
+COLD_START = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get("/")
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def cold_start(profile, runs):
+    env = dict(os.environ, STARTUP_PROFILE=profile, RATE_LIMIT_ENABLED="0")
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", COLD_START], cwd=ROOT, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append([float(value) for value in out.split()])
+    return [statistics.median(column) for column in zip(*samples)]
+
+
+class SlowSink(io.StringIO):
+    """A log destination that blocks on every write, like a full pipe to a log collector"""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return len(text)
+
+
+def per_call_us(fn, count):
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def make_app():
+    app = Flask("bench_startup")
+
+    @app.route("/fails/<int:n>")
+    def fails(n):
+        logging.error("Error processing remittance: %s", ValueError(f"bad amount {n}"))
+        return "", 204
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--starts", type=int, default=7)
+    parser.add_argument("--calls", type=int, default=50000)
+    parser.add_argument("--slow-ms", type=float, default=0.2, help="write latency of the slow sink")
+    args = parser.parse_args()
+
+    print(f"{'cold start (median)':24s} {'import s':>9s} {'+1st request s':>15s}")
+    for profile in ("default", "lean"):
+        imported, first = cold_start("" if profile == "default" else profile, args.starts)
+        print(f"{profile:24s} {imported:9.3f} {first:15.3f}")
+
+    client = make_app().test_client()
+    sinks = [("file", tempfile.TemporaryFile("w"), args.calls),
+             (f"{args.slow_ms} ms/write", SlowSink(args.slow_ms / 1000), args.calls // 25)]
+    for sink_name, sink, calls in sinks:
+        print(f"\n{'logging to ' + sink_name:24s} {'us/call':>9s} {'us/request':>15s}")
+        for name, fmt in (("off (baseline)", None), ("text, sync", "text"), ("json, queued", "json")):
+            if fmt is None:
+                logging.disable(logging.CRITICAL)
+            else:
+                logging.disable(logging.NOTSET)
+                logging_setup.configure("INFO", fmt, stream=sink, queue_size=calls * 2)
+            call = per_call_us(lambda i: logging.error("Error processing remittance: %s", i), calls)
+            request = per_call_us(lambda i: client.get(f"/fails/{i}"), calls // 5)
+            logging_setup._flush()
+            print(f"{name:24s} {call:9.2f} {request:15.1f}")
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Seed a DataStore with synthetic customers and remittances for benchmarks."""
+import random
+
+COUNTRIES = ["ZW", "KE", "ZM", "MZ", "MW", "GH", "UG", "TZ"]
+CHUNK = 10000
+
+
+def bench_email(i):
+    return f"bench{i}@example.com"
+
+
+def seed_store(store, customers, transactions, seed=1):
+    """Add `customers` customers and spread `transactions` remittances across them.
+
+    Returns the list of new customer ids. Uses add_transactions_bulk in chunks
+    so seeding millions of rows stays reasonably quick.
+    """
+    rng = random.Random(seed)
+    customer_ids = []
+    for i in range(customers):
+        customer = store.add_customer(f"Bench Customer {i}", bench_email(i), f"+2760{i:07d}")
+        customer_ids.append(customer["id"])
+    if not customer_ids:
+        return customer_ids
+
+    remaining = transactions
+    while remaining > 0:
+        size = min(CHUNK, remaining)
+        store.add_transactions_bulk([
+            {
+                "customer_id": rng.choice(customer_ids),
+                "amount": rng.randrange(100, 5000),
+                "recipient": "Recipient",
+                "destination_country": rng.choice(COUNTRIES),
+            }
+            for _ in range(size)
+        ])
+        remaining -= size
+    return customer_ids
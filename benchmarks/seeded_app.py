@@ -0,0 +1,21 @@
+"""WSGI entry point for benchmarking under gunicorn: the app plus a seeded DataStore.
+
+    BENCH_CUSTOMERS=10000 BENCH_TRANSACTIONS=100000 \
+        gunicorn --chdir benchmarks seeded_app:app
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app  # noqa: E402,F401
+from models import data_store  # noqa: E402
+from seed import seed_store  # noqa: E402
+
+seed_store(
+    data_store,
+    int(os.environ.get("BENCH_CUSTOMERS", 1000)),
+    int(os.environ.get("BENCH_TRANSACTIONS", 10000)),
+)
@@ -0,0 +1,62 @@
+from collections import namedtuple
+import hashlib
+import json
+import threading
+
+CatalogSnapshot = namedtuple("CatalogSnapshot", [
+    "version",      # store catalog version this snapshot was built from
+    "rewards",      # list of reward dicts
+    "categories",   # category -> list of rewards, in catalog order
+    "gifts",        # list of gift dicts
+    "gift_costs",   # gift id -> points cost
+    "payload",      # JSON body served by /api/catalog
+    "etag",
+])
+
+
+class CatalogCache:
+    """Derived views of the rewards and gift catalog.
+
+    Everything is rebuilt only when the store's catalog version changes,
+    so a page view costs one version check instead of copying and
+    regrouping the catalog. Snapshots are shared between requests and must
+    be treated as read-only.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = self.store.get_catalog_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._build(version)
+            return self._snapshot
+
+    def _build(self, version):
+        rewards = [dict(reward) for reward in self.store.get_all_rewards()]
+        gifts = [dict(gift) for gift in self.store.get_all_gifts()]
+
+        # Group rewards by category
+        categories = {}
+        for reward in rewards:
+            categories.setdefault(reward["category"], []).append(reward)
+
+        payload = json.dumps({"rewards": rewards, "gifts": gifts},
+                             separators=(",", ":"), sort_keys=True)
+        # Content hash rather than the version number, so every worker agrees on the tag
+        etag = hashlib.sha1(payload.encode()).hexdigest()
+        return CatalogSnapshot(
+            version=version,
+            rewards=rewards,
+            categories=categories,
+            gifts=gifts,
+            gift_costs={gift["id"]: gift["points_cost"] for gift in gifts},
+            payload=payload,
+            etag=etag,
+        )
@@ -0,0 +1,78 @@
+"""Per-customer change events for the live balance/leaderboard push channel.
+
+Stores publish "balance" and "transaction" events as writes happen. Only
+customers with an open channel (an SSE stream or a recent long-poll) keep
+events; for everyone else publish() is a dict lookup. Each channel has
+its own condition, so an event wakes that customer's listeners and no
+one else's.
+
+A channel outlives its last listener by `idle_ttl` seconds. That way a
+long-polling client, between two polls, doesn't miss events.
+"""
+from collections import deque
+import itertools
+import threading
+import time
+
+
+class _Channel:
+    __slots__ = ("cond", "events", "listeners", "idle_since")
+
+    def __init__(self, history):
+        self.cond = threading.Condition()
+        self.events = deque(maxlen=history)   # (seq, name, data), oldest first
+        self.listeners = 0
+        self.idle_since = None
+
+
+class EventBus:
+    def __init__(self, history=100, idle_ttl=60):
+        self.history = history
+        self.idle_ttl = idle_ttl
+        self._channels = {}
+        self._seq = itertools.count(1)
+        self._pruned = time.monotonic()
+        self._lock = threading.Lock()
+
+    def publish(self, customer_id, name, data=None):
+        channel = self._channels.get(customer_id)
+        if channel is None:
+            return
+        with channel.cond:
+            channel.events.append((next(self._seq), name, data))
+            channel.cond.notify_all()
+
+    def open(self, customer_id):
+        """Start listening for a customer; pair with close()"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._pruned > self.idle_ttl:
+                self._pruned = now
+                for key, idle in list(self._channels.items()):
+                    if idle.listeners == 0 and now - idle.idle_since > self.idle_ttl:
+                        del self._channels[key]
+            channel = self._channels.get(customer_id)
+            if channel is None:
+                channel = self._channels[customer_id] = _Channel(self.history)
+            channel.listeners += 1
+            return channel
+
+    def close(self, channel):
+        with self._lock:
+            channel.listeners -= 1
+            if channel.listeners == 0:
+                channel.idle_since = time.monotonic()
+
+    def cursor(self, channel):
+        """Seq of the channel's newest event, for listeners that only want what comes next"""
+        with channel.cond:
+            return channel.events[-1][0] if channel.events else 0
+
+    def wait(self, channel, after, timeout):
+        """Events newer than seq `after`, waiting up to `timeout` seconds for the first"""
+        with channel.cond:
+            channel.cond.wait_for(lambda: channel.events and channel.events[-1][0] > after, timeout)
+            return [event for event in channel.events if event[0] > after]
+
+    def __len__(self):
+        return len(self._channels)
@@ -0,0 +1,140 @@
+"""Fragment and page caching for the Jinja templates.
+
+Templates wrap slow-changing sections in a cache tag keyed on the data
+versions they depend on:
+
+    {% cache 'reward-grid', catalog_version, customer.points_balance %}
+        ...
+    {% endcache %}
+
+The first render of a key stores the HTML; later renders with the same key
+skip the block. A version moves whenever its data changes, so there is
+nothing to invalidate. If any key part is None (the backend can't tell a
+version cheaply), the block renders normally.
+"""
+from collections import OrderedDict
+import functools
+import hashlib
+import os
+import threading
+
+from flask import current_app, make_response, request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+import startup
+
+
+class FragmentCache:
+    """Bounded LRU of rendered HTML keyed by tuples"""
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache key, ... %}...{% endcache %} backed by environment.fragment_cache"""
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_render", [nodes.Tuple(parts, "load")])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or any(part is None for part in key):
+            return caller()
+        html = cache.get(key)
+        if html is None:
+            html = caller()
+            cache.set(key, html)
+        return html
+
+
+def cached_page(vary=None):
+    """Serve a view's whole response from the fragment cache.
+
+    For pages whose output depends only on `vary()` (called per request).
+    Requests with pending flash messages bypass the cache, since those are
+    rendered into the page once.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.jinja_env.fragment_cache
+            if cache is None or session.get("_flashes"):
+                return view(*args, **kwargs)
+            key = ("page", request.endpoint, vary() if vary else None)
+            cached = cache.get(key)
+            if cached is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                cached = (body, response.content_type, hashlib.sha1(body).hexdigest())
+                cache.set(key, cached)
+            body, content_type, etag = cached
+            response = make_response(body)
+            response.content_type = content_type
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def init_app(app, max_entries=None, precompile=None):
+    """Enable the cache tag, and load every template up front so none compiles on a request.
+
+    FRAGMENT_CACHE_SIZE=0 keeps the tag but renders every block.
+    PRECOMPILE_TEMPLATES=0 (the default under STARTUP_PROFILE=lean) leaves
+    each template to compile on its first render.
+    """
+    if max_entries is None:
+        max_entries = int(os.environ.get("FRAGMENT_CACHE_SIZE", 2000))
+    if precompile is None:
+        precompile = startup.flag("PRECOMPILE_TEMPLATES")
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache(max_entries) if max_entries else None
+    if precompile:
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)
+    return app.jinja_env.fragment_cache
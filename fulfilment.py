@@ -0,0 +1,221 @@
+"""Background fulfilment of reward redemptions and gifts.
+
+A request only reserves the points (the store records a "pending"
+redemption) and submits a job here. Worker threads hand each job to the
+voucher/airtime provider, retrying transient failures with exponential
+backoff; the redemption then moves to "completed", or to "refunded" with
+the points returned if the provider keeps failing.
+
+Jobs live in memory, but redemptions outlive a restart (journal or SQL).
+With resume_after set, the pool resubmits redemptions that have been
+pending for longer than that and that no job in this process is handling.
+It does this once when it starts and then every resume_after seconds.
+Resumed jobs carry no request details; the provider identifies them by
+redemption id.
+
+Before every provider call the pool takes a lease on the redemption in
+the store (claim_redemption) for `lease` seconds, and the resume pass
+only resubmits what it can lease. So under several workers sharing SQL,
+a job another worker is running or retrying in backoff is left alone.
+A second provider call can still happen if a call outlives the lease,
+or if the provider succeeded but settling failed and the lease lapsed.
+Keep `lease` above the longest attempt plus backoff, and have the
+provider deduplicate on redemption id.
+"""
+from dataclasses import dataclass, field
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+
+from records import now_us
+
+TERMINAL_STATUSES = ("completed", "refunded")
+
+
+class ProviderError(Exception):
+    """A provider call failed; `retryable` says whether trying again can help"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+@dataclass
+class FulfilmentJob:
+    redemption_id: str
+    kind: str   # "reward" or "gift"
+    details: dict = field(default_factory=dict)
+    attempts: int = 0
+
+
+class StubProvider:
+    """Local stand-in for the voucher/airtime provider: fixed latency and optional random failures"""
+
+    def __init__(self, latency=0.2, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+
+    def fulfil(self, job):
+        time.sleep(self.latency)
+        if self._rng.random() < self.failure_rate:
+            raise ProviderError("provider unavailable")
+        return f"VCH-{job.redemption_id[:8].upper()}"
+
+
+class FulfilmentQueue:
+    """Worker pool draining fulfilment jobs; `workers` bounds concurrent provider calls"""
+
+    def __init__(self, store, provider, workers=4, max_attempts=3, backoff=0.5, resume_after=None, lease=300,
+                 owner=None):
+        self.store = store
+        self.provider = provider
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.resume_after = resume_after
+        self.lease = lease
+        self.owner = owner   # who holds this pool's leases; host:pid of the serving process by default
+        self._cond = threading.Condition()
+        self._jobs = None
+        self._threads = []
+        self._pid = None
+        self._outstanding = 0
+        self._in_flight = set()   # redemption ids with a job in this process
+        self._stopping = threading.Event()
+
+    def submit(self, redemption_id, kind, **details):
+        self._ensure_started()
+        with self._cond:
+            self._outstanding += 1
+            self._in_flight.add(redemption_id)
+        self._jobs.put(FulfilmentJob(redemption_id, kind, details))
+
+    def start(self):
+        """Start the workers in this process (and resume stalled redemptions) if not already running"""
+        self._ensure_started()
+
+    def _ensure_started(self):
+        # Threads don't survive fork (gunicorn --preload), so start them in the serving process
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._jobs = queue.Queue()
+            self._outstanding = 0
+            self._in_flight = set()
+            self._stopping = threading.Event()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"fulfilment-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            if self.resume_after is not None:
+                self._threads.append(threading.Thread(target=self._resume_loop, name="fulfilment-resume",
+                                                      daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def _resume_loop(self):
+        while True:
+            try:
+                self.resume_stalled()
+            except Exception:
+                logging.exception("Resuming stalled redemptions failed")
+            if self._stopping.wait(self.resume_after):
+                break
+
+    def resume_stalled(self):
+        """Resubmit redemptions pending for over resume_after seconds that no job here holds; returns how many"""
+        cutoff = now_us() - int(self.resume_after * 1_000_000)
+        resumed = 0
+        for redemption in self.store.get_pending_redemptions(cutoff):
+            with self._cond:
+                if redemption["id"] in self._in_flight:
+                    continue
+            # Fails if it settled since the list was read, or another worker's job holds it
+            if not self._claim(redemption["id"]):
+                continue
+            kind = "gift" if self.store.get_gift(redemption["reward_id"]) else "reward"
+            logging.warning("Resuming %s %s, pending since %s", kind, redemption["id"], redemption["timestamp"])
+            self.submit(redemption["id"], kind)
+            resumed += 1
+        return resumed
+
+    def _claim(self, redemption_id):
+        owner = self.owner or f"{socket.gethostname()}:{os.getpid()}"
+        return self.store.claim_redemption(redemption_id, owner, self.lease)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            try:
+                claimed = self._claim(job.redemption_id)
+            except Exception:
+                logging.exception("Leasing %s %s failed", job.kind, job.redemption_id)
+                claimed = False
+            if not claimed:
+                # Settled already or held by another worker; if the store failed, the resume pass tries later
+                self._drop(job)
+                continue
+            job.attempts += 1
+            try:
+                reference = self.provider.fulfil(job)
+            except ProviderError as e:
+                if e.retryable and job.attempts < self.max_attempts:
+                    self._retry_later(job)
+                    continue
+                logging.warning("Fulfilment of %s %s failed after %d attempt(s): %s; refunding",
+                                job.kind, job.redemption_id, job.attempts, e)
+                self._finish(self.store.refund_redemption, job)
+            except Exception:
+                logging.exception("Fulfilment of %s %s crashed; refunding", job.kind, job.redemption_id)
+                self._finish(self.store.refund_redemption, job)
+            else:
+                logging.info("Fulfilled %s %s: %s", job.kind, job.redemption_id, reference)
+                self._finish(self.store.complete_redemption, job)
+
+    def _retry_later(self, job):
+        timer = threading.Timer(self.backoff * 2 ** (job.attempts - 1), self._jobs.put, (job,))
+        timer.daemon = True
+        timer.start()
+
+    def _finish(self, settle, job):
+        try:
+            settle(job.redemption_id)
+        except Exception:
+            # Keep the worker alive; the redemption is still pending, so the resume pass tries it again
+            logging.exception("Settling %s %s failed", job.kind, job.redemption_id)
+        finally:
+            self._drop(job)
+
+    def _drop(self, job):
+        with self._cond:
+            self._outstanding -= 1
+            self._in_flight.discard(job.redemption_id)
+            self._cond.notify_all()
+
+    def wait_for_change(self, timeout):
+        """Block until any job settles or `timeout` passes (used by status streams)"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def join(self, timeout=None):
+        """Wait until every submitted job has settled; returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._outstanding == 0, timeout)
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        for _ in range(self.workers):
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._pid = None
@@ -0,0 +1,50 @@
+"""gunicorn settings, picked up when gunicorn is started from this directory:
+
+    gunicorn main:app
+
+Live update streams (/api/events/stream) keep their connection open. A
+sync worker would be tied up for each open browser tab. With gevent
+installed (the "gevent" extra: `uv sync --extra gevent` or
+`pip install ".[gevent]"`), each idle stream is a parked greenlet, so one worker holds tens
+of thousands of them. Without gevent, workers fall back to gthread with
+GUNICORN_THREADS threads, which caps open streams at workers x threads.
+Either way a worker keeps at most EVENT_STREAM_MAX streams open (half its
+threads under gthread) and answers further ones with 503, and those pages
+fall back to polling /api/events.
+"""
+import importlib.util
+import os
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS") or (
+    "gevent" if importlib.util.find_spec("gevent") else "gthread"
+)
+# The in-memory store lives in one process; set DATABASE_URL before raising this
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 64))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 20000))
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+# Open live streams per worker before new ones are refused (routes.EVENT_STREAM_MAX). Under gthread
+# that is half the threads; a gevent worker can hold most of its connections
+if worker_class == "gevent":
+    os.environ.setdefault("EVENT_STREAM_MAX", str(worker_connections // 2))
+    # Load shedding defaults to 3/4 of GUNICORN_THREADS (ratelimit.py); greenlets are bounded by connections
+    os.environ.setdefault("SHED_MAX_IN_FLIGHT", str(worker_connections * 3 // 4))
+
+
+def when_ready(server):
+    velocity = os.environ.get("VELOCITY_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+    if workers > 1 and velocity:
+        server.log.warning("Velocity limits are counted per worker: with %d workers a customer "
+                           "can move up to %d times each limit", workers, workers)
+    if workers > 1 and os.environ.get("DATA_DIR") and not os.environ.get("DATABASE_URL"):
+        server.log.warning("DATA_DIR can only be journaled by one process: with %d workers, the "
+                           "second fails to boot and gunicorn stops; set DATABASE_URL or WEB_CONCURRENCY=1",
+                           workers)
+
+
+def post_worker_init(worker):
+    # Start the DATA_DIR journal in the worker, so a second worker on the same directory fails to
+    # boot instead of failing its first write
+    from models import data_store
+    if getattr(data_store, "journal", None) is not None:
+        data_store.journal.start()
@@ -0,0 +1,165 @@
+"""Idempotency-Key support for POST routes that move money or points.
+
+A client sends the same Idempotency-Key header on every retry of one
+logical request. The first request runs the view and its response is kept
+in a bounded TTL/LRU cache; retries get that stored response back without
+running the view again. A duplicate that arrives while the original is
+still running waits for it instead of racing it.
+
+A failed request normally gives up its key so the retry runs afresh.
+Once a view has written something a retry must not repeat (points
+awarded or spent), it calls mark_committed(); from then on its answer is
+stored under the key even if it is an error.
+
+The cache lives in the process, so with several gunicorn workers a retry
+is only deduplicated when it reaches the same worker.
+"""
+from collections import OrderedDict
+import functools
+import hashlib
+import json
+import threading
+import time
+
+from flask import g, jsonify, make_response, request, session
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "expires", "done", "response")
+
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.done = threading.Event()
+        self.response = None   # (status, body, content_type) once the original finishes
+
+
+class IdempotencyCache:
+    """Recent idempotency keys and their stored responses, bounded by count and age"""
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600, wait_timeout=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, scope, fingerprint):
+        """Claim `scope` or find its earlier result.
+
+        Returns ("run", claim) when the caller should run the request and then
+        pass the claim to complete() or abandon(); ("replay", response) for a stored
+        response; ("mismatch", None) when the key was used with a different
+        payload; ("busy", None) if the original is still running after
+        wait_timeout.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                self._expire(now)
+                entry = self._entries.get(scope)
+                if entry is None or entry.expires <= now:
+                    claim = self._entries[scope] = _Entry(fingerprint, now + self.ttl)
+                    self._entries.move_to_end(scope)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                    return "run", claim
+                if entry.fingerprint != fingerprint:
+                    return "mismatch", None
+                if entry.done.is_set() and entry.response is not None:
+                    self._entries.move_to_end(scope)
+                    return "replay", entry.response
+            # Concurrent duplicate: wait for the original outside the lock
+            if not entry.done.wait(max(0.0, deadline - now)):
+                return "busy", None
+
+    def complete(self, claim, response):
+        claim.response = response
+        claim.done.set()
+
+    def abandon(self, scope, claim):
+        """Forget a claim whose request failed so a retry runs it again"""
+        with self._lock:
+            if self._entries.get(scope) is claim:
+                del self._entries[scope]
+        claim.done.set()
+
+    def _expire(self, now):
+        # Entries sit roughly in age order, so expired ones collect at the front
+        while self._entries:
+            scope, entry = next(iter(self._entries.items()))
+            if entry.expires > now or not entry.done.is_set():
+                break
+            del self._entries[scope]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def mark_committed(committed=True):
+    """Record whether this request has written something a retry must not repeat"""
+    g._idempotent_committed = committed
+
+
+def committed():
+    return g.get("_idempotent_committed", False)
+
+
+def _fingerprint():
+    payload = repr((sorted(request.form.items(multi=True)), request.get_data()))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def idempotent(cache):
+    """Route decorator: honour an Idempotency-Key header using `cache`; without the header it's a no-op"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'success': False, 'message': 'Idempotency-Key is too long'}), 400
+
+            # Token clients are identified by auth.login_required, which runs first
+            customer_id = g.customer_id if 'customer_id' in g else session.get('customer_id')
+            scope = (customer_id, request.path, key)
+            state, result = cache.begin(scope, _fingerprint())
+            if state == "replay":
+                status, body, content_type = result
+                response = make_response(body, status)
+                response.content_type = content_type
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+            if state == "mismatch":
+                return jsonify({'success': False,
+                                'message': 'Idempotency-Key was already used for a different request'}), 422
+            if state == "busy":
+                response = jsonify({'success': False, 'message': 'The original request is still in progress'})
+                response.headers["Retry-After"] = "1"
+                return response, 409
+
+            mark_committed(False)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                if committed():
+                    body = json.dumps({'success': False, 'message': 'Request failed after it was recorded'})
+                    cache.complete(result, (500, body.encode(), "application/json"))
+                else:
+                    cache.abandon(scope, result)
+                raise
+            # Server errors and "slow down" answers aren't stored, so the client's retry gets a fresh
+            # attempt, unless the view had already committed its writes
+            if response.is_streamed or (not committed() and (response.status_code >= 500
+                                                             or response.status_code == 429)):
+                cache.abandon(scope, result)
+            else:
+                cache.complete(result, (response.status_code, response.get_data(), response.content_type))
+            return response
+        return wrapper
+    return decorator
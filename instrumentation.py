@@ -0,0 +1,220 @@
+"""Optional request / DataStore timing with a Prometheus-text /metrics endpoint.
+
+Enabled with METRICS_ENABLED=1 (METRICS_PROFILE=1 adds the sampling
+profiler). When disabled, init_app() returns without registering any hook
+or wrapping any method, so the hot path is untouched.
+"""
+from bisect import bisect_left
+from collections import Counter
+import functools
+import os
+import sys
+import threading
+import time
+
+from flask import Response, g, request, template_rendered, before_render_template
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# DataStore methods that get a timing wrapper
+STORE_METHODS = (
+    "get_customer", "get_all_customers", "find_customer_by_email", "update_customer_points",
+    "deduct_customer_points", "add_transaction", "add_transactions_bulk", "get_latest_transactions",
+    "get_transactions_page", "get_transaction_totals", "get_leaderboard_page", "get_customer_rank",
+    "get_all_rewards", "redeem_reward",
+)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    """Labelled timing histograms and counters, rendered in Prometheus text format"""
+
+    def __init__(self, prefix="mukuru"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}   # (metric, labels) -> Histogram
+        self._counters = Counter()   # (metric, labels) -> count
+        self._help = {}
+
+    def observe(self, metric, labels, seconds, help_text=""):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+                self._help.setdefault(metric, help_text)
+            histogram.observe(seconds)
+
+    def increment(self, metric, labels, help_text=""):
+        with self._lock:
+            self._counters[(metric, tuple(sorted(labels.items())))] += 1
+            self._help.setdefault(metric, help_text)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            seen = set()
+            for (metric, labels), histogram in histograms:
+                name = f"{self.prefix}_{metric}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# HELP {name} {self._help[metric]}")
+                    lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.total}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+            for (metric, labels), count in counters:
+                name = f"{self.prefix}_{metric}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# HELP {name} {self._help[metric]}")
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def timed(metrics, name):
+    """Decorator recording call count and latency of a DataStore method"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe("store_call_duration_seconds", {"method": name},
+                                time.perf_counter() - start, "DataStore method latency")
+        return wrapper
+    return decorator
+
+
+def instrument_store(store, metrics):
+    """Wrap the hot DataStore methods on this instance only"""
+    for name in STORE_METHODS:
+        method = getattr(store, name, None)
+        if method is not None:
+            setattr(store, name, timed(metrics, name)(method))
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and counts folded stacks.
+
+    Output of folded() can be fed straight to flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval=0.005, max_stacks=10000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack = ";".join(reversed(parts))
+                # Bound memory: once full, only already-seen stacks keep counting
+                if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[stack] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes", "on")
+
+
+def init_app(app, store, enabled=None, profile=None):
+    """Hook timing into the app and store; returns the Metrics registry, or None when disabled"""
+    if enabled is None:
+        enabled = _env_flag("METRICS_ENABLED")
+    if not enabled:
+        return None
+    if profile is None:
+        profile = _env_flag("METRICS_PROFILE")
+
+    metrics = Metrics()
+    instrument_store(store, metrics)
+
+    @app.before_request
+    def _start_timer():
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("_request_started", None)
+        if started is not None:
+            labels = {"endpoint": request.endpoint or "unknown", "method": request.method}
+            metrics.observe("request_duration_seconds", labels, time.perf_counter() - started,
+                            "Request latency by Flask endpoint")
+            metrics.increment("requests_total", dict(labels, status=response.status_code),
+                              "Requests by endpoint and status")
+        return response
+
+    def _template_started(sender, template, context, **extra):
+        g._template_started = time.perf_counter()
+
+    def _template_finished(sender, template, context, **extra):
+        started = g.pop("_template_started", None)
+        if started is not None:
+            metrics.observe("template_render_seconds", {"template": template.name or "string"},
+                            time.perf_counter() - started, "Jinja render time per template")
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
+
+    profiler = SamplingProfiler() if profile else None
+
+    @app.route("/metrics")
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    if profiler:
+        @app.route("/metrics/profile")
+        def profile_endpoint():
+            return Response(profiler.folded(), mimetype="text/plain")
+
+    app.extensions["metrics"] = metrics
+    return metrics
@@ -0,0 +1,275 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+LOCK_NAME = "LOCK"
+
+
+def _fsync_dir(path):
+    # Make renames and new files in the directory durable (no-op where unsupported)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class JournalError(Exception):
+    """The journal can no longer write (e.g. disk full); nothing more can be made durable"""
+
+
+class Journal:
+    """Append-only log of DataStore mutations with group commit.
+
+    append() only queues a record and hands back its log sequence number
+    (LSN). A writer thread flushes everything queued so far with a single
+    write + fsync, so many concurrent callers share one disk sync; callers
+    that need durability block in wait_durable() until their batch lands.
+
+    If a write or fsync fails, the writer records the error and stops.
+    Waiting callers are woken, and wait_durable() and every later append()
+    raise JournalError, so requests fail fast instead of hanging.
+
+    The writer starts in the process that first appends (or calls start()),
+    since threads don't survive a fork: under gunicorn --preload the master
+    loads the journal and a worker writes it. Only one process may write a
+    directory. The writer holds an exclusive lock on its LOCK file, and
+    start() in any other process raises JournalError.
+
+    The log is split into segments named after the first LSN they hold.
+    After a snapshot, segments whose records are all covered by it are
+    deleted (see compact()).
+    """
+
+    def __init__(self, directory, start_lsn=0, commit_delay=0.0):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Optional pause before each flush to let more records join the batch
+        self.commit_delay = commit_delay
+        self._cond = threading.Condition()
+        self._pending = []
+        self._lsn = start_lsn
+        self._durable_lsn = start_lsn
+        self._rotate = True   # always start a fresh segment
+        self._file = None
+        self._closed = False
+        self._error = None
+        self._writer = None
+        self._pid = None
+        self._lock_fd = None
+        # Fail now rather than on the first write if another process is already writing here
+        os.close(self._lock_directory())
+
+    @property
+    def last_lsn(self):
+        return self._lsn
+
+    def start(self):
+        """Start the writer in this process if it isn't running here; raises JournalError if another process is"""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            if self._closed:
+                raise RuntimeError("journal is closed")
+            self._lock_fd = self._lock_directory()
+            self._pid = os.getpid()
+            # A segment inherited over fork belongs to the parent's writer; start a fresh one
+            self._file = None
+            self._rotate = True
+            self._writer = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+            self._writer.start()
+
+    def _lock_directory(self):
+        fd = os.open(os.path.join(self.directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            holder = os.pread(fd, 32, 0).decode(errors="replace").strip() or "unknown"
+            os.close(fd)
+            raise JournalError(f"{self.directory} is being journaled by another process (pid {holder}); "
+                               f"run one worker per DATA_DIR, or use DATABASE_URL") from None
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, str(os.getpid()).encode(), 0)
+        return fd
+
+    def append(self, record):
+        self.start()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("journal is closed")
+            if self._error is not None:
+                raise JournalError(f"journal write failed: {self._error}") from self._error
+            self._lsn += 1
+            record["lsn"] = self._lsn
+            self._pending.append(json.dumps(record, separators=(",", ":")))
+            self._cond.notify_all()
+            return self._lsn
+
+    def wait_durable(self, lsn):
+        with self._cond:
+            while self._durable_lsn < lsn and not self._closed and self._error is None:
+                self._cond.wait()
+            if self._durable_lsn < lsn and self._error is not None:
+                raise JournalError(f"journal write failed: {self._error}") from self._error
+
+    def rotate(self):
+        """Start a new segment with the next batch written"""
+        with self._cond:
+            self._rotate = True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._pid == os.getpid():
+            self._writer.join()
+            os.close(self._lock_fd)
+            self._pid = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    break
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+            with self._cond:
+                batch, self._pending = self._pending, []
+                last_lsn = self._lsn
+                rotate, self._rotate = self._rotate, False
+            first_lsn = last_lsn - len(batch) + 1
+            try:
+                if rotate or self._file is None:
+                    self._open_segment(first_lsn)
+                self._file.write("\n".join(batch) + "\n")
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                # Whether this batch reached the disk is unknown, so nothing after it can be promised either
+                logging.exception("Journal write failed at LSN %d", first_lsn)
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                break
+            with self._cond:
+                self._durable_lsn = last_lsn
+                self._cond.notify_all()
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+
+    def _open_segment(self, first_lsn):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"journal-{first_lsn:020d}.log")
+        self._file = open(path, "a", encoding="utf-8")
+        _fsync_dir(self.directory)
+
+    def compact(self, snapshot_lsn):
+        """Delete segments whose records are all at or below snapshot_lsn"""
+        segments = list_segments(self.directory)
+        for (path, _), (_, next_first) in zip(segments, segments[1:]):
+            if next_first - 1 <= snapshot_lsn:
+                os.remove(path)
+
+
+def list_segments(directory):
+    """(path, first_lsn) for every journal segment, oldest first"""
+    segments = []
+    for path in glob.glob(os.path.join(directory, "journal-*.log")):
+        name = os.path.basename(path)
+        segments.append((path, int(name[len("journal-"):-len(".log")])))
+    segments.sort(key=lambda segment: segment[1])
+    return segments
+
+
+def read_records(directory, after_lsn=0):
+    """Yield journal records with lsn > after_lsn, in order.
+
+    A torn final line (crash mid-write) ends replay of that segment.
+    """
+    for path, _ in list_segments(directory):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record["lsn"] > after_lsn:
+                    yield record
+
+
+def write_snapshot(directory, state):
+    """Atomically write a snapshot and drop older ones; state must include 'lsn'"""
+    path = os.path.join(directory, f"snapshot-{state['lsn']:020d}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(directory)
+    for old in glob.glob(os.path.join(directory, "snapshot-*.json")):
+        if old != path:
+            os.remove(old)
+    return path
+
+
+def load_latest_snapshot(directory):
+    snapshots = sorted(glob.glob(os.path.join(directory, "snapshot-*.json")))
+    if not snapshots:
+        return None
+    with open(snapshots[-1], encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Snapshotter:
+    """Background thread that snapshots the store every `interval` seconds when it has changed"""
+
+    def __init__(self, store, interval):
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Runs in the process that writes the journal, like the journal's own writer
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid() or self._stop.is_set():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="journal-snapshotter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.store.journal.last_lsn > self.store.snapshot_lsn:
+                try:
+                    self.store.snapshot()
+                except Exception:
+                    # The journal still holds everything; the next interval tries again
+                    logging.exception("Snapshot failed")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
@@ -0,0 +1,160 @@
+from bisect import bisect_left, bisect_right, insort
+import threading
+
+
+class Leaderboard:
+    """Customers ranked by points balance, updated incrementally.
+
+    Keys live in a bucketed sorted list (a list of short sorted lists) with a
+    Fenwick tree over the bucket sizes, so inserts, removals, rank lookups and
+    positional lookups all stay close to O(log n) without re-sorting.
+    """
+
+    _LOAD = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = []   # sorted lists of keys
+        self._maxes = []     # last key of each bucket
+        self._tree = []      # Fenwick tree over bucket sizes
+        self._tree_valid = False
+        self._keys = {}      # customer_id -> current key
+        self._seq = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, customer_id, points):
+        """Insert or move a customer to their new points balance"""
+        with self._lock:
+            old_key = self._keys.get(customer_id)
+            if old_key is not None:
+                if old_key[0] == -points:
+                    return
+                self._remove(old_key)
+                seq = old_key[1]
+            else:
+                # Ties keep the order customers joined the board in
+                seq = self._seq
+                self._seq += 1
+            key = (-points, seq, customer_id)
+            self._keys[customer_id] = key
+            self._insert(key)
+            self.version += 1
+
+    def touch(self):
+        """Bump the version when something shown next to the ranks (e.g. a name) changes"""
+        with self._lock:
+            self.version += 1
+
+    def remove(self, customer_id):
+        with self._lock:
+            key = self._keys.pop(customer_id, None)
+            if key is not None:
+                self._remove(key)
+                self.version += 1
+
+    def rank_of(self, customer_id):
+        """1-based rank of a customer, or None if they are not on the board"""
+        with self._lock:
+            key = self._keys.get(customer_id)
+            if key is None:
+                return None
+            i = bisect_left(self._maxes, key)
+            j = bisect_left(self._buckets[i], key)
+            return self._prefix(i) + j + 1
+
+    def page(self, offset=0, limit=50):
+        """(rank, customer_id, points) rows starting at a 0-based offset"""
+        with self._lock:
+            if offset < 0 or limit <= 0 or offset >= len(self._keys):
+                return []
+            i, j = self._locate(offset)
+            rows = []
+            rank = offset + 1
+            while i < len(self._buckets) and len(rows) < limit:
+                bucket = self._buckets[i]
+                for key in bucket[j:j + limit - len(rows)]:
+                    rows.append((rank, key[2], -key[0]))
+                    rank += 1
+                i += 1
+                j = 0
+            return rows
+
+    def top(self, k=10):
+        return self.page(0, k)
+
+    def _insert(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._tree_valid = False
+            return
+        i = bisect_right(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+        bucket = self._buckets[i]
+        insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self._LOAD:
+            self._buckets[i:i + 1] = [bucket[:self._LOAD], bucket[self._LOAD:]]
+            self._maxes[i:i + 1] = [bucket[self._LOAD - 1], bucket[-1]]
+            self._tree_valid = False
+        else:
+            self._tree_add(i, 1)
+
+    def _remove(self, key):
+        i = bisect_left(self._maxes, key)
+        bucket = self._buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+            self._tree_valid = False
+
+    def _build_tree(self):
+        tree = [len(bucket) for bucket in self._buckets]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._tree_valid = True
+
+    def _tree_add(self, i, delta):
+        if not self._tree_valid:
+            return
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i |= i + 1
+
+    def _prefix(self, i):
+        """Number of keys in buckets before bucket i"""
+        if not self._tree_valid:
+            self._build_tree()
+        total = 0
+        i -= 1
+        while i >= 0:
+            total += self._tree[i]
+            i = (i & (i + 1)) - 1
+        return total
+
+    def _locate(self, offset):
+        """(bucket, index) of the key at a 0-based position"""
+        if not self._tree_valid:
+            self._build_tree()
+        tree = self._tree
+        pos = -1
+        step = 1 << (len(tree).bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt < len(tree) and tree[nxt] <= offset:
+                offset -= tree[nxt]
+                pos = nxt
+            step >>= 1
+        return pos + 1, offset
@@ -0,0 +1,159 @@
+"""Money and gifts waiting to be collected: the in-memory ledger index and its expiry sweeper.
+
+Every entry sits in one insertion-ordered dict per (recipient, status),
+so looking an entry up, claiming it and moving it to another status are
+O(1). A recipient's pending list is a slice of their own dict, oldest
+first, with no scan over anyone else's entries. Pending entries are also
+on a heap ordered by expiry. A sweep visits only the part of the heap
+that is due. An entry leaves the heap once it is no longer pending, when
+it reaches the top, so one that fails to expire is tried again next time.
+"""
+import heapq
+from itertools import islice
+import logging
+import os
+import threading
+
+# How long an uncollected entry waits before the sweeper expires it
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+class CollectionLedger:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}        # uuid_int -> Collection
+        self._by_status = {}      # (recipient_key, status) -> {uuid_int: Collection}, oldest first
+        self._by_sender = {}      # sender_id -> [Collection] of gifts sent, oldest first
+        self._by_redemption = {}  # redemption_id -> Collection, for gifts
+        self._expiry = []         # (expires_us, uuid_int) for entries that were pending when pushed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, entry):
+        with self._lock:
+            self._entries[entry.uuid_int] = entry
+            self._by_status.setdefault((entry.recipient_key, entry.status), {})[entry.uuid_int] = entry
+            if entry.kind == "gift" and entry.sender_id is not None:
+                self._by_sender.setdefault(entry.sender_id, []).append(entry)
+            if entry.redemption_id:
+                self._by_redemption[entry.redemption_id] = entry
+            if entry.status == "pending" and entry.expires_us:
+                heapq.heappush(self._expiry, (entry.expires_us, entry.uuid_int))
+
+    def get(self, uuid_int):
+        return self._entries.get(uuid_int)
+
+    def for_redemption(self, redemption_id):
+        return self._by_redemption.get(redemption_id)
+
+    def transition(self, uuid_int, status, recipient_keys=None):
+        """Move a pending entry to `status`; returns it, or None if it isn't pending (or isn't theirs)"""
+        with self._lock:
+            entry = self._entries.get(uuid_int)
+            if entry is None or entry.status != "pending":
+                return None
+            if recipient_keys is not None and entry.recipient_key not in recipient_keys:
+                return None
+            self._move(entry, status)
+            return entry
+
+    def set_status(self, uuid_int, status):
+        """Put an entry in `status` whatever it was; for journal replay and restores"""
+        with self._lock:
+            entry = self._entries.get(uuid_int)
+            if entry is not None and entry.status != status:
+                self._move(entry, status)
+            return entry
+
+    def _move(self, entry, status):
+        old_key = (entry.recipient_key, entry.status)
+        bucket = self._by_status[old_key]
+        del bucket[entry.uuid_int]
+        if not bucket:
+            del self._by_status[old_key]
+        entry.status = status
+        self._by_status.setdefault((entry.recipient_key, status), {})[entry.uuid_int] = entry
+
+    def pending(self, recipient_keys, offset=0, limit=20):
+        """(entries, total): one page of pending entries for any of the keys, oldest first"""
+        with self._lock:
+            buckets = [self._by_status.get((key, "pending")) for key in dict.fromkeys(recipient_keys)]
+            buckets = [bucket for bucket in buckets if bucket]
+            total = sum(len(bucket) for bucket in buckets)
+            if len(buckets) == 1:
+                return list(islice(buckets[0].values(), offset, offset + limit)), total
+            merged = heapq.merge(*(bucket.values() for bucket in buckets), key=lambda entry: entry.created_us)
+            return list(islice(merged, offset, offset + limit)), total
+
+    def recent_gifts(self, sender_id, recipient_keys, limit=5):
+        """Latest gifts sent by sender_id or to any of the keys, newest first, as (type, entry)"""
+        with self._lock:
+            sent = self._by_sender.get(sender_id, [])[-limit:]
+            received = []
+            for key in dict.fromkeys(recipient_keys):
+                for status in ("pending", "collected", "expired"):
+                    entries = reversed(self._by_status.get((key, status), {}).values())
+                    received.extend(islice((entry for entry in entries if entry.kind == "gift"), limit))
+        rows = [("sent", entry) for entry in sent] + [("received", entry) for entry in received]
+        rows.sort(key=lambda row: row[1].created_us, reverse=True)
+        return rows[:limit]
+
+    def due(self, now):
+        """Pending entries whose expiry has passed, soonest first; they stay on the heap until they move"""
+        found = []
+        with self._lock:
+            heap = self._expiry
+            while heap and self._settled(heap[0][1]):
+                heapq.heappop(heap)
+            # Every due item sits in the subtree of due items under the root
+            stack = [0]
+            while stack:
+                i = stack.pop()
+                if i < len(heap) and heap[i][0] <= now:
+                    if not self._settled(heap[i][1]):
+                        found.append(heap[i])
+                    stack += (2 * i + 1, 2 * i + 2)
+        return [self._entries[uuid_int] for _, uuid_int in sorted(found)]
+
+    def _settled(self, uuid_int):
+        entry = self._entries.get(uuid_int)
+        return entry is None or entry.status != "pending"
+
+
+class CollectionSweeper:
+    """Background thread that expires uncollected entries every `interval` seconds.
+
+    Like the fulfilment workers, the thread is (re)started from the
+    serving process on first use, since threads don't survive a fork.
+    """
+
+    def __init__(self, store, interval=60):
+        self.store = store
+        self.interval = interval
+        self.expired = 0
+        self._pid = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid() or self._stop.is_set():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="collection-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.expired += self.store.expire_collections()
+            except Exception:
+                # Whatever didn't expire is still pending and due; the next sweep retries it
+                logging.exception("Collection sweep failed")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
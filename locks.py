@@ -0,0 +1,18 @@
+import threading
+import zlib
+
+
+class StripedLock:
+    """A fixed pool of locks shared out by key.
+
+    Operations on the same key always get the same lock, while different keys
+    usually land on different stripes and can run in parallel. The pool size
+    bounds memory no matter how many customers there are.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def for_key(self, key):
+        # crc32 rather than hash() so the stripe for a key is stable across processes
+        return self._locks[zlib.crc32(str(key).encode()) % len(self._locks)]
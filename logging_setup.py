@@ -0,0 +1,126 @@
+"""Root logging for the app: plain text for development, queued JSON lines for production.
+
+LOG_LEVEL sets the root level (default DEBUG). LOG_FORMAT picks the
+pipeline:
+
+* text (default): logging.basicConfig to stderr, written on the
+  calling thread;
+* json: the calling thread only merges the message arguments and puts
+  the record on a bounded queue. A QueueListener thread encodes each one
+  as a JSON object on its own line and writes it to stderr. `extra`
+  fields become keys. When the queue is full, records are dropped and
+  counted rather than making the request wait.
+
+    logging.info("Reward redeemed", extra={"customer_id": customer_id})
+"""
+import atexit
+from datetime import datetime, timezone
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import sys
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue records without ever blocking the caller; counts what didn't fit"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the arguments now, while they hold the values being logged. Unlike
+        # QueueHandler.prepare, this keeps the traceback for the listener to format
+        # and skips the copy: the merged message reads the same to any other handler
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+
+
+def configure(level=None, fmt=None, stream=None, queue_size=None):
+    """Set up root logging from the arguments or LOG_LEVEL / LOG_FORMAT / LOG_QUEUE_SIZE.
+
+    Returns the QueueListener in json mode (already started), else None.
+    """
+    global _listener
+    level = (level or os.environ.get("LOG_LEVEL", "DEBUG")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "text")).lower()
+    stream = stream or sys.stderr
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if fmt != "json":
+        logging.basicConfig(level=level, stream=stream, force=True)
+        return None
+
+    if queue_size is None:
+        queue_size = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(queue_size)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _flush():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _after_fork():
+    """A forked worker gets a fresh queue and its own listener thread"""
+    if _listener is None:
+        return
+    fresh = queue.Queue(_listener.queue.maxsize)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            handler.queue = fresh
+    _listener.queue = fresh
+    _listener._thread = None
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -1,47 +1,134 @@
-from datetime import datetime
+from bisect import bisect_left
+import os
+import threading
+import time
 import uuid
 
+from journal import Journal, Snapshotter, load_latest_snapshot, read_records, write_snapshot
+from leaderboard import Leaderboard
+from ledger import DEFAULT_TTL, CollectionLedger
+from locks import StripedLock
+from points_rules import tier_for
+from records import Collection, Customer, Redemption, Transaction, new_uuid_int, now_us
+from shared_balances import BalanceTable, SharedLeaderboard
+from events import EventBus
+from stats import Stats
+import startup
+from storage import (
+    Storage, decode_cursor, encode_cursor, normalize_email, normalize_mukuru_id, normalize_phone,
+    validate_remittance,
+)
+
 # In-memory storage for the application
-class DataStore:
-    def __init__(self):
+class DataStore(Storage):
+    def __init__(self, balances=None, sample_customers=True):
         self.customers = {}
         self.transactions = {}
         self.rewards = {}
         self.redemptions = {}
-        self._init_sample_data()
+        self.gifts = {}
+        # Money and gifts waiting for their recipients, indexed by self.ledger
+        self.collections = {}
+        self.ledger = CollectionLedger()
+        # Bumped on every rewards/gifts change so cached catalog views know to rebuild
+        self._catalog_version = 0
+        # customer_id -> that customer's transactions, oldest first
+        self._transactions_by_customer = {}
+        # customer_id -> running count / amount / points over those transactions
+        self._transaction_totals = {}
+        self.leaderboard = Leaderboard()
+        # Running per-day / per-tier / per-country aggregates behind /api/stats
+        self.stats = Stats()
+        # Per-customer change events for the live push channel
+        self.events = EventBus()
+        # Balance read-modify-writes for a customer run under that customer's stripe
+        self._customer_locks = StripedLock()
+        # Normalized email/phone -> customer_id for login and lookups
+        self._customer_by_email = {}
+        self._customer_by_phone = {}
+        self._contact_lock = threading.Lock()
+        # redemption_id -> (owner, lease expiry) for fulfilment jobs; not journaled, leases lapse on restart
+        self._leases = {}
+        self._lease_lock = threading.Lock()
+        # Set by DataStore.open(); None keeps the store purely in memory
+        self.journal = None
+        self.snapshot_lsn = 0
+        self._snapshotter = None
+        # A BalanceTable shared with other worker processes; None keeps balances on the records
+        self.balances = balances
+        self._init_sample_data(sample_customers)
+        self._rebuild_indexes()
     
-    def _init_sample_data(self):
-        # Initialize sample customers
-        self.customers = {
-            "1": {
-                "id": "1",
-                "name": "John Doe",
-                "email": "john.doe@email.com",
-                "phone": "+27123456789",
-                "points_balance": 0,
-                "tier": "Bronze",
-                "joined_date": datetime.now().isoformat()
-            },
-            "2": {
-                "id": "2",
-                "name": "Sarah Smith",
-                "email": "sarah.smith@email.com",
-                "phone": "+27987654321",
-                "points_balance": 0,
-                "tier": "Bronze",
-                "joined_date": datetime.now().isoformat()
-            },
-            "3": {
-                "id": "3",
-                "name": "Michael Johnson",
-                "email": "michael.j@email.com",
-                "phone": "+27555666777",
-                "points_balance": 0,
-                "tier": "Bronze",
-                "joined_date": datetime.now().isoformat()
-            }
+    def _rebuild_indexes(self):
+        self._customer_by_email = {}
+        self._customer_by_phone = {}
+        if self.balances is not None:
+            for customer in self.customers.values():
+                self.balances.attach(customer)
+            self.leaderboard = SharedLeaderboard(self.balances)
+        else:
+            self.leaderboard = Leaderboard()
+        self._transactions_by_customer = {}
+        self._transaction_totals = {}
+        for customer_id, customer in self.customers.items():
+            self._index_contact(customer)
+            self.leaderboard.update(customer_id, customer["points_balance"])
+        for transaction in self.transactions.values():
+            self._index_transaction(transaction)
+        self.ledger = CollectionLedger()
+        for entry in sorted(self.collections.values(), key=lambda entry: entry.created_us):
+            self.ledger.add(entry)
+        self.stats = Stats.build(self.customers.values(), self.transactions.values(), self.redemptions.values())
+    
+    def _init_sample_data(self, sample_customers=True):
+        # Initialize sample customers (demo accounts; SAMPLE_DATA=0 starts without them)
+        joined_us = now_us()
+        self.customers = {} if not sample_customers else {
+            "1": Customer(
+                id="1",
+                name="John Doe",
+                email="john.doe@email.com",
+                phone="+27123456789",
+                joined_us=joined_us
+            ),
+            "2": Customer(
+                id="2",
+                name="Sarah Smith",
+                email="sarah.smith@email.com",
+                phone="+27987654321",
+                joined_us=joined_us
+            ),
+            "3": Customer(
+                id="3",
+                name="Michael Johnson",
+                email="michael.j@email.com",
+                phone="+27555666777",
+                joined_us=joined_us
+            )
         }
         
+        # Money waiting for the demo customers on the Receive & Collect page
+        self.collections = {}
+        if sample_customers:
+            for days_ago, recipient, sender, amount, method, verification in (
+                (2, "1", "Alice Johnson", 1500.00, "Bank Transfer", "mukuru_card"),
+                (1, "2", "David Wilson", 750.00, "Cash Pickup", "id_number"),
+            ):
+                created_us = joined_us - days_ago * 86400 * 1_000_000
+                entry = Collection(
+                    # A fixed id per demo entry, so journaled claims still match it after a restart
+                    uuid_int=uuid.uuid5(uuid.NAMESPACE_URL, f"mukuru-demo-collection:{recipient}:{sender}").int,
+                    kind="money",
+                    recipient_key=recipient,
+                    sender_name=sender,
+                    amount=amount,
+                    collection_method=method,
+                    verification_method=verification,
+                    created_us=created_us,
+                    expires_us=created_us + DEFAULT_TTL * 1_000_000
+                )
+                self.collections[entry.uuid_int] = entry
+        
         # Initialize rewards catalog
         self.rewards = {
             "1": {
@@ -99,6 +186,14 @@ class DataStore:
                 "available": True
             }
         }
+        
+        # Gifts that can be sent to other Mukuru users
+        self.gifts = {
+            "airtime50": {"id": "airtime50", "name": "R50 Airtime", "description": "Mobile airtime voucher", "points_cost": 50, "icon": "fas fa-mobile-alt"},
+            "grocery100": {"id": "grocery100", "name": "R100 Grocery Voucher", "description": "Shoprite/Checkers voucher", "points_cost": 100, "icon": "fas fa-shopping-cart"},
+            "fuel200": {"id": "fuel200", "name": "R200 Fuel Voucher", "description": "Shell/BP fuel voucher", "points_cost": 200, "icon": "fas fa-gas-pump"},
+            "entertainment500": {"id": "entertainment500", "name": "R500 Entertainment", "description": "Netflix/Showmax voucher", "points_cost": 500, "icon": "fas fa-film"}
+        }
     
     def get_customer(self, customer_id):
         return self.customers.get(customer_id)
@@ -106,7 +201,73 @@ class DataStore:
     def get_all_customers(self):
         return list(self.customers.values())
     
+    def count_customers(self):
+        return len(self.customers)
+    
+    def find_customer_by_email(self, email):
+        customer_id = self._customer_by_email.get(normalize_email(email))
+        return self.customers.get(customer_id) if customer_id else None
+    
+    def find_customer_by_phone(self, phone):
+        customer_id = self._customer_by_phone.get(normalize_phone(phone))
+        return self.customers.get(customer_id) if customer_id else None
+    
+    def _index_contact(self, customer):
+        self._customer_by_email[normalize_email(customer["email"])] = customer["id"]
+        if customer.get("phone"):
+            self._customer_by_phone[normalize_phone(customer["phone"])] = customer["id"]
+    
+    def _unindex_contact(self, customer):
+        self._customer_by_email.pop(normalize_email(customer["email"]), None)
+        if customer.get("phone"):
+            self._customer_by_phone.pop(normalize_phone(customer["phone"]), None)
+    
+    def add_customer(self, name, email, phone=None):
+        with self._contact_lock:
+            if normalize_email(email) in self._customer_by_email:
+                return None
+            customer_id = str(uuid.uuid4())
+            customer = Customer(id=customer_id, name=name, email=email.strip(), phone=phone, joined_us=now_us())
+            if self.balances is not None:
+                self.balances.attach(customer)
+            self.customers[customer_id] = customer
+            self._index_contact(customer)
+            lsn = self._log({"op": "customer", "row": customer.stored()})
+        self.leaderboard.update(customer_id, 0)
+        self.stats.add_customer(customer["tier"])
+        self._await_durable(lsn)
+        return customer
+    
+    def update_customer(self, customer_id, name=None, email=None, phone=None):
+        with self._contact_lock:
+            customer = self.customers.get(customer_id)
+            if not customer:
+                return None
+            if email is not None:
+                owner = self._customer_by_email.get(normalize_email(email))
+                if owner and owner != customer_id:
+                    return None
+            self._unindex_contact(customer)
+            if name is not None:
+                customer["name"] = name
+                self.leaderboard.touch()
+            if email is not None:
+                customer["email"] = email.strip()
+            if phone is not None:
+                customer["phone"] = phone
+            self._index_contact(customer)
+            # The row carries the balance: log it in balance order, or replay could roll a newer balance back
+            with self._balance_lock(customer_id):
+                lsn = self._log({"op": "customer", "row": customer.stored()})
+        self._await_durable(lsn)
+        return customer
+    
     def update_customer_points(self, customer_id, points_to_add):
+        customer, lsn = self._add_points(customer_id, points_to_add)
+        self._await_durable(lsn)
+        return customer
+    
+    def _add_points(self, customer_id, points_to_add):
         # normalize and guard
         try:
             points_to_add = int(points_to_add)
@@ -115,41 +276,216 @@ class DataStore:
         if points_to_add < 0:
             points_to_add = 0
         if customer_id in self.customers:
-            self.customers[customer_id]["points_balance"] += points_to_add
-            # Update tier based on points
-            self._update_customer_tier(customer_id)
-            return self.customers[customer_id]
-        return None
+            with self._balance_lock(customer_id):
+                self.customers[customer_id]["points_balance"] += points_to_add
+                # Update tier based on points
+                self._update_customer_tier(customer_id)
+                self.leaderboard.update(customer_id, self.customers[customer_id]["points_balance"])
+                lsn = self._log_balance(self.customers[customer_id])
+            self.events.publish(customer_id, "balance")
+            return self.customers[customer_id], lsn
+        return None, None
+    
+    def deduct_customer_points(self, customer_id, points):
+        """Deduct points if the customer can afford them; returns the customer or None"""
+        customer = self.customers.get(customer_id)
+        if not customer or points < 0:
+            return None
+        with self._balance_lock(customer_id):
+            if customer["points_balance"] < points:
+                return None
+            customer["points_balance"] -= points
+            self.leaderboard.update(customer_id, customer["points_balance"])
+            lsn = self._log_balance(customer)
+        self.events.publish(customer_id, "balance")
+        self._await_durable(lsn)
+        return customer
+    
+    def _balance_lock(self, customer_id):
+        """Held around every balance read-modify-write; spans processes when balances are shared"""
+        if self.balances is not None:
+            return self.balances.lock(customer_id)
+        return self._customer_locks.for_key(customer_id)
     
     def _update_customer_tier(self, customer_id):
         if customer_id in self.customers:
-            points = self.customers[customer_id]["points_balance"]
-            if points >= 1000:
-                self.customers[customer_id]["tier"] = "Gold"
-            elif points >= 500:
-                self.customers[customer_id]["tier"] = "Silver"
-            else:
-                self.customers[customer_id]["tier"] = "Bronze"
+            old_tier = self.customers[customer_id]["tier"]
+            self.customers[customer_id]["tier"] = tier_for(self.customers[customer_id]["points_balance"])
+            self.stats.change_tier(old_tier, self.customers[customer_id]["tier"])
     
     def add_transaction(self, customer_id, amount, recipient, points_earned, destination_country=None, verification_method=None, verification_value=None):
-        transaction_id = str(uuid.uuid4())
-        transaction = {
-            "id": transaction_id,
-            "customer_id": customer_id,
-            "amount": amount,
-            "recipient": recipient,
-            "points_earned": points_earned,
-            "destination_country": destination_country,
-            "verification_method": verification_method,
-            "verification_value": verification_value,
-            "timestamp": datetime.now().isoformat(),
-            "type": "remittance"
-        }
-        self.transactions[transaction_id] = transaction
+        transaction, lsn = self._add_transaction(customer_id, amount, recipient, points_earned, destination_country, verification_method, verification_value)
+        self._await_durable(lsn)
         return transaction
     
-    def get_customer_transactions(self, customer_id):
-        return [t for t in self.transactions.values() if t["customer_id"] == customer_id]
+    def _add_transaction(self, customer_id, amount, recipient, points_earned, destination_country=None, verification_method=None, verification_value=None):
+        transaction = Transaction(
+            uuid_int=new_uuid_int(),
+            customer_id=customer_id,
+            amount=amount,
+            recipient=recipient,
+            points_earned=points_earned,
+            destination_country=destination_country,
+            verification_method=verification_method,
+            verification_value=verification_value,
+            created_us=now_us()
+        )
+        with self._customer_locks.for_key(customer_id):
+            # Keyed by the 128-bit id as an int; transaction["id"] renders the usual string
+            self.transactions[transaction.uuid_int] = transaction
+            self._index_transaction(transaction)
+            self.stats.add_transaction(transaction.created_us, destination_country, amount, points_earned)
+            lsn = self._log({"op": "transaction", "row": transaction.stored()})
+        self.events.publish(customer_id, "transaction", transaction)
+        return transaction, lsn
+    
+    def _index_transaction(self, transaction):
+        customer_id = transaction["customer_id"]
+        # Transactions are stamped with now(), so appending keeps the list in time order
+        self._transactions_by_customer.setdefault(customer_id, []).append(transaction)
+        totals = self._transaction_totals.setdefault(customer_id, {"count": 0, "amount": 0, "points_earned": 0})
+        totals["count"] += 1
+        totals["amount"] += transaction["amount"]
+        totals["points_earned"] += transaction["points_earned"]
+    
+    def add_transactions_bulk(self, rows, score=None):
+        results = []
+        valid = []
+        # Validate and price every row first, so a row that fails can't leave the batch half recorded
+        for index, row in enumerate(rows):
+            remittance, error = validate_remittance(row)
+            if remittance and remittance["customer_id"] not in self.customers:
+                remittance, error = None, "Customer not found"
+            results.append({"index": index, "success": False, "message": error})
+            if error:
+                continue
+            if score:
+                # Priced at the tier the customer had when the batch reached them
+                tier = self.customers[remittance["customer_id"]]["tier"]
+                remittance["points_earned"] = score(remittance["amount"], remittance["destination_country"], tier)
+            valid.append((index, remittance))
+        
+        point_deltas = {}
+        last_lsn = None
+        for index, remittance in valid:
+            transaction, lsn = self._add_transaction(**remittance)
+            last_lsn = lsn or last_lsn
+            customer_id = remittance["customer_id"]
+            point_deltas[customer_id] = point_deltas.get(customer_id, 0) + remittance["points_earned"]
+            results[index] = {
+                "index": index,
+                "success": True,
+                "transaction_id": transaction["id"],
+                "points_earned": remittance["points_earned"]
+            }
+        # One balance update (and tier recompute) per customer for the whole batch
+        for customer_id, points in point_deltas.items():
+            _, lsn = self._add_points(customer_id, points)
+            last_lsn = lsn or last_lsn
+        # One durability wait for the whole batch
+        self._await_durable(last_lsn)
+        return results
+    
+    def get_customer_transactions(self, customer_id, newest_first=False):
+        transactions = self._transactions_by_customer.get(customer_id, [])
+        if newest_first:
+            return transactions[::-1]
+        return list(transactions)
+    
+    def get_latest_transactions(self, customer_id, limit=5):
+        """Last `limit` transactions for a customer, oldest first"""
+        if limit <= 0:
+            return []
+        return self._transactions_by_customer.get(customer_id, [])[-limit:]
+    
+    def count_customer_transactions(self, customer_id):
+        return len(self._transactions_by_customer.get(customer_id, ()))
+    
+    def get_transaction_version(self, customer_id):
+        # History is append-only, so its length is a version
+        return self.count_customer_transactions(customer_id)
+    
+    def get_transaction_totals(self, customer_id):
+        totals = self._transaction_totals.get(customer_id)
+        return dict(totals) if totals else {"count": 0, "amount": 0, "points_earned": 0}
+    
+    def get_transactions_page(self, customer_id, limit=20, cursor=None):
+        transactions = self._transactions_by_customer.get(customer_id, [])
+        end = len(transactions)
+        position = decode_cursor(cursor)
+        if position:
+            end = self._cursor_index(transactions, *position)
+        start = max(end - limit, 0)
+        page = transactions[start:end][::-1]
+        next_cursor = encode_cursor(page[-1]) if page and start > 0 else None
+        return page, next_cursor
+    
+    def _cursor_index(self, transactions, timestamp, transaction_id):
+        """Index of the cursor's transaction in a time-ordered list"""
+        index = bisect_left(transactions, timestamp, key=lambda t: t["timestamp"])
+        # Several transactions can share a timestamp; find the exact one
+        for i in range(index, len(transactions)):
+            if transactions[i]["timestamp"] != timestamp:
+                break
+            if transactions[i]["id"] == transaction_id:
+                return i
+        return index
+    
+    def iter_customer_transactions(self, customer_id, newest_first=True):
+        transactions = self._transactions_by_customer.get(customer_id, [])
+        return reversed(transactions) if newest_first else iter(transactions)
+    
+    def get_leaderboard_page(self, offset=0, limit=50):
+        """Ranked customer rows; each row is a copy with a `rank` key added"""
+        rows = []
+        for rank, customer_id, _ in self.leaderboard.page(offset, limit):
+            customer = self.customers.get(customer_id)
+            if customer:
+                rows.append(dict(customer, rank=rank))
+        return rows
+    
+    def get_customer_rank(self, customer_id):
+        return self.leaderboard.rank_of(customer_id)
+    
+    def get_leaderboard_version(self):
+        return self.leaderboard.version
+    
+    def get_catalog_version(self):
+        return self._catalog_version
+    
+    def get_stats(self, days=30, top=5):
+        return self.stats.snapshot(days, top)
+    
+    def get_all_gifts(self):
+        return list(self.gifts.values())
+    
+    def get_gift(self, gift_id):
+        return self.gifts.get(gift_id)
+    
+    def add_reward(self, name, description, points_cost, category, image_url=None, available=True):
+        reward_id = str(uuid.uuid4())
+        reward = {
+            "id": reward_id,
+            "name": name,
+            "description": description,
+            "points_cost": points_cost,
+            "category": category,
+            "image_url": image_url,
+            "available": available
+        }
+        self.rewards[reward_id] = reward
+        self._catalog_version += 1
+        self._await_durable(self._log({"op": "reward", "reward": reward}))
+        return reward
+    
+    def update_reward(self, reward_id, **fields):
+        reward = self.rewards.get(reward_id)
+        if not reward:
+            return None
+        reward.update((key, value) for key, value in fields.items() if key in reward and key != "id")
+        self._catalog_version += 1
+        self._await_durable(self._log({"op": "reward", "reward": dict(reward)}))
+        return reward
     
     def get_all_rewards(self):
         return list(self.rewards.values())
@@ -164,25 +500,303 @@ class DataStore:
         if not customer or not reward:
             return None, "Customer or reward not found"
         
-        if customer["points_balance"] < reward["points_cost"]:
+        redemption = self._reserve(customer_id, reward_id, reward["points_cost"])
+        if not redemption:
             return None, "Insufficient points"
+        return redemption, "Reward redeemed successfully"
+    
+    def redeem_gift(self, customer_id, gift_id):
+        customer = self.get_customer(customer_id)
+        gift = self.get_gift(gift_id)
         
-        # Deduct points
-        self.customers[customer_id]["points_balance"] -= reward["points_cost"]
+        if not customer or not gift:
+            return None, "Customer or gift not found"
         
-        # Create redemption record
-        redemption_id = str(uuid.uuid4())
-        redemption = {
-            "id": redemption_id,
-            "customer_id": customer_id,
-            "reward_id": reward_id,
-            "points_used": reward["points_cost"],
-            "timestamp": datetime.now().isoformat(),
-            "status": "completed"
-        }
-        self.redemptions[redemption_id] = redemption
+        redemption = self._reserve(customer_id, gift_id, gift["points_cost"])
+        if not redemption:
+            return None, "Insufficient points"
+        return redemption, "Gift sent successfully"
+    
+    def _reserve(self, customer_id, item_id, points):
+        """Deduct points and record a pending redemption; None if the customer can't afford it"""
+        # Check and deduct under the customer's lock so concurrent redemptions can't double-spend
+        with self._balance_lock(customer_id):
+            customer = self.customers[customer_id]
+            if customer["points_balance"] < points:
+                return None
+            
+            customer["points_balance"] -= points
+            self.leaderboard.update(customer_id, customer["points_balance"])
+            
+            redemption = Redemption(
+                uuid_int=new_uuid_int(),
+                customer_id=customer_id,
+                reward_id=item_id,
+                points_used=points,
+                created_us=now_us(),
+                status="pending"
+            )
+            self.redemptions[redemption.uuid_int] = redemption
+            self.stats.add_redemption(redemption.created_us, points)
+            # Deduction and record go in one journal entry so replay never sees half a redemption
+            lsn = self._log({"op": "redemption", "row": redemption.stored(),
+                             "balance": customer["points_balance"]})
         
-        return redemption, "Reward redeemed successfully"
+        self.events.publish(customer_id, "balance")
+        self._await_durable(lsn)
+        return redemption
+    
+    def get_redemption(self, redemption_id):
+        try:
+            return self.redemptions.get(uuid.UUID(redemption_id).int)
+        except (TypeError, ValueError):
+            return None
+    
+    def get_pending_redemptions(self, created_before_us=None):
+        pending = [redemption for redemption in list(self.redemptions.values())
+                   if redemption.status == "pending"
+                   and (created_before_us is None or redemption.created_us < created_before_us)]
+        pending.sort(key=lambda redemption: redemption.created_us)
+        return pending
+    
+    def claim_redemption(self, redemption_id, owner, lease_seconds):
+        redemption = self.get_redemption(redemption_id)
+        if not redemption or redemption.status != "pending":
+            return False
+        now = time.time()
+        with self._lease_lock:
+            holder, expires = self._leases.get(redemption.id, (owner, 0))
+            if holder != owner and expires > now:
+                return False
+            self._leases[redemption.id] = (owner, now + lease_seconds)
+            return True
+    
+    def complete_redemption(self, redemption_id):
+        """Mark a pending redemption fulfilled; returns it, or None if it wasn't pending"""
+        return self._settle_redemption(redemption_id, "completed")
+    
+    def refund_redemption(self, redemption_id):
+        """Cancel a pending redemption and return its points; returns it, or None if it wasn't pending"""
+        return self._settle_redemption(redemption_id, "refunded")
+    
+    def _settle_redemption(self, redemption_id, status):
+        redemption = self.get_redemption(redemption_id)
+        if not redemption:
+            return None
+        
+        customer_id = redemption.customer_id
+        with self._balance_lock(customer_id):
+            if redemption.status != "pending":
+                return None
+            redemption.status = status
+            record = {"op": "redemption_status", "id": redemption.uuid_int, "status": status}
+            customer = self.customers.get(customer_id)
+            if status == "refunded":
+                self.stats.add_redemption(redemption.created_us, -redemption.points_used)
+            if status == "refunded" and customer:
+                customer["points_balance"] += redemption.points_used
+                self.leaderboard.update(customer_id, customer["points_balance"])
+                record["balance"] = customer["points_balance"]
+            lsn = self._log(record)
+        with self._lease_lock:
+            self._leases.pop(redemption.id, None)
+        
+        if status == "refunded":
+            # A refunded gift never arrives, so the recipient can no longer claim it
+            gift = self.ledger.for_redemption(redemption.id)
+            if gift and self.ledger.transition(gift.uuid_int, "cancelled"):
+                lsn = self._log({"op": "collection_status", "id": gift.uuid_int, "status": "cancelled"})
+            self.events.publish(customer_id, "balance")
+        self._await_durable(lsn)
+        return redemption
+    
+    # --- Money and gifts awaiting collection -----------------------------
+    
+    def add_collection(self, recipient_mukuru_id, kind, sender_name, amount=0, item_name=None, sender_id=None,
+                       recipient_name=None, collection_method=None, verification_method=None, message=None,
+                       redemption_id=None, ttl=None):
+        created_us = now_us()
+        entry = Collection(
+            uuid_int=new_uuid_int(),
+            kind=kind,
+            recipient_key=normalize_mukuru_id(recipient_mukuru_id),
+            sender_name=sender_name,
+            amount=amount,
+            item_name=item_name,
+            sender_id=sender_id,
+            recipient_name=recipient_name,
+            collection_method=collection_method,
+            verification_method=verification_method,
+            message=message,
+            redemption_id=redemption_id,
+            created_us=created_us,
+            expires_us=created_us + int((DEFAULT_TTL if ttl is None else ttl) * 1_000_000)
+        )
+        self.collections[entry.uuid_int] = entry
+        self.ledger.add(entry)
+        self._await_durable(self._log({"op": "collection", "row": entry.stored()}))
+        return entry
+    
+    def get_collection(self, collection_id):
+        try:
+            return self.collections.get(uuid.UUID(collection_id).int)
+        except (TypeError, ValueError):
+            return None
+    
+    def get_pending_collections(self, mukuru_ids, offset=0, limit=20):
+        return self.ledger.pending(mukuru_ids, offset, limit)
+    
+    def claim_collection(self, collection_id, mukuru_ids):
+        try:
+            uuid_int = uuid.UUID(collection_id).int
+        except (TypeError, ValueError):
+            return None
+        entry = self.ledger.transition(uuid_int, "collected", set(mukuru_ids))
+        if entry:
+            self._await_durable(self._log({"op": "collection_status", "id": uuid_int, "status": "collected"}))
+        return entry
+    
+    def expire_collections(self, now=None):
+        lsn = None
+        expired = 0
+        for entry in self.ledger.due(now_us() if now is None else now):
+            # Claimed since due() found it: transition() leaves it alone
+            if self.ledger.transition(entry.uuid_int, "expired"):
+                lsn = self._log({"op": "collection_status", "id": entry.uuid_int, "status": "expired"})
+                expired += 1
+        self._await_durable(lsn)
+        return expired
+    
+    def get_recent_gifts(self, customer_id, mukuru_ids, limit=5):
+        return [dict(entry, type=kind) for kind, entry in self.ledger.recent_gifts(customer_id, mukuru_ids, limit)]
+    
+    # --- Journal and snapshots -------------------------------------------
+    
+    @classmethod
+    def open(cls, directory, snapshot_interval=300, commit_delay=0.0, sample_customers=True):
+        """Load the latest snapshot in `directory`, replay the journal tail, and keep journaling"""
+        store = cls(sample_customers=sample_customers)
+        snapshot = load_latest_snapshot(directory)
+        if snapshot:
+            store._restore(snapshot)
+        last_lsn = store.snapshot_lsn
+        for record in read_records(directory, after_lsn=store.snapshot_lsn):
+            store._apply(record)
+            last_lsn = record["lsn"]
+        store._rebuild_indexes()
+        store.journal = Journal(directory, start_lsn=last_lsn, commit_delay=commit_delay)
+        if snapshot_interval:
+            store._snapshotter = Snapshotter(store, snapshot_interval)
+        return store
+    
+    def close(self):
+        if self._snapshotter:
+            self._snapshotter.stop()
+        if self.journal:
+            self.journal.close()
+        if self.balances is not None:
+            self.balances.close()
+    
+    def _log(self, record):
+        if self.journal is None:
+            return None
+        if self._snapshotter is not None:
+            self._snapshotter.ensure_started()
+        return self.journal.append(record)
+    
+    def _log_balance(self, customer):
+        return self._log({"op": "balance", "customer_id": customer["id"],
+                          "balance": customer["points_balance"], "tier": customer["tier"]})
+    
+    def _await_durable(self, lsn):
+        if lsn is not None:
+            self.journal.wait_durable(lsn)
+    
+    def snapshot(self):
+        """Write a compact snapshot and drop the journal segments it covers.
+        
+        The copy is taken while writes continue. That is safe because every
+        journal record holds absolute state (balances, whole records), so
+        replaying records after the snapshot's LSN converges on the same
+        result whether or not their effects were already captured.
+        """
+        lsn = self.journal.last_lsn
+        self.journal.rotate()
+        state = {
+            "lsn": lsn,
+            "catalog_version": self._catalog_version,
+            "customers": [customer.stored() for customer in list(self.customers.values())],
+            "transactions": [transaction.stored() for transaction in list(self.transactions.values())],
+            "redemptions": [redemption.stored() for redemption in list(self.redemptions.values())],
+            "rewards": list(self.rewards.values()),
+            "gifts": list(self.gifts.values()),
+            "collections": [entry.stored() for entry in list(self.collections.values())],
+        }
+        write_snapshot(self.journal.directory, state)
+        self.snapshot_lsn = lsn
+        self.journal.compact(lsn)
+    
+    def _restore(self, state):
+        self.snapshot_lsn = state["lsn"]
+        self._catalog_version = state["catalog_version"]
+        self.customers = {row[0]: Customer(*row) for row in state["customers"]}
+        self.transactions = {row[0]: Transaction(*row) for row in state["transactions"]}
+        self.redemptions = {row[0]: Redemption(*row) for row in state["redemptions"]}
+        self.rewards = {reward["id"]: reward for reward in state["rewards"]}
+        self.gifts = {gift["id"]: gift for gift in state["gifts"]}
+        self.collections = {row[0]: Collection(*row) for row in state.get("collections", [])}
+    
+    def _apply(self, record):
+        """Redo one journal record; indexes are rebuilt once replay finishes"""
+        op = record["op"]
+        if op == "balance":
+            customer = self.customers.get(record["customer_id"])
+            if customer:
+                customer["points_balance"] = record["balance"]
+                customer["tier"] = record["tier"]
+        elif op == "transaction":
+            transaction = Transaction(*record["row"])
+            self.transactions[transaction.uuid_int] = transaction
+        elif op == "redemption":
+            redemption = Redemption(*record["row"])
+            self.redemptions[redemption.uuid_int] = redemption
+            customer = self.customers.get(redemption.customer_id)
+            if customer:
+                customer["points_balance"] = record["balance"]
+        elif op == "redemption_status":
+            redemption = self.redemptions.get(record["id"])
+            if redemption:
+                redemption.status = record["status"]
+                customer = self.customers.get(redemption.customer_id)
+                if customer and "balance" in record:
+                    customer["points_balance"] = record["balance"]
+        elif op == "customer":
+            customer = Customer(*record["row"])
+            self.customers[customer.id] = customer
+        elif op == "collection":
+            entry = Collection(*record["row"])
+            self.collections[entry.uuid_int] = entry
+        elif op == "collection_status":
+            entry = self.collections.get(record["id"])
+            if entry:
+                entry.status = record["status"]
+        elif op == "reward":
+            self.rewards[record["reward"]["id"]] = record["reward"]
+            self._catalog_version += 1
 
-# Global data store instance
-data_store = DataStore()
+# Global data store instance; set DATABASE_URL to share state across workers through SQL,
+# DATA_DIR to keep the in-memory store but journal and snapshot it to disk, or
+# SHARED_BALANCES to keep it in memory with balances and tiers shared between workers
+if os.environ.get("DATABASE_URL"):
+    from sql_store import SQLDataStore
+    data_store = SQLDataStore(os.environ["DATABASE_URL"], sample_customers=startup.flag("SAMPLE_DATA"))
+elif os.environ.get("DATA_DIR"):
+    data_store = DataStore.open(os.environ["DATA_DIR"],
+                                snapshot_interval=float(os.environ.get("SNAPSHOT_INTERVAL", 300)),
+                                sample_customers=startup.flag("SAMPLE_DATA"))
+elif os.environ.get("SHARED_BALANCES"):
+    data_store = DataStore(balances=BalanceTable(os.environ["SHARED_BALANCES"],
+                                                 capacity=int(os.environ.get("SHARED_BALANCES_CAPACITY", 262144))),
+                           sample_customers=startup.flag("SAMPLE_DATA"))
+else:
+    data_store = DataStore(sample_customers=startup.flag("SAMPLE_DATA"))
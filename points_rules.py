@@ -0,0 +1,242 @@
+"""Points accrual rules: the base rate, tier thresholds and bonus campaigns.
+
+A remittance earns 1 point per R100 sent. Campaigns adjust that for
+some corridors (destination_country), some tiers and a window of time:
+
+    [{"name": "Zim double points", "countries": ["ZW"], "multiplier": 2,
+      "starts": "2026-12-01", "ends": "2027-01-01"},
+     {"name": "Gold bonus", "tiers": ["Gold"], "bonus": 5}]
+
+A campaign without countries or tiers applies to all of them; without
+starts/ends it's open-ended. When several campaigns match, their
+multipliers multiply and their bonuses add:
+points = floor(base x multiplier) + bonus.
+
+RuleSet.points() serves the request path. Campaigns in force are compiled
+into a (country, tier) -> (multiplier, bonus) table, which stays valid
+until the next campaign starts or ends. RuleSet.score_batch() re-scores
+many transactions at once: with NumPy it works column-wise, one pass per
+campaign, and without NumPy it falls back to a Python loop.
+back_apply() uses it to credit a new campaign to past transactions.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import math
+
+from records import now_us
+import startup
+
+# Optional: score_batch() loops in Python without it
+np = startup.optional_import("numpy")
+
+# Highest first: a balance gets the first tier whose threshold it reaches
+TIER_THRESHOLDS = (("Gold", 1000), ("Silver", 500), ("Bronze", 0))
+TIERS = tuple(tier for tier, _ in TIER_THRESHOLDS)
+
+RAND_PER_POINT = 100
+FOREVER = float("inf")
+
+
+def tier_for(balance):
+    for tier, threshold in TIER_THRESHOLDS:
+        if balance >= threshold:
+            return tier
+    return TIERS[-1]
+
+
+def base_points(amount):
+    """1 point per R100 sent"""
+    return int(amount // RAND_PER_POINT)
+
+
+def _apply(base, multiplier, bonus):
+    # Rounded first so 100 x 1.15 is 115, not 114.99999999999999
+    return math.floor(round(base * multiplier, 6)) + bonus
+
+
+def _us(value):
+    """Epoch microseconds for an ISO date/datetime (local time, like record timestamps)"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return int(datetime.fromisoformat(value).timestamp() * 1_000_000)
+
+
+@dataclass(frozen=True)
+class Campaign:
+    name: str
+    multiplier: float = 1.0
+    bonus: int = 0
+    countries: frozenset = None   # None: every corridor
+    tiers: frozenset = None       # None: every tier
+    starts_us: int = None         # None: already running
+    ends_us: int = None           # None: no end; exclusive otherwise
+
+    @classmethod
+    def from_dict(cls, spec):
+        unknown = set(spec) - {"name", "multiplier", "bonus", "countries", "tiers", "starts", "ends"}
+        if unknown:
+            raise ValueError(f"Unknown campaign fields: {', '.join(sorted(unknown))}")
+        countries, tiers = spec.get("countries"), spec.get("tiers")
+        return cls(
+            name=spec["name"],
+            multiplier=float(spec.get("multiplier", 1.0)),
+            bonus=int(spec.get("bonus", 0)),
+            countries=frozenset(countries) if countries else None,
+            tiers=frozenset(tiers) if tiers else None,
+            starts_us=_us(spec.get("starts")),
+            ends_us=_us(spec.get("ends")),
+        )
+
+    def running(self, at_us):
+        return ((self.starts_us is None or self.starts_us <= at_us)
+                and (self.ends_us is None or at_us < self.ends_us))
+
+    def matches(self, destination_country, tier):
+        return ((self.countries is None or destination_country in self.countries)
+                and (self.tiers is None or tier in self.tiers))
+
+
+class PointsTable:
+    """The campaigns running over one stretch of time, flattened for O(1) lookups"""
+
+    def __init__(self, campaigns, valid_from=-FOREVER, valid_until=FOREVER):
+        self.campaigns = campaigns
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+        # (country, tier) -> (multiplier, bonus); country None covers corridors no campaign names
+        self._effects = {}
+        named = set().union(*(campaign.countries for campaign in campaigns if campaign.countries))
+        for tier in TIERS:
+            for country in named | {None}:
+                multiplier, bonus = 1.0, 0
+                for campaign in campaigns:
+                    if campaign.matches(country, tier):
+                        multiplier *= campaign.multiplier
+                        bonus += campaign.bonus
+                self._effects[(country, tier)] = (multiplier, bonus)
+
+    def effect(self, destination_country, tier):
+        return (self._effects.get((destination_country, tier))
+                or self._effects.get((None, tier))
+                or (1.0, 0))
+
+    def points(self, amount, destination_country, tier):
+        multiplier, bonus = self.effect(destination_country, tier)
+        return _apply(base_points(amount), multiplier, bonus)
+
+
+class RuleSet:
+    def __init__(self, campaigns=()):
+        self.campaigns = list(campaigns)
+        self._table = None
+
+    @classmethod
+    def from_dicts(cls, specs):
+        return cls(Campaign.from_dict(spec) for spec in specs)
+
+    @classmethod
+    def load(cls, path):
+        """Campaigns from a JSON file holding a list of campaign objects"""
+        with open(path) as f:
+            return cls.from_dicts(json.load(f))
+
+    def compile(self, at_us):
+        """The table in force at `at_us`, valid until the next campaign boundary"""
+        running = [campaign for campaign in self.campaigns if campaign.running(at_us)]
+        boundaries = [edge for campaign in self.campaigns
+                      for edge in (campaign.starts_us, campaign.ends_us) if edge is not None]
+        return PointsTable(
+            running,
+            valid_from=max((edge for edge in boundaries if edge <= at_us), default=-FOREVER),
+            valid_until=min((edge for edge in boundaries if edge > at_us), default=FOREVER),
+        )
+
+    def table(self, at_us=None):
+        at_us = now_us() if at_us is None else at_us
+        table = self._table
+        if table is None or not table.valid_from <= at_us < table.valid_until:
+            # Rebuilt at most once per campaign boundary; a racing rebuild produces the same table
+            table = self._table = self.compile(at_us)
+        return table
+
+    def points(self, amount, destination_country=None, tier="Bronze", at_us=None):
+        """Points a remittance earns under the campaigns running at `at_us` (default now)"""
+        return self.table(at_us).points(amount, destination_country, tier)
+
+    def score_batch(self, amounts, countries, tiers, created_us, use_numpy=None):
+        """Points for many transactions given as parallel columns; returns a list of ints"""
+        if use_numpy is None:
+            use_numpy = np is not None
+        if not use_numpy:
+            return [
+                _apply(base_points(amount), *self._effect_at(country, tier, at_us))
+                for amount, country, tier, at_us in zip(amounts, countries, tiers, created_us)
+            ]
+
+        amounts = np.asarray(amounts, dtype=np.float64)
+        created_us = np.asarray(created_us, dtype=np.int64)
+        # Fixed-width strings ('' for a missing country) so np.isin can sort them
+        countries = np.array([country or "" for country in countries], dtype=str)
+        tiers = np.array(tiers, dtype=str)
+        multiplier = np.ones(len(amounts))
+        bonus = np.zeros(len(amounts), dtype=np.int64)
+        for campaign in self.campaigns:
+            mask = np.ones(len(amounts), dtype=bool)
+            if campaign.starts_us is not None:
+                mask &= created_us >= campaign.starts_us
+            if campaign.ends_us is not None:
+                mask &= created_us < campaign.ends_us
+            if campaign.countries is not None:
+                mask &= np.isin(countries, list(campaign.countries))
+            if campaign.tiers is not None:
+                mask &= np.isin(tiers, list(campaign.tiers))
+            multiplier[mask] *= campaign.multiplier
+            bonus[mask] += campaign.bonus
+        base = np.floor_divide(amounts, RAND_PER_POINT)
+        return (np.floor(np.round(base * multiplier, 6)).astype(np.int64) + bonus).tolist()
+
+    def _effect_at(self, destination_country, tier, at_us):
+        multiplier, bonus = 1.0, 0
+        for campaign in self.campaigns:
+            if campaign.running(at_us) and campaign.matches(destination_country, tier):
+                multiplier *= campaign.multiplier
+                bonus += campaign.bonus
+        return multiplier, bonus
+
+
+def _created_us(transaction):
+    created = getattr(transaction, "created_us", None)
+    return created if created is not None else _us(transaction["timestamp"])
+
+
+def back_apply(store, campaign, rules=None, dry_run=False):
+    """Credit `campaign` to every past transaction it covers, as if it had been running.
+
+    Each customer gets the difference between the points their
+    transactions earn under `rules` plus the campaign and under `rules`
+    alone. Customers' current tiers stand in for the tier at the time.
+    Returns {customer_id: points credited}. Running it twice credits twice.
+    """
+    rules = rules or RuleSet()
+    with_campaign = RuleSet(rules.campaigns + [campaign])
+    owners, amounts, countries, tiers, created = [], [], [], [], []
+    for customer in store.get_all_customers():
+        for transaction in store.iter_customer_transactions(customer["id"]):
+            owners.append(customer["id"])
+            amounts.append(transaction["amount"])
+            countries.append(transaction["destination_country"])
+            tiers.append(customer["tier"])
+            created.append(_created_us(transaction))
+
+    before = rules.score_batch(amounts, countries, tiers, created)
+    after = with_campaign.score_batch(amounts, countries, tiers, created)
+    credits = {}
+    for customer_id, old, new in zip(owners, before, after):
+        if new != old:
+            credits[customer_id] = credits.get(customer_id, 0) + new - old
+    credits = {customer_id: points for customer_id, points in credits.items() if points > 0}
+    if not dry_run:
+        for customer_id, points in credits.items():
+            store.update_customer_points(customer_id, points)
+    return credits
@@ -0,0 +1,188 @@
+"""Token-bucket rate limiting and load shedding for write endpoints.
+
+Each limited endpoint has a (rate, burst) bucket per logged-in customer,
+or per client IP before login. A saturated worker sheds those endpoints
+with a fast 503 instead of queueing them behind the backlog; over-limit
+callers get 429. Both carry Retry-After.
+
+Anonymous callers are keyed on request.remote_addr. Behind a proxy, set
+TRUSTED_PROXY_HOPS (see app.py) so that is the client's address;
+otherwise every anonymous caller shares the proxy's bucket.
+
+Buckets live in this process by default. Set RATE_LIMIT_URL to a SQL
+database (see sql_store.SQLBucketStore) to share them between gunicorn
+workers. RATE_LIMIT_ENABLED=0 turns the whole layer off.
+"""
+from collections import OrderedDict
+import math
+import os
+import threading
+import time
+
+from flask import g, jsonify, request, session
+
+# endpoint -> (tokens per second, burst)
+DEFAULT_LIMITS = {
+    "login": (1.0, 10),
+    "issue_token": (1.0, 10),
+    "process_remittance": (2.0, 20),
+    "redeem_reward": (1.0, 10),
+}
+
+
+class MemoryBucketStore:
+    """Token buckets in this process, LRU-bounded so a flood of distinct keys can't grow it forever"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Spend one token; returns 0 when allowed, else seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class LoadShedder:
+    """Decides when this process is too busy to take more writes.
+
+    Busy means more than `max_in_flight` requests running here, or the
+    request waited longer than `max_queue_wait` seconds before a worker
+    picked it up. Queue wait comes from an X-Request-Start header stamped
+    by the proxy (nginx "t=${msec}", or epoch milli/microseconds).
+    """
+
+    def __init__(self, max_in_flight=64, max_queue_wait=0.5):
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def check(self, request_start=None):
+        """Seconds the client should back off, or 0 to accept the request"""
+        if self.in_flight > self.max_in_flight:
+            return 1.0
+        waited = queue_wait(request_start)
+        if self.max_queue_wait and waited > self.max_queue_wait:
+            return waited
+        return 0.0
+
+
+def queue_wait(header, now=None):
+    """Seconds since the proxy's X-Request-Start stamp (0 if missing or unparseable)"""
+    if not header:
+        return 0.0
+    try:
+        stamp = float(header[2:] if header.startswith("t=") else header)
+    except ValueError:
+        return 0.0
+    if stamp > 1e14:
+        stamp /= 1e6   # microseconds
+    elif stamp > 1e11:
+        stamp /= 1e3   # milliseconds
+    return max(0.0, (time.time() if now is None else now) - stamp)
+
+
+def _reject(status, message, retry_after):
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _session_customer_id():
+    return session.get('customer_id')
+
+
+class RateLimiter:
+    def __init__(self, limits, store, shedder, identify=_session_customer_id):
+        self.limits = limits
+        self.store = store
+        self.shedder = shedder
+        self.identify = identify
+        self.limited = 0
+        self.shed = 0
+
+    def before_request(self):
+        self.shedder.enter()
+        g._in_flight = True
+        limit = self.limits.get(request.endpoint)
+        if limit is None:
+            return None
+
+        # Shed before touching the buckets: a saturated worker should answer as cheaply as possible
+        retry_after = self.shedder.check(request.headers.get("X-Request-Start"))
+        if retry_after:
+            self.shed += 1
+            return _reject(503, 'Service busy, please try again shortly', retry_after)
+
+        customer_id = self.identify()
+        key = f"customer:{customer_id}" if customer_id else f"ip:{request.remote_addr}"
+        retry_after = self.store.take(f"{request.endpoint}:{key}", *limit)
+        if retry_after:
+            self.limited += 1
+            return _reject(429, 'Too many requests, please slow down', retry_after)
+        return None
+
+    def teardown_request(self, exc):
+        if g.pop("_in_flight", None):
+            self.shedder.exit()
+
+
+def _env_enabled():
+    return os.environ.get("RATE_LIMIT_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+
+
+def init_app(app, enabled=None, limits=None, store=None, shedder=None, identify=None):
+    """Install the limiter on the app; returns it, or None when disabled.
+
+    `identify()` returns the caller's customer id (or None) for keying buckets;
+    the session's by default.
+    """
+    if enabled is None:
+        enabled = _env_enabled()
+    if not enabled:
+        return None
+
+    if store is None:
+        url = os.environ.get("RATE_LIMIT_URL")
+        if url:
+            from sql_store import SQLBucketStore
+            store = SQLBucketStore(url)
+        else:
+            store = MemoryBucketStore()
+    if shedder is None:
+        # Below the worker's thread count: a gthread worker can't run more requests than it has
+        # threads, so a limit at or above it would never shed anything
+        threads = int(os.environ.get("GUNICORN_THREADS", 64))
+        shedder = LoadShedder(
+            max_in_flight=int(os.environ.get("SHED_MAX_IN_FLIGHT", max(1, threads * 3 // 4))),
+            max_queue_wait=float(os.environ.get("SHED_MAX_QUEUE_WAIT", 0.5)),
+        )
+
+    limiter = RateLimiter(DEFAULT_LIMITS if limits is None else limits, store, shedder,
+                          identify or _session_customer_id)
+    app.before_request(limiter.before_request)
+    app.teardown_request(limiter.teardown_request)
+    app.extensions["rate_limiter"] = limiter
+    return limiter
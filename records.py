@@ -0,0 +1,169 @@
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import datetime
+import time
+import uuid
+
+
+def now_us():
+    """Current time as integer microseconds since the epoch"""
+    return time.time_ns() // 1000
+
+
+def iso_from_us(timestamp_us):
+    """Local ISO string for an epoch-microsecond timestamp, same format as datetime.now().isoformat()"""
+    seconds, micros = divmod(timestamp_us, 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micros).isoformat()
+
+
+def new_uuid_int():
+    return uuid.uuid4().int
+
+
+def uuid_str(value):
+    return str(uuid.UUID(int=value))
+
+
+class Record(Mapping):
+    """Read-mostly mapping view over a slotted record.
+
+    Subclasses list their public keys in KEYS; each key is read with
+    getattr, so stored fields and computed properties (string ids, ISO
+    timestamps) look the same to templates, jsonify and dict(record).
+    Only keys in WRITABLE can be assigned through record[key] = value.
+    """
+
+    __slots__ = ()
+    KEYS = ()
+    WRITABLE = ()
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.WRITABLE:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def stored(self):
+        """Stored field values in declaration order; Cls(*record.stored()) rebuilds the record"""
+        return [getattr(self, name) for name in self.__slots__]
+
+
+@dataclass(slots=True, eq=False)
+class Customer(Record):
+    KEYS = ("id", "name", "email", "phone", "points_balance", "tier", "joined_date")
+    WRITABLE = ("name", "email", "phone", "points_balance", "tier")
+
+    id: str
+    name: str
+    email: str
+    phone: str = None
+    points_balance: int = 0
+    tier: str = "Bronze"
+    joined_us: int = 0
+
+    @property
+    def joined_date(self):
+        return iso_from_us(self.joined_us)
+
+
+@dataclass(slots=True, eq=False)
+class Transaction(Record):
+    KEYS = ("id", "customer_id", "amount", "recipient", "points_earned", "destination_country",
+            "verification_method", "verification_value", "timestamp", "type")
+
+    uuid_int: int
+    customer_id: str
+    amount: float
+    recipient: str
+    points_earned: int
+    destination_country: str = None
+    verification_method: str = None
+    verification_value: str = None
+    created_us: int = 0
+
+    # Every stored transaction is a remittance; a class constant costs no per-record memory
+    type = "remittance"
+
+    @property
+    def id(self):
+        return uuid_str(self.uuid_int)
+
+    @property
+    def timestamp(self):
+        return iso_from_us(self.created_us)
+
+
+@dataclass(slots=True, eq=False)
+class Redemption(Record):
+    KEYS = ("id", "customer_id", "reward_id", "points_used", "timestamp", "status")
+    WRITABLE = ("status",)
+
+    uuid_int: int
+    customer_id: str
+    reward_id: str
+    points_used: int
+    created_us: int = 0
+    status: str = "pending"   # -> "completed" or "refunded" once fulfilment finishes
+
+    @property
+    def id(self):
+        return uuid_str(self.uuid_int)
+
+    @property
+    def timestamp(self):
+        return iso_from_us(self.created_us)
+
+
+def collection_reference(collection_id):
+    """Short reference printed for the recipient and quoted at the counter"""
+    return f"MUK-{collection_id[:8].upper()}"
+
+
+@dataclass(slots=True, eq=False)
+class Collection(Record):
+    KEYS = ("id", "kind", "recipient_key", "sender_id", "sender_name", "recipient_name", "amount",
+            "item_name", "collection_method", "verification_method", "message", "redemption_id",
+            "reference", "timestamp", "expires_at", "status")
+    WRITABLE = ("status",)
+
+    uuid_int: int
+    kind: str                         # "money" or "gift"
+    recipient_key: str                # normalize_mukuru_id() of who may collect it
+    sender_name: str
+    amount: float = 0                 # rand for money, the gift's points cost for a gift
+    item_name: str = None
+    sender_id: str = None
+    recipient_name: str = None
+    collection_method: str = None
+    verification_method: str = None
+    message: str = None
+    redemption_id: str = None         # a gift's redemption, which fulfilment may refund
+    created_us: int = 0
+    expires_us: int = 0
+    status: str = "pending"           # -> "collected", "expired", or "cancelled" if a gift is refunded
+
+    @property
+    def id(self):
+        return uuid_str(self.uuid_int)
+
+    @property
+    def reference(self):
+        return collection_reference(self.id)
+
+    @property
+    def timestamp(self):
+        return iso_from_us(self.created_us)
+
+    @property
+    def expires_at(self):
+        return iso_from_us(self.expires_us)
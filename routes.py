@@ -1,7 +1,97 @@
-from flask import render_template, request, jsonify, session, redirect, url_for, flash
+from flask import render_template, request, jsonify, session, redirect, url_for, flash, g, Response
 from app import app
 from models import data_store
+from auth import TokenAuth, login_required
+from catalog import CatalogCache
+from fragments import cached_page
+from fulfilment import TERMINAL_STATUSES, FulfilmentQueue, StubProvider
+from idempotency import IdempotencyCache, committed, idempotent, mark_committed
+from ledger import CollectionSweeper
+from points_rules import RuleSet
+from storage import customer_mukuru_ids
+from velocity import VelocityChecker, VelocityExceeded
+import csv
+import hmac
+import io
+import json
 import logging
+import math
+import os
+import threading
+import time
+
+# Rows handed to the store per call when streaming NDJSON settlement files
+BULK_CHUNK_SIZE = 1000
+
+# Transactions per page on the history view
+HISTORY_PAGE_SIZE = 50
+
+# Pending collections per page on Receive & Collect
+COLLECTIONS_PAGE_SIZE = 10
+
+# Longest a redemption status stream stays open before the client reconnects
+STATUS_STREAM_SECONDS = 60
+
+# Live balance/rank streams: how long one stays open before the browser reconnects, and how
+# often an idle one re-reads balance and rank (picking up other customers' moves and other workers' writes)
+EVENT_STREAM_SECONDS = int(os.environ.get('EVENT_STREAM_SECONDS', 300))
+EVENT_POLL_SECONDS = float(os.environ.get('EVENT_POLL_SECONDS', 10))
+
+# Longest a /api/events long-poll waits before answering with no events
+LONG_POLL_SECONDS = 25
+
+# Streams and long-polls hold a worker thread each (a greenlet under gevent). Past this many open at
+# once, streams answer 503 and long-polls answer at once, so ordinary requests keep some threads.
+# Defaults to half of GUNICORN_THREADS; gunicorn.conf.py raises it when gevent is in use.
+EVENT_STREAM_MAX = int(os.environ.get('EVENT_STREAM_MAX', int(os.environ.get('GUNICORN_THREADS', 64)) // 2))
+event_slots = threading.BoundedSemaphore(EVENT_STREAM_MAX) if EVENT_STREAM_MAX > 0 else None
+
+catalog_cache = CatalogCache(data_store)
+
+# Bonus campaigns (see points_rules.py); none unless CAMPAIGNS_FILE names a JSON list of them
+points_rules = RuleSet.load(os.environ['CAMPAIGNS_FILE']) if os.environ.get('CAMPAIGNS_FILE') else RuleSet()
+
+# Bearer tokens for API clients (the web UI keeps using the session cookie)
+token_auth = TokenAuth(
+    data_store,
+    app.secret_key,
+    ttl=int(os.environ.get('API_TOKEN_TTL', 3600)),
+    cache_ttl=float(os.environ.get('API_TOKEN_CACHE_TTL', 60)),
+)
+
+# Responses to recent Idempotency-Key requests, so client retries don't repeat the work
+idempotency_cache = IdempotencyCache(
+    max_entries=int(os.environ.get('IDEMPOTENCY_MAX_KEYS', 10000)),
+    ttl=float(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600)),
+)
+
+# Per-customer and per-recipient limits on value moved per minute/hour/day (VELOCITY_ENABLED=0 turns them off).
+# Counted per worker process: under N gunicorn workers the effective limits are up to N times these
+velocity = VelocityChecker(
+    limits=None if os.environ.get('VELOCITY_ENABLED', '1').lower() not in ('0', 'false', 'no', 'off') else {},
+    max_keys=int(os.environ.get('VELOCITY_MAX_KEYS', 100000)),
+)
+
+# Vouchers and airtime are sent in the background; requests only reserve the points
+fulfilment = FulfilmentQueue(
+    data_store,
+    StubProvider(latency=float(os.environ.get('FULFILMENT_STUB_LATENCY', 0.2))),
+    workers=int(os.environ.get('FULFILMENT_WORKERS', 4)),
+    # Redemptions left pending by a restart are picked up again after this many seconds
+    resume_after=float(os.environ.get('FULFILMENT_RESUME_AFTER', 60)),
+    # How long a worker holds a redemption it is fulfilling before another may take it over
+    lease=float(os.environ.get('FULFILMENT_LEASE', 300)),
+)
+# Started by the first request in each serving process, not at import, so a preloading
+# gunicorn master doesn't run jobs of its own
+app.before_request(fulfilment.start)
+
+# Money and gifts wait COLLECTION_TTL seconds to be collected; the sweeper expires the rest
+COLLECTION_TTL = float(os.environ.get('COLLECTION_TTL', 30 * 24 * 3600))
+collection_sweeper = CollectionSweeper(data_store, interval=float(os.environ.get('COLLECTION_SWEEP_INTERVAL', 60)))
+
+EXPORT_FIELDS = ['id', 'timestamp', 'amount', 'recipient', 'destination_country',
+                 'points_earned', 'verification_method', 'type']
 
 @app.route('/')
 def index():
@@ -9,20 +99,42 @@ def index():
     customers = data_store.get_all_customers()
     return render_template('index.html', customers=customers)
 
+def _velocity_rejected(exceeded):
+    response = jsonify({'success': False, 'message': exceeded.message})
+    if exceeded.retry_after is None:
+        # Larger than a limit allows at all: retrying can't help
+        return response, 422
+    response.headers['Retry-After'] = str(exceeded.retry_after)
+    return response, 429
+
+def _request_fields():
+    """Form fields, or the object in a JSON body, so API clients can post either"""
+    if request.is_json:
+        body = request.get_json(silent=True)
+        return body if isinstance(body, dict) else {}
+    return request.form
+
+def _text(fields, name):
+    value = fields.get(name)
+    return str(value).strip() if value is not None else ''
+
+def _check_login(email, password):
+    """The customer for a valid email/password pair, else None"""
+    # Find customer by email
+    customer = data_store.find_customer_by_email(email.lower())
+    if customer and password == 'demo123':  # Simple demo password
+        return customer
+    return None
+
 @app.route('/login', methods=['POST'])
 def login():
     """Handle user login"""
     email = request.form.get('email', '').strip().lower()
     password = request.form.get('password', '')
     
-    # Find customer by email
-    customer = None
-    for customer_data in data_store.get_all_customers():
-        if customer_data['email'].lower() == email:
-            customer = customer_data
-            break
+    customer = _check_login(email, password)
     
-    if customer and password == 'demo123':  # Simple demo password
+    if customer:
         session['customer_id'] = customer['id']
         return jsonify({
             'success': True,
@@ -35,6 +147,22 @@ def login():
             'message': 'Invalid email or password. Use demo123 as password for demo accounts.'
         })
 
+@app.route('/api/token', methods=['POST'])
+def issue_token():
+    """Exchange email and password for a bearer token (JSON or form body)"""
+    fields = _request_fields()
+    customer = _check_login(_text(fields, 'email'), _text(fields, 'password'))
+    if not customer:
+        return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
+    
+    token, expires_in = token_auth.issue(customer['id'])
+    return jsonify({
+        'success': True,
+        'token': token,
+        'token_type': 'Bearer',
+        'expires_in': expires_in
+    })
+
 @app.route('/select_customer/<customer_id>')
 def select_customer(customer_id):
     """Legacy customer selection for backwards compatibility"""
@@ -47,54 +175,47 @@ def select_customer(customer_id):
         return redirect(url_for('index'))
 
 @app.route('/dashboard')
+@login_required(token_auth, page=True)
 def dashboard():
     """Customer dashboard showing points balance and overview"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return redirect(url_for('index'))
-    
-    customer = data_store.get_customer(customer_id)
-    if not customer:
-        flash('Customer not found', 'error')
-        return redirect(url_for('index'))
+    customer_id, customer = g.customer_id, g.customer
     
-    recent_transactions = data_store.get_customer_transactions(customer_id)[-5:]  # Last 5 transactions
-    total_transactions = len(data_store.get_customer_transactions(customer_id))
+    # Versions are read before the data, so a fragment is never stored under a newer version than its rows
+    transaction_version = data_store.get_transaction_version(customer_id)
+    recent_transactions = data_store.get_latest_transactions(customer_id, 5)  # Last 5 transactions
+    total_transactions = data_store.count_customer_transactions(customer_id)
     
     return render_template('dashboard.html', 
                          customer=customer, 
                          recent_transactions=recent_transactions,
-                         total_transactions=total_transactions)
+                         total_transactions=total_transactions,
+                         transaction_version=transaction_version)
 
 @app.route('/send_money')
+@login_required(token_auth, page=True)
 def send_money():
     """Send money page"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return redirect(url_for('index'))
-    
-    customer = data_store.get_customer(customer_id)
-    if not customer:
-        flash('Customer not found', 'error')
-        return redirect(url_for('index'))
+    customer_id, customer = g.customer_id, g.customer
     
     return render_template('send_money.html', customer=customer)
 
 @app.route('/process_remittance', methods=['POST'])
+@login_required(token_auth)
+@idempotent(idempotency_cache)
 def process_remittance():
     """Process remittance transaction and award points"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return jsonify({'success': False, 'message': 'Not logged in'})
+    customer_id = g.customer_id
+    fields = _request_fields()
+    reservation = None
     
     try:
-        amount = float(request.form.get('amount', 0))
-        recipient = request.form.get('recipient', '').strip()
-        destination_country = request.form.get('destination_country', '').strip()
-        mukuru_card = request.form.get('mukuru_card', '').strip()
-        id_number = request.form.get('id_number', '').strip()
+        amount = float(fields.get('amount') or 0)
+        recipient = _text(fields, 'recipient')
+        destination_country = _text(fields, 'destination_country')
+        mukuru_card = _text(fields, 'mukuru_card')
+        id_number = _text(fields, 'id_number')
         
-        if amount <= 0:
+        if not math.isfinite(amount) or amount <= 0:
             return jsonify({'success': False, 'message': 'Invalid amount'})
         
         if not recipient:
@@ -103,14 +224,23 @@ def process_remittance():
         if not destination_country:
             return jsonify({'success': False, 'message': 'Please select a destination country'})
         
-        # Calculate points: 1 point per R100 sent
-        points_earned = int(amount // 100)
+        # 1 point per R100 sent, adjusted by any campaign running for this corridor and tier
+        points_earned = points_rules.points(amount, destination_country, g.customer['tier'])
+        
+        try:
+            reservation = velocity.admit('remittance', customer_id, amount,
+                                         recipient=f"{destination_country}:{recipient.casefold()}")
+        except VelocityExceeded as e:
+            return _velocity_rejected(e)
         
         # Update customer points
         customer = data_store.update_customer_points(customer_id, points_earned)
         
         if not customer:
+            reservation.release()
             return jsonify({'success': False, 'message': 'Customer not found'})
+        # The points are awarded: from here on a retry with the same Idempotency-Key gets this answer back
+        mark_committed()
         
         # Get country information for display
         country_info = {
@@ -147,49 +277,134 @@ def process_remittance():
     except ValueError:
         return jsonify({'success': False, 'message': 'Invalid amount format'})
     except Exception as e:
-        logging.error(f"Error processing remittance: {e}")
-        return jsonify({'success': False, 'message': 'Transaction failed'})
+        logging.error("Error processing remittance: %s", e)
+        if committed():
+            # Stored under the Idempotency-Key, so a retry can't award the points twice
+            return jsonify({'success': False,
+                            'message': 'Your points were awarded but the transaction was not recorded; '
+                                       'please contact support rather than resending'}), 500
+        if reservation:
+            reservation.release()
+        # Nothing was written, so an Idempotency-Key retry gets a fresh attempt instead of this answer replayed
+        return jsonify({'success': False, 'message': 'Transaction failed'}), 500
+
+def _iter_ndjson(stream):
+    """Yield one parsed row per line without reading the whole body into memory"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+def _valid_api_key(env_name):
+    api_key = os.environ.get(env_name)
+    return bool(api_key) and hmac.compare_digest(request.headers.get('X-API-Key', ''), api_key)
+
+@app.route('/api/remittances/bulk', methods=['POST'])
+def bulk_remittances():
+    """Ingest a partner settlement file as a JSON array or NDJSON stream"""
+    if not _valid_api_key('PARTNER_API_KEY'):
+        return jsonify({'success': False, 'message': 'Invalid API key'}), 403
+    
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        rows = _iter_ndjson(request.stream)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return jsonify({'success': False, 'message': 'Expected a JSON array of remittances'}), 400
+    
+    try:
+        results = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                results.extend(_bulk_chunk(chunk, len(results)))
+                chunk = []
+        if chunk:
+            results.extend(_bulk_chunk(chunk, len(results)))
+    except Exception as e:
+        logging.error("Error processing bulk remittances: %s", e)
+        return jsonify({'success': False, 'message': 'Bulk ingestion failed'}), 500
+    
+    succeeded = sum(1 for result in results if result['success'])
+    return jsonify({
+        'success': True,
+        'processed': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    })
+
+@app.route('/api/stats')
+def api_stats():
+    """Operational stats for internal dashboards, keyed by STATS_API_KEY"""
+    if not _valid_api_key('STATS_API_KEY'):
+        return jsonify({'success': False, 'message': 'Invalid API key'}), 403
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    top = min(max(request.args.get('top', 5, type=int), 1), 50)
+    return jsonify({'success': True, 'stats': data_store.get_stats(days, top)})
+
+def _bulk_chunk(chunk, offset):
+    results = data_store.add_transactions_bulk(chunk, score=points_rules.points)
+    for result in results:
+        result['index'] += offset
+    return results
 
 @app.route('/rewards')
+@login_required(token_auth, page=True)
 def rewards():
     """Rewards marketplace"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return redirect(url_for('index'))
-    
-    customer = data_store.get_customer(customer_id)
-    if not customer:
-        flash('Customer not found', 'error')
-        return redirect(url_for('index'))
+    customer_id, customer = g.customer_id, g.customer
     
-    rewards = data_store.get_all_rewards()
-    
-    # Group rewards by category
-    categories = {}
-    for reward in rewards:
-        category = reward['category']
-        if category not in categories:
-            categories[category] = []
-        categories[category].append(reward)
+    # Grouping is precomputed and only rebuilt when the catalog changes
+    catalog = catalog_cache.get()
     
     return render_template('rewards.html', 
                          customer=customer, 
-                         categories=categories,
-                         rewards=rewards)
+                         categories=catalog.categories,
+                         rewards=catalog.rewards,
+                         catalog_version=catalog.version)
+
+@app.route('/api/catalog')
+def catalog_api():
+    """Rewards and gift catalog as JSON, revalidated with ETag / If-None-Match"""
+    catalog = catalog_cache.get()
+    if catalog.etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(catalog.payload, mimetype='application/json')
+    response.set_etag(catalog.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/redeem_reward', methods=['POST'])
+@login_required(token_auth)
+@idempotent(idempotency_cache)
 def redeem_reward():
     """Redeem a reward using points"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return jsonify({'success': False, 'message': 'Not logged in'})
+    customer_id = g.customer_id
+    reservation = None
     
     try:
-        reward_id = request.form.get('reward_id')
+        reward_id = _text(_request_fields(), 'reward_id')
+        
+        reward = data_store.get_reward(reward_id)
+        try:
+            reservation = velocity.admit('redemption', customer_id, reward['points_cost'] if reward else 0)
+        except VelocityExceeded as e:
+            return _velocity_rejected(e)
         
         redemption, message = data_store.redeem_reward(customer_id, reward_id)
+        if not redemption:
+            reservation.release()
         
         if redemption:
+            # The points are spent: from here on a retry with the same Idempotency-Key gets this answer back
+            mark_committed()
+            fulfilment.submit(redemption['id'], 'reward')
             customer = data_store.get_customer(customer_id)
             if not customer:
                 return jsonify({'success': False, 'message': 'Customer not found'})
@@ -197,36 +412,78 @@ def redeem_reward():
                 'success': True,
                 'message': message,
                 'new_balance': customer['points_balance'],
-                'redemption_id': redemption['id']
+                'redemption_id': redemption['id'],
+                'status': redemption['status'],
+                'status_url': url_for('redemption_status', redemption_id=redemption['id'])
             })
         else:
             return jsonify({'success': False, 'message': message})
             
     except Exception as e:
-        logging.error(f"Error redeeming reward: {e}")
-        return jsonify({'success': False, 'message': 'Redemption failed'})
+        logging.error("Error redeeming reward: %s", e)
+        if committed():
+            # Stored under the Idempotency-Key; a pending redemption is picked up by the fulfilment resume pass
+            return jsonify({'success': False,
+                            'message': 'Your reward was redeemed but could not be confirmed; '
+                                       'check your redemptions rather than redeeming again'}), 500
+        if reservation:
+            reservation.release()
+        return jsonify({'success': False, 'message': 'Redemption failed'}), 500
 
 @app.route('/transaction_history')
+@login_required(token_auth, page=True)
 def transaction_history():
     """View complete transaction history"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return redirect(url_for('index'))
-    
-    customer = data_store.get_customer(customer_id)
-    if not customer:
-        flash('Customer not found', 'error')
-        return redirect(url_for('index'))
+    customer_id, customer = g.customer_id, g.customer
     
-    transactions = data_store.get_customer_transactions(customer_id)
-    # Sort by timestamp descending (newest first)
-    transactions.sort(key=lambda x: x['timestamp'], reverse=True)
+    # One newest-first page at a time; totals come precomputed from the store
+    cursor = request.args.get('cursor')
+    transaction_version = data_store.get_transaction_version(customer_id)
+    transactions, next_cursor = data_store.get_transactions_page(customer_id, HISTORY_PAGE_SIZE, cursor)
+    totals = data_store.get_transaction_totals(customer_id)
     
     return render_template('transaction_history.html', 
                          customer=customer, 
-                         transactions=transactions)
+                         transactions=transactions,
+                         totals=totals,
+                         cursor=cursor,
+                         next_cursor=next_cursor,
+                         transaction_version=transaction_version)
+
+def _export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        # Hand each line to the client as soon as it's written
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+def _export_ndjson(rows):
+    for row in rows:
+        yield json.dumps({field: row.get(field) for field in EXPORT_FIELDS}) + '\n'
+
+@app.route('/transaction_history/export')
+@login_required(token_auth, page=True)
+def export_transactions():
+    """Stream the full transaction history as CSV or NDJSON"""
+    customer_id = g.customer_id
+    
+    rows = data_store.iter_customer_transactions(customer_id, newest_first=True)
+    if request.args.get('format') == 'ndjson':
+        body, mimetype, extension = _export_ndjson(rows), 'application/x-ndjson', 'ndjson'
+    else:
+        body, mimetype, extension = _export_csv(rows), 'text/csv', 'csv'
+    
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=transactions.{extension}'
+    })
 
 @app.route('/demo')
+@cached_page(vary=lambda: bool(session.get('customer_id')))
 def demo_presentation():
     """Demo presentation page"""
     return render_template('demo_presentation.html')
@@ -234,16 +491,27 @@ def demo_presentation():
 @app.route('/leaderboard')
 def leaderboard():
     """Customer leaderboard showing top earners"""
-    customers = data_store.get_all_customers()
-    
-    # Sort customers by points balance in descending order
-    sorted_customers = sorted(customers, key=lambda x: x['points_balance'], reverse=True)
-    
-    # Add rank to each customer
-    for i, customer in enumerate(sorted_customers):
-        customer['rank'] = i + 1
-    
-    return render_template('leaderboard.html', customers=sorted_customers)
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+    per_page = 50
+    
+    # Ranked rows come from the maintained leaderboard; customer records are not touched
+    leaderboard_version = data_store.get_leaderboard_version()
+    customers = data_store.get_leaderboard_page((page - 1) * per_page, per_page)
+    total = data_store.count_customers()
+    
+    viewer_id = token_auth.customer_id()
+    my_rank = data_store.get_customer_rank(viewer_id) if viewer_id else None
+    
+    # Rows are cached per leaderboard version; only the viewer's own row renders differently
+    viewer_on_page = next((row['id'] for row in customers if row['id'] == viewer_id), '')
+    
+    return render_template('leaderboard.html',
+                         customers=customers,
+                         page=page,
+                         has_next=page * per_page < total,
+                         my_rank=my_rank,
+                         leaderboard_version=leaderboard_version,
+                         viewer_on_page=viewer_on_page)
 
 @app.route('/logout')
 def logout():
@@ -267,105 +535,80 @@ def not_found(error):
     return render_template('index.html'), 404
 
 @app.route('/receive_collect')
+@login_required(token_auth, page=True)
 def receive_collect():
     """Receive & Collect page for money collections and gift sending"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return redirect(url_for('index'))
+    customer_id, customer = g.customer_id, g.customer
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+    collection_sweeper.ensure_started()
     
-    customer = data_store.get_customer(customer_id)
-    if not customer:
-        flash('Customer not found', 'error')
-        return redirect(url_for('index'))
+    # Money and gifts addressed to any of the customer's Mukuru IDs, read from the ledger's index
+    mukuru_ids = customer_mukuru_ids(customer)
+    pending_collections, total = data_store.get_pending_collections(
+        mukuru_ids, (page - 1) * COLLECTIONS_PAGE_SIZE, COLLECTIONS_PAGE_SIZE)
     
-    # Mock data for pending collections (in real app, this would come from database)
-    pending_collections = [
-        {
-            'id': 'COL001',
-            'sender_name': 'Alice Johnson',
-            'amount': 'R 1,500.00',
-            'date': '2 days ago',
-            'reference': 'MUK-COL-001',
-            'collection_method': 'Bank Transfer',
-            'verification_method': 'mukuru_card'
-        },
-        {
-            'id': 'COL002', 
-            'sender_name': 'David Wilson',
-            'amount': 'R 750.00',
-            'date': '1 day ago',
-            'reference': 'MUK-COL-002',
-            'collection_method': 'Cash Pickup',
-            'verification_method': 'id_number'
-        }
-    ]
-    
-    # Available gifts from rewards catalog
-    available_gifts = [
-        {'id': 'airtime50', 'name': 'R50 Airtime', 'description': 'Mobile airtime voucher', 'points_cost': 50, 'icon': 'fas fa-mobile-alt'},
-        {'id': 'grocery100', 'name': 'R100 Grocery Voucher', 'description': 'Shoprite/Checkers voucher', 'points_cost': 100, 'icon': 'fas fa-shopping-cart'},
-        {'id': 'fuel200', 'name': 'R200 Fuel Voucher', 'description': 'Shell/BP fuel voucher', 'points_cost': 200, 'icon': 'fas fa-gas-pump'},
-        {'id': 'entertainment500', 'name': 'R500 Entertainment', 'description': 'Netflix/Showmax voucher', 'points_cost': 500, 'icon': 'fas fa-film'}
-    ]
-    
-    # Recent gift activity (mock data)
-    recent_gifts = [
-        {'type': 'sent', 'reward_name': 'R50 Airtime', 'recipient_name': 'John Doe', 'date': '2 days ago'},
-        {'type': 'received', 'reward_name': 'R100 Grocery Voucher', 'sender_name': 'Sarah Smith', 'date': '5 days ago'}
-    ]
+    # Available gifts from the cached catalog
+    available_gifts = catalog_cache.get().gifts
+    
+    recent_gifts = data_store.get_recent_gifts(customer_id, mukuru_ids)
     
     return render_template('receive_collect.html', 
                          customer=customer, 
                          pending_collections=pending_collections,
+                         page=page,
+                         has_next=page * COLLECTIONS_PAGE_SIZE < total,
                          available_gifts=available_gifts,
                          recent_gifts=recent_gifts)
 
+@app.route('/api/collections')
+@login_required(token_auth)
+def collections_api():
+    """Pending money and gifts for the logged-in customer, `limit` at a time from `offset`"""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', COLLECTIONS_PAGE_SIZE, type=int), 1), 100)
+    collection_sweeper.ensure_started()
+    
+    rows, total = data_store.get_pending_collections(customer_mukuru_ids(g.customer), offset, limit)
+    return jsonify({'success': True, 'collections': [dict(row) for row in rows],
+                    'total': total, 'offset': offset, 'limit': limit})
+
 @app.route('/collect_money', methods=['POST'])
+@login_required(token_auth)
 def collect_money():
     """Handle money collection"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return jsonify({'success': False, 'message': 'Not logged in'})
-    
-    collection_id = request.form.get('collection_id')
+    collection_id = _text(_request_fields(), 'collection_id')
     
     if not collection_id:
         return jsonify({'success': False, 'message': 'Invalid collection ID'})
     
-    # In real app, mark collection as completed in database
-    return jsonify({
-        'success': True,
-        'message': f'Money collected successfully! Collection ID: {collection_id}'
-    })
+    collection_sweeper.ensure_started()
+    collection = data_store.claim_collection(collection_id, customer_mukuru_ids(g.customer))
+    if not collection:
+        return jsonify({'success': False, 'message': 'Nothing waiting to collect under that reference'}), 404
+    
+    if collection['kind'] == 'gift':
+        message = f"{collection['item_name']} from {collection['sender_name']} collected!"
+    else:
+        message = f"R {collection['amount']:,.2f} collected successfully! Reference: {collection['reference']}"
+    return jsonify({'success': True, 'message': message, 'collection': dict(collection)})
 
 @app.route('/send_gift', methods=['POST'])
+@login_required(token_auth)
+@idempotent(idempotency_cache)
 def send_gift():
     """Handle gift sending to Mukuru users"""
-    customer_id = session.get('customer_id')
-    if not customer_id:
-        return jsonify({'success': False, 'message': 'Not logged in'})
+    customer_id, customer = g.customer_id, g.customer
     
-    customer = data_store.get_customer(customer_id)
-    if not customer:
-        return jsonify({'success': False, 'message': 'Customer not found'})
-    
-    gift_id = request.form.get('gift_id')
-    recipient = request.form.get('gift_recipient', '').strip()
-    recipient_mukuru_id = request.form.get('recipient_mukuru_id', '').strip()
-    message = request.form.get('gift_message', '').strip()
+    fields = _request_fields()
+    gift_id = _text(fields, 'gift_id')
+    recipient = _text(fields, 'gift_recipient')
+    recipient_mukuru_id = _text(fields, 'recipient_mukuru_id')
+    message = _text(fields, 'gift_message')
     
     if not all([gift_id, recipient, recipient_mukuru_id]):
         return jsonify({'success': False, 'message': 'All fields are required'})
     
-    # Mock gift costs
-    gift_costs = {
-        'airtime50': 50,
-        'grocery100': 100,
-        'fuel200': 200,
-        'entertainment500': 500
-    }
-    
-    gift_cost = gift_costs.get(gift_id or '', 0)
+    gift_cost = catalog_cache.get().gift_costs.get(gift_id or '', 0)
     
     if gift_cost == 0:
         return jsonify({'success': False, 'message': 'Invalid gift selected'})
@@ -373,16 +616,216 @@ def send_gift():
     if customer['points_balance'] < gift_cost:
         return jsonify({'success': False, 'message': 'Insufficient points for this gift'})
     
-    # Deduct points
-    data_store.customers[customer_id]['points_balance'] -= gift_cost
+    try:
+        reservation = velocity.admit('gift', customer_id, gift_cost, recipient=recipient_mukuru_id)
+    except VelocityExceeded as e:
+        return _velocity_rejected(e)
+    
+    try:
+        # Reserve the points; the voucher goes out from the fulfilment queue
+        redemption, _ = data_store.redeem_gift(customer_id, gift_id)
+    except Exception as e:
+        logging.error("Error sending gift: %s", e)
+        reservation.release()
+        return jsonify({'success': False, 'message': 'Gift failed'}), 500
+    if not redemption:
+        reservation.release()
+        return jsonify({'success': False, 'message': 'Insufficient points for this gift'})
+    # The points are spent: from here on a retry with the same Idempotency-Key gets this answer back
+    mark_committed()
+    
+    try:
+        # The recipient sees it under Receive & Collect until they claim it or it expires
+        collection_sweeper.ensure_started()
+        data_store.add_collection(recipient_mukuru_id, 'gift', customer['name'],
+                                  amount=gift_cost,
+                                  item_name=data_store.get_gift(gift_id)['name'],
+                                  sender_id=customer_id,
+                                  recipient_name=recipient,
+                                  message=message,
+                                  redemption_id=redemption['id'],
+                                  ttl=COLLECTION_TTL)
+    except Exception as e:
+        logging.error("Error sending gift: %s", e)
+        # Nothing has gone out yet: hand the points back so a retry starts over
+        if not _refund_quietly(redemption['id']):
+            return jsonify({'success': False,
+                            'message': 'Your gift could not be delivered; please contact support '
+                                       'rather than sending it again'}), 500
+        reservation.release()
+        mark_committed(False)
+        return jsonify({'success': False, 'message': 'Gift failed'}), 500
     
-    # In real app, create gift transaction record and send notification to recipient
+    try:
+        fulfilment.submit(redemption['id'], 'gift', recipient=recipient,
+                          recipient_mukuru_id=recipient_mukuru_id, message=message)
+    except Exception as e:
+        # Still pending, so the fulfilment resume pass sends it later
+        logging.error("Error queueing gift %s: %s", redemption['id'], e)
     
     return jsonify({
         'success': True,
-        'message': f'Gift sent successfully to {recipient}! They will receive a notification.'
+        'message': f'Gift sent successfully to {recipient}! They will receive a notification.',
+        'redemption_id': redemption['id'],
+        'status': redemption['status'],
+        'status_url': url_for('redemption_status', redemption_id=redemption['id'])
     })
 
+def _refund_quietly(redemption_id):
+    try:
+        return data_store.refund_redemption(redemption_id) is not None
+    except Exception as e:
+        logging.error("Error refunding %s: %s", redemption_id, e)
+        return False
+
+def _own_redemption(redemption_id):
+    """The logged-in customer's redemption, or None"""
+    redemption = data_store.get_redemption(redemption_id)
+    if not redemption or redemption['customer_id'] != g.customer_id:
+        return None
+    return redemption
+
+@app.route('/api/redemptions/<redemption_id>')
+@login_required(token_auth)
+def redemption_status(redemption_id):
+    """Poll the fulfilment status of a reward or gift"""
+    redemption = _own_redemption(redemption_id)
+    if not redemption:
+        return jsonify({'success': False, 'message': 'Redemption not found'}), 404
+    return jsonify({'success': True, 'redemption': dict(redemption)})
+
+@app.route('/api/redemptions/<redemption_id>/stream')
+@login_required(token_auth)
+def redemption_status_stream(redemption_id):
+    """Server-sent events: one 'status' event per change until the redemption settles"""
+    if not _own_redemption(redemption_id):
+        return jsonify({'success': False, 'message': 'Redemption not found'}), 404
+    
+    def events():
+        deadline = time.monotonic() + STATUS_STREAM_SECONDS
+        last_status = None
+        while True:
+            redemption = data_store.get_redemption(redemption_id)
+            if redemption['status'] != last_status:
+                last_status = redemption['status']
+                yield f"event: status\ndata: {json.dumps(dict(redemption))}\n\n"
+            if last_status in TERMINAL_STATUSES or time.monotonic() >= deadline:
+                return
+            fulfilment.wait_for_change(timeout=15)
+            yield ": keepalive\n\n"
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _live_state(customer_id):
+    customer = data_store.get_customer(customer_id)
+    if not customer:
+        return None
+    return {
+        'points_balance': customer['points_balance'],
+        'tier': customer['tier'],
+        'rank': data_store.get_customer_rank(customer_id)
+    }
+
+def _state_changes(old, new):
+    """(event, data) pairs for what differs between two live states"""
+    changes = []
+    if old['points_balance'] != new['points_balance'] or old['tier'] != new['tier']:
+        changes.append(('balance', {'points_balance': new['points_balance'], 'tier': new['tier']}))
+    if old['tier'] != new['tier']:
+        changes.append(('tier', {'tier': new['tier'], 'previous': old['tier']}))
+    if old['rank'] != new['rank']:
+        changes.append(('rank', {'rank': new['rank'], 'previous': old['rank']}))
+    return changes
+
+@app.route('/api/events/stream')
+@login_required(token_auth)
+def event_stream():
+    """Server-sent events for the logged-in customer: a 'snapshot' on connect, then
+    'balance', 'tier', 'rank' and 'transaction' events as they happen"""
+    customer_id = g.customer_id
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    
+    slots = event_slots
+    if slots is None or not slots.acquire(blocking=False):
+        # The page falls back to polling /api/events
+        response = jsonify({'success': False, 'message': 'Too many live connections'})
+        response.headers['Retry-After'] = str(int(EVENT_POLL_SECONDS))
+        return response, 503
+    
+    def events():
+        channel = data_store.events.open(customer_id)
+        try:
+            # A reconnecting browser resumes after the last transaction it saw
+            cursor = int(last_event_id) if last_event_id.isdigit() else data_store.events.cursor(channel)
+            state = _live_state(customer_id)
+            yield f"retry: 3000\nevent: snapshot\ndata: {json.dumps(state)}\n\n"
+            deadline = time.monotonic() + EVENT_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                new_events = data_store.events.wait(channel, cursor, EVENT_POLL_SECONDS)
+                for seq, name, data in new_events:
+                    if name == 'transaction':
+                        yield f"id: {seq}\nevent: transaction\ndata: {json.dumps(dict(data))}\n\n"
+                    cursor = seq
+                new_state = _live_state(customer_id)
+                if new_state is None:
+                    return
+                changes = _state_changes(state, new_state)
+                for name, data in changes:
+                    yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+                if not new_events and not changes:
+                    yield ": keepalive\n\n"
+                state = new_state
+        finally:
+            data_store.events.close(channel)
+    
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs even if the body is never iterated (client gone before the first chunk)
+    response.call_on_close(slots.release)
+    return response
+
+@app.route('/api/events')
+@login_required(token_auth)
+def poll_events():
+    """Long-poll fallback for clients without EventSource.
+    
+    Returns the events after `after` (waiting up to LONG_POLL_SECONDS for one),
+    the current balance/tier/rank, and the cursor to pass next time. The first
+    call, without `after`, answers at once. So does any call while EVENT_STREAM_MAX
+    connections are already held, with `retry_after` telling the client how long
+    to wait before polling again.
+    """
+    customer_id = g.customer_id
+    after = request.args.get('after', type=int)
+    
+    slots = event_slots
+    held = after is not None and slots is not None and slots.acquire(blocking=False)
+    channel = data_store.events.open(customer_id)
+    try:
+        if after is None:
+            new_events, cursor = [], data_store.events.cursor(channel)
+        else:
+            new_events = data_store.events.wait(channel, after, LONG_POLL_SECONDS if held else 0)
+            cursor = new_events[-1][0] if new_events else after
+    finally:
+        data_store.events.close(channel)
+        if held:
+            slots.release()
+    
+    state = _live_state(customer_id)
+    if state is None:
+        return jsonify({'success': False, 'message': 'Customer not found'}), 404
+    body = {
+        'success': True,
+        'events': [{'id': seq, 'event': name, 'data': data} for seq, name, data in new_events],
+        'state': state,
+        'cursor': cursor
+    }
+    if after is not None and not held:
+        body['retry_after'] = EVENT_POLL_SECONDS
+    return jsonify(body)
+
 @app.errorhandler(500)
 def internal_error(error):
     return render_template('index.html'), 500
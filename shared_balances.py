@@ -0,0 +1,357 @@
+"""Customer balances and tiers in a fixed-layout table shared by worker processes.
+
+Under gunicorn every worker imports models.py and builds its own
+DataStore, so balances drift apart between workers. Point SHARED_BALANCES
+at a file (ideally on tmpfs, e.g. /dev/shm/mukuru-balances) and each
+worker maps the same file instead:
+
+* the file is a header plus `capacity` 64-byte slots. A customer id
+  hashes to a slot (linear probing); slots are never moved or freed, so
+  each process caches id -> slot;
+* writers hold a striped fcntl byte-range lock, plus a thread lock since
+  fcntl locks belong to the whole process, so read-modify-writes such as
+  "deduct if affordable" are atomic across processes;
+* each slot has a sequence number that is odd while a write is in
+  progress, so readers take no lock and retry instead of seeing half an
+  update. A reader that keeps finding it odd takes the stripe lock
+  instead; since fcntl locks die with their process, an odd seq seen
+  under the lock was left by a writer that crashed, and is repaired.
+
+Reads go straight to the mapping: a customer's balance is unpacked from
+its slot, and ranking works on a NumPy view over the slots without
+copying them. Only balances and tiers are shared. Profiles, transactions
+and redemptions stay per process; use DATABASE_URL when those must be
+shared too.
+"""
+from contextlib import contextmanager
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from points_rules import TIERS
+from records import Customer
+import startup
+
+# Optional: ranking falls back to a cached Python sort
+np = startup.optional_import("numpy")
+
+MAGIC = b"MKBAL001"
+STRIPES = 64
+# magic, capacity, slots in use, then one write counter per lock stripe
+HEADER = struct.Struct(f"<8sQQ{STRIPES}Q")
+HEADER_SIZE = 1024
+# seq, tier index, balance, join order (0 = free), customer id
+SLOT = struct.Struct("<IB3xqQ40s")
+STATE = struct.Struct("<IB3xq")
+SEQ = struct.Struct("<I")
+COUNTER = struct.Struct("<Q")
+KEY_OFFSET = 24
+KEY_SIZE = 40
+USED_OFFSET = 16
+COUNTERS_OFFSET = 24
+# Lock bytes: 0..STRIPES-1 guard slot writes, STRIPES guards slot allocation
+ALLOC_LOCK = STRIPES
+# Lock-free read attempts before a reader falls back to the stripe lock
+READ_RETRIES = 100
+
+class BalanceTableFull(Exception):
+    pass
+
+
+class BalanceTable:
+    def __init__(self, path, capacity=262144):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # The first process to open the file sizes it; later ones adopt its capacity
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, ALLOC_LOCK)
+        try:
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, HEADER_SIZE + capacity * SLOT.size)
+                os.pwrite(fd, MAGIC + COUNTER.pack(capacity), 0)
+            magic, capacity = struct.unpack("<8sQ", os.pread(fd, 16, 0))
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, ALLOC_LOCK)
+        if magic != MAGIC:
+            os.close(fd)
+            raise ValueError(f"{path} is not a balance table")
+        self.path = path
+        self.capacity = capacity
+        self._fd = fd
+        self._map = mmap.mmap(fd, HEADER_SIZE + capacity * SLOT.size)
+        self._rows = None
+        self._slots = {}   # customer_id -> slot
+        self._thread_locks = [threading.RLock() for _ in range(STRIPES)]
+        self._depth = [0] * STRIPES   # re-entry count per stripe, guarded by that stripe's thread lock
+        self._alloc_lock = threading.Lock()
+        # Customers attached to this table read their balance and tier through it
+        self.customer_class = type("SharedCustomer", (SharedCustomer,), {"__slots__": (), "table": self})
+
+    def close(self):
+        self._rows = None
+        self._map.close()
+        os.close(self._fd)
+
+    def __len__(self):
+        return COUNTER.unpack_from(self._map, USED_OFFSET)[0]
+
+    def version(self):
+        """Bumped by every write in any process; a cache key for rankings"""
+        return sum(HEADER.unpack_from(self._map)[3:])
+
+    @staticmethod
+    def _key(customer_id):
+        key = str(customer_id).encode()
+        if len(key) > KEY_SIZE:
+            raise ValueError(f"Customer id longer than {KEY_SIZE} bytes: {customer_id!r}")
+        return key
+
+    def _offset(self, slot):
+        return HEADER_SIZE + slot * SLOT.size
+
+    def _key_at(self, slot):
+        offset = self._offset(slot) + KEY_OFFSET
+        return self._map[offset:offset + KEY_SIZE].rstrip(b"\0")
+
+    def slot(self, customer_id, create=False, balance=0, tier="Bronze"):
+        """The customer's slot, or None; with create, allocate one seeded with balance/tier"""
+        slot = self._slots.get(customer_id)
+        if slot is None:
+            key = self._key(customer_id)
+            slot = self._probe(key)
+            if slot is None and create:
+                slot = self._allocate(key, balance, tier)
+            if slot is not None:
+                self._slots[customer_id] = slot
+        return slot
+
+    def _probe(self, key):
+        start = zlib.crc32(key) % self.capacity
+        for step in range(self.capacity):
+            slot = (start + step) % self.capacity
+            found = self._key_at(slot)
+            if found == key:
+                return slot
+            if not found:
+                return None
+        return None
+
+    def _allocate(self, key, balance, tier):
+        with self._alloc_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, ALLOC_LOCK)
+            try:
+                # Probe again: another process may have added the key since
+                start = zlib.crc32(key) % self.capacity
+                for step in range(self.capacity):
+                    slot = (start + step) % self.capacity
+                    found = self._key_at(slot)
+                    if found == key:
+                        return slot
+                    if not found:
+                        break
+                else:
+                    raise BalanceTableFull(f"{self.path} has no free slots (capacity {self.capacity})")
+                order = len(self) + 1
+                with self.lock(key.decode()):
+                    SLOT.pack_into(self._map, self._offset(slot), 0, TIERS.index(tier), balance, order, key)
+                    COUNTER.pack_into(self._map, USED_OFFSET, order)
+                    self._bump(key.decode())
+                return slot
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, ALLOC_LOCK)
+
+    @staticmethod
+    def _stripe(customer_id):
+        return zlib.crc32(str(customer_id).encode()) % STRIPES
+
+    @contextmanager
+    def lock(self, customer_id):
+        """Exclusive, across threads and processes, for every customer on this one's stripe"""
+        stripe = self._stripe(customer_id)
+        with self._thread_locks[stripe]:
+            if not self._depth[stripe]:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            self._depth[stripe] += 1
+            try:
+                yield
+            finally:
+                self._depth[stripe] -= 1
+                if not self._depth[stripe]:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    def _bump(self, customer_id):
+        offset = COUNTERS_OFFSET + self._stripe(customer_id) * COUNTER.size
+        COUNTER.pack_into(self._map, offset, COUNTER.unpack_from(self._map, offset)[0] + 1)
+
+    def get(self, customer_id):
+        """(balance, tier) for a customer, or None if they have no slot"""
+        slot = self.slot(customer_id)
+        if slot is None:
+            return None
+        offset = self._offset(slot)
+        for _ in range(READ_RETRIES):
+            seq, tier, balance = STATE.unpack_from(self._map, offset)
+            if not seq & 1 and SEQ.unpack_from(self._map, offset)[0] == seq:
+                return balance, TIERS[tier]
+        with self.lock(customer_id):
+            seq, tier, balance = STATE.unpack_from(self._map, offset)
+            if seq & 1:
+                self._repair(offset, seq)
+            return balance, TIERS[tier]
+
+    def _repair(self, offset, seq):
+        # Only called under the stripe lock, so no live writer owns this odd seq
+        SEQ.pack_into(self._map, offset, (seq + 1) & 0xFFFFFFFF)
+
+    def set(self, customer_id, balance=None, tier=None):
+        """Overwrite a customer's balance and/or tier.
+
+        For a read-modify-write, hold lock(customer_id) around the read and
+        the set; the lock is re-entrant.
+        """
+        slot = self.slot(customer_id, create=True)
+        offset = self._offset(slot)
+        with self.lock(customer_id):
+            seq, old_tier, old_balance = STATE.unpack_from(self._map, offset)
+            # An odd seq here was left by a writer that died mid-update; write over it
+            seq |= 1
+            SEQ.pack_into(self._map, offset, seq)
+            STATE.pack_into(self._map, offset, seq,
+                            old_tier if tier is None else TIERS.index(tier),
+                            old_balance if balance is None else balance)
+            SEQ.pack_into(self._map, offset, (seq + 1) & 0xFFFFFFFF)
+            self._bump(customer_id)
+
+    def attach(self, customer):
+        """Give a Customer a slot and make its balance and tier read and write through the table.
+
+        A customer new to the table seeds its slot from the record; one
+        another process already added keeps the table's values.
+        """
+        if not isinstance(customer, SharedCustomer):
+            self.slot(customer.id, create=True, balance=customer.points_balance, tier=customer.tier)
+            customer.__class__ = self.customer_class
+        return customer
+
+    def rows(self):
+        """Zero-copy NumPy view over every slot (free ones have order 0)"""
+        if self._rows is None:
+            dtype = np.dtype([("seq", "<u4"), ("tier", "u1"), ("pad", "V3"),
+                              ("balance", "<i8"), ("order", "<u8"), ("key", f"S{KEY_SIZE}")])
+            self._rows = np.frombuffer(self._map, dtype=dtype, count=self.capacity, offset=HEADER_SIZE)
+        return self._rows
+
+    def scan(self):
+        """(balance, order, customer_id) for every customer in the table"""
+        view = memoryview(self._map)[HEADER_SIZE:]
+        try:
+            return [(balance, order, key.rstrip(b"\0").decode())
+                    for _, _, balance, order, key in SLOT.iter_unpack(view) if order]
+        finally:
+            view.release()
+
+
+class SharedCustomer(Customer):
+    """A Customer whose points_balance and tier live in a BalanceTable"""
+
+    __slots__ = ()
+    table = None   # set on each table's own subclass
+
+    @property
+    def points_balance(self):
+        return self.table.get(self.id)[0]
+
+    @points_balance.setter
+    def points_balance(self, value):
+        self.table.set(self.id, balance=value)
+
+    @property
+    def tier(self):
+        return self.table.get(self.id)[1]
+
+    @tier.setter
+    def tier(self, value):
+        self.table.set(self.id, tier=value)
+
+    def stored(self):
+        return [getattr(self, name) for name in Customer.__slots__]
+
+
+class SharedLeaderboard:
+    """The Leaderboard interface over a BalanceTable, so every process ranks the same balances.
+
+    Balances are already in the table, so update() has nothing to do.
+    Ranks are worked out from the slots when asked: with NumPy, one
+    vectorized pass over the table (argpartition for a page); without
+    it, a sort that is cached until the table's next write.
+
+    Unlike BalanceTable.get, ranking reads the slots without checking
+    their sequence numbers, so a balance being written at that moment may
+    be seen mid-update. Ranks and page rows are a display snapshot, off by
+    at most the writes in flight; read a balance through get() when it has
+    to be exact.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._touched = 0
+        self._sorted = (None, [])   # (table version, rows sorted by rank) for the Python path
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def version(self):
+        return self.table.version() + self._touched
+
+    def update(self, customer_id, points):
+        pass
+
+    def touch(self):
+        self._touched += 1
+
+    def _ranked(self):
+        version = self.table.version()
+        if self._sorted[0] != version:
+            self._sorted = (version, sorted(self.table.scan(), key=lambda row: (-row[0], row[1])))
+        return self._sorted[1]
+
+    def rank_of(self, customer_id):
+        """1-based rank of a customer, or None if they are not in the table"""
+        slot = self.table.slot(customer_id)
+        if slot is None:
+            return None
+        if np is None:
+            for rank, (_, _, key) in enumerate(self._ranked(), 1):
+                if key == customer_id:
+                    return rank
+            return None
+        rows = self.table.rows()
+        balance, order = rows["balance"], rows["order"]
+        mine = rows[slot]
+        ahead = (balance > mine["balance"]) | ((balance == mine["balance"]) & (order < mine["order"]))
+        return int(np.count_nonzero(ahead & (order > 0))) + 1
+
+    def page(self, offset=0, limit=50):
+        """(rank, customer_id, points) rows starting at a 0-based offset"""
+        if offset < 0 or limit <= 0:
+            return []
+        end = offset + limit
+        if np is None:
+            return [(offset + i + 1, key, balance)
+                    for i, (balance, _, key) in enumerate(self._ranked()[offset:end])]
+        rows = self.table.rows()
+        used = np.flatnonzero(rows["order"])
+        balance = rows["balance"][used]
+        if end < len(used):
+            # Only customers at or above the end-th highest balance can be on the page
+            cutoff = -np.partition(-balance, end - 1)[end - 1]
+            keep = balance >= cutoff
+            used, balance = used[keep], balance[keep]
+        ranked = used[np.lexsort((rows["order"][used], -balance))][offset:end]
+        return [(offset + i + 1, rows["key"][slot].decode(), int(rows["balance"][slot]))
+                for i, slot in enumerate(ranked)]
+
+    def top(self, k=10):
+        return self.page(0, k)
@@ -0,0 +1,784 @@
+from datetime import datetime, timedelta
+import os
+import time
+import uuid
+
+from sqlalchemy import (
+    Boolean, Column, Float, Index, Integer, MetaData, String, Table, and_, case,
+    create_engine, delete, func, insert, or_, select, update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
+
+from events import EventBus
+from ledger import DEFAULT_TTL
+from points_rules import TIER_THRESHOLDS
+from records import collection_reference, iso_from_us
+from storage import (
+    Storage, decode_cursor, encode_cursor, normalize_email, normalize_mukuru_id, normalize_phone,
+    validate_remittance,
+)
+
+metadata = MetaData()
+
+customers = Table(
+    "customers", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("name", String(120), nullable=False),
+    Column("email", String(254), nullable=False, unique=True, index=True),
+    Column("phone", String(32)),
+    Column("points_balance", Integer, nullable=False, default=0),
+    Column("tier", String(16), nullable=False, default="Bronze"),
+    Column("joined_date", String(32)),
+    # normalize_phone(phone), kept alongside so phone lookups can use an index
+    Column("phone_key", String(32), index=True),
+    Index("ix_customers_points_balance", "points_balance"),
+)
+# Login looks customers up by lower(email)
+Index("ix_customers_email_lower", func.lower(customers.c.email), unique=True)
+
+# Everything except the internal lookup key, so rows match DataStore's dicts
+customer_columns = [column for column in customers.c if column.name != "phone_key"]
+
+transactions = Table(
+    "transactions", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("customer_id", String(36), nullable=False, index=True),
+    Column("amount", Float, nullable=False),
+    Column("recipient", String(120)),
+    Column("points_earned", Integer, nullable=False, default=0),
+    Column("destination_country", String(8)),
+    Column("verification_method", String(32)),
+    Column("verification_value", String(64)),
+    Column("timestamp", String(32), nullable=False, index=True),
+    Column("type", String(16), nullable=False, default="remittance"),
+    # History pages read one customer's rows in time order
+    Index("ix_transactions_customer_timestamp", "customer_id", "timestamp"),
+)
+
+rewards = Table(
+    "rewards", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("name", String(120), nullable=False),
+    Column("description", String(255)),
+    Column("points_cost", Integer, nullable=False),
+    Column("category", String(32), index=True),
+    Column("image_url", String(512)),
+    Column("available", Boolean, nullable=False, default=True),
+)
+
+gifts = Table(
+    "gifts", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("name", String(120), nullable=False),
+    Column("description", String(255)),
+    Column("points_cost", Integer, nullable=False),
+    Column("icon", String(64)),
+)
+
+# Single row whose version is bumped in the same transaction as any catalog edit,
+# so every worker can tell cheaply whether its cached catalog is stale
+catalog_meta = Table(
+    "catalog_meta", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False, default=0),
+)
+
+redemptions = Table(
+    "redemptions", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("customer_id", String(36), nullable=False, index=True),
+    Column("reward_id", String(36), nullable=False),
+    Column("points_used", Integer, nullable=False),
+    Column("timestamp", String(32), nullable=False, index=True),
+    Column("status", String(16), nullable=False),
+)
+
+# Who is fulfilling a pending redemption, so two workers don't both call the provider for it
+redemption_leases = Table(
+    "redemption_leases", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("owner", String(120), nullable=False),
+    Column("lease_until", Float, nullable=False),
+)
+
+# Money and gifts waiting for their recipients
+collections = Table(
+    "collections", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("kind", String(16), nullable=False),
+    # normalize_mukuru_id() of who may collect it
+    Column("recipient_key", String(120), nullable=False),
+    Column("sender_id", String(36), index=True),
+    Column("sender_name", String(120), nullable=False),
+    Column("recipient_name", String(120)),
+    Column("amount", Float, nullable=False, default=0),
+    Column("item_name", String(120)),
+    Column("collection_method", String(32)),
+    Column("verification_method", String(32)),
+    Column("message", String(255)),
+    Column("redemption_id", String(36), index=True),
+    Column("timestamp", String(32), nullable=False),
+    Column("expires_at", String(32), nullable=False),
+    Column("status", String(16), nullable=False, default="pending"),
+    # A recipient's pending page, in time order; and the sweep for expired pending rows
+    Index("ix_collections_recipient_status_timestamp", "recipient_key", "status", "timestamp"),
+    Index("ix_collections_status_expires_at", "status", "expires_at"),
+)
+
+# Token buckets for ratelimit.py when RATE_LIMIT_URL points here
+rate_buckets = Table(
+    "rate_buckets", metadata,
+    Column("key", String(200), primary_key=True),
+    Column("tokens", Float, nullable=False),
+    Column("updated", Float, nullable=False),
+)
+
+
+def _collection_row(row):
+    entry = dict(row._mapping)
+    entry["reference"] = collection_reference(entry["id"])
+    return entry
+
+
+def _tier_for(balance):
+    """SQL expression for the tier a balance belongs to (same thresholds as DataStore)"""
+    *ranked, (lowest, _) = TIER_THRESHOLDS
+    return case(*((balance >= threshold, tier) for tier, threshold in ranked), else_=lowest)
+
+
+def create_store_engine(url):
+    """Pooled engine; in-memory SQLite shares one connection so every thread sees the same data"""
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        return create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(
+        url,
+        pool_size=int(os.environ.get("DATABASE_POOL_SIZE", 10)),
+        max_overflow=int(os.environ.get("DATABASE_MAX_OVERFLOW", 20)),
+        pool_pre_ping=True,
+        pool_recycle=1800,
+    )
+
+
+class SQLDataStore(Storage):
+    """DataStore backed by a SQL database through SQLAlchemy Core.
+
+    Balance changes are single conditional UPDATE statements, so several
+    gunicorn workers (or hosts) can share one Postgres database safely.
+    """
+
+    def __init__(self, url, seed=True, sample_customers=True):
+        self.engine = create_store_engine(url)
+        metadata.create_all(self.engine)
+        # Only sees writes made through this process; live streams poll for the rest
+        self.events = EventBus()
+        if seed:
+            self._seed_sample_data(sample_customers)
+
+    def _seed_sample_data(self, sample_customers=True):
+        from models import DataStore
+
+        with self.engine.begin() as conn:
+            # The catalog row is written once, whether or not the demo customers came with it
+            if conn.execute(select(func.count()).select_from(catalog_meta)).scalar():
+                return
+            sample = DataStore(sample_customers=sample_customers)
+            conn.execute(insert(rewards), list(sample.rewards.values()))
+            conn.execute(insert(gifts), list(sample.gifts.values()))
+            if sample.customers:
+                conn.execute(insert(customers), [
+                    dict(customer, phone_key=normalize_phone(customer["phone"]))
+                    for customer in sample.customers.values()
+                ])
+                conn.execute(insert(collections), [
+                    {column.name: entry[column.name] for column in collections.c}
+                    for entry in sample.collections.values()
+                ])
+            conn.execute(insert(catalog_meta), {"id": 1, "version": 0})
+
+    def _fetch_customer(self, conn, customer_id, where=None):
+        if where is None:
+            where = customers.c.id == customer_id
+        row = conn.execute(select(*customer_columns).where(where)).first()
+        return dict(row._mapping) if row else None
+
+    def get_customer(self, customer_id):
+        with self.engine.connect() as conn:
+            return self._fetch_customer(conn, customer_id)
+
+    def get_all_customers(self):
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(select(*customer_columns))]
+
+    def count_customers(self):
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(customers)).scalar()
+
+    def find_customer_by_email(self, email):
+        with self.engine.connect() as conn:
+            return self._fetch_customer(conn, None, func.lower(customers.c.email) == normalize_email(email))
+
+    def find_customer_by_phone(self, phone):
+        key = normalize_phone(phone)
+        if not key:
+            return None
+        with self.engine.connect() as conn:
+            return self._fetch_customer(conn, None, customers.c.phone_key == key)
+
+    def add_customer(self, name, email, phone=None):
+        customer = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "email": email.strip(),
+            "phone": phone,
+            "points_balance": 0,
+            "tier": "Bronze",
+            "joined_date": datetime.now().isoformat()
+        }
+        try:
+            with self.engine.begin() as conn:
+                if self._fetch_customer(conn, None, func.lower(customers.c.email) == normalize_email(email)):
+                    return None
+                conn.execute(insert(customers), dict(customer, phone_key=normalize_phone(phone)))
+        except IntegrityError:
+            # Lost a race with another worker registering the same email
+            return None
+        return customer
+
+    def update_customer(self, customer_id, name=None, email=None, phone=None):
+        values = {}
+        if name is not None:
+            values["name"] = name
+        if email is not None:
+            values["email"] = email.strip()
+        if phone is not None:
+            values["phone"] = phone
+            values["phone_key"] = normalize_phone(phone)
+        try:
+            with self.engine.begin() as conn:
+                if email is not None:
+                    owner = self._fetch_customer(conn, None, func.lower(customers.c.email) == normalize_email(email))
+                    if owner and owner["id"] != customer_id:
+                        return None
+                if values:
+                    conn.execute(update(customers).where(customers.c.id == customer_id).values(**values))
+                return self._fetch_customer(conn, customer_id)
+        except IntegrityError:
+            return None
+
+    def update_customer_points(self, customer_id, points_to_add):
+        # normalize and guard
+        try:
+            points_to_add = int(points_to_add)
+        except Exception:
+            points_to_add = 0
+        if points_to_add < 0:
+            points_to_add = 0
+        new_balance = customers.c.points_balance + points_to_add
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(customers)
+                .where(customers.c.id == customer_id)
+                .values(points_balance=new_balance, tier=_tier_for(new_balance))
+            )
+            if result.rowcount != 1:
+                return None
+            customer = self._fetch_customer(conn, customer_id)
+        self.events.publish(customer_id, "balance")
+        return customer
+
+    def deduct_customer_points(self, customer_id, points):
+        if points < 0:
+            return None
+        with self.engine.begin() as conn:
+            if not self._deduct(conn, customer_id, points):
+                return None
+            customer = self._fetch_customer(conn, customer_id)
+        self.events.publish(customer_id, "balance")
+        return customer
+
+    def _deduct(self, conn, customer_id, points):
+        # Check and deduct in one statement so concurrent workers can't double-spend
+        result = conn.execute(
+            update(customers)
+            .where(and_(customers.c.id == customer_id, customers.c.points_balance >= points))
+            .values(points_balance=customers.c.points_balance - points)
+        )
+        return result.rowcount == 1
+
+    def add_transaction(self, customer_id, amount, recipient, points_earned, destination_country=None, verification_method=None, verification_value=None):
+        transaction = {
+            "id": str(uuid.uuid4()),
+            "customer_id": customer_id,
+            "amount": amount,
+            "recipient": recipient,
+            "points_earned": points_earned,
+            "destination_country": destination_country,
+            "verification_method": verification_method,
+            "verification_value": verification_value,
+            "timestamp": datetime.now().isoformat(),
+            "type": "remittance"
+        }
+        with self.engine.begin() as conn:
+            conn.execute(insert(transactions), transaction)
+        self.events.publish(customer_id, "transaction", transaction)
+        return transaction
+
+    def add_transactions_bulk(self, rows, score=None):
+        results = []
+        valid = []
+        for index, row in enumerate(rows):
+            remittance, error = validate_remittance(row)
+            results.append({"index": index, "success": False, "message": error})
+            if remittance:
+                valid.append((index, remittance))
+
+        with self.engine.begin() as conn:
+            customer_ids = {remittance["customer_id"] for _, remittance in valid}
+            known = dict(conn.execute(
+                select(customers.c.id, customers.c.tier).where(customers.c.id.in_(customer_ids))
+            ).all()) if customer_ids else {}
+
+            new_transactions = []
+            point_deltas = {}
+            timestamp = datetime.now().isoformat()
+            for index, remittance in valid:
+                customer_id = remittance["customer_id"]
+                if customer_id not in known:
+                    results[index]["message"] = "Customer not found"
+                    continue
+                if score:
+                    remittance["points_earned"] = score(remittance["amount"], remittance["destination_country"], known[customer_id])
+                transaction = dict(remittance, id=str(uuid.uuid4()), timestamp=timestamp, type="remittance")
+                new_transactions.append(transaction)
+                point_deltas[customer_id] = point_deltas.get(customer_id, 0) + remittance["points_earned"]
+                results[index] = {
+                    "index": index,
+                    "success": True,
+                    "transaction_id": transaction["id"],
+                    "points_earned": remittance["points_earned"]
+                }
+
+            if new_transactions:
+                conn.execute(insert(transactions), new_transactions)
+            # One balance update (and tier recompute) per customer for the whole batch
+            for customer_id, points in point_deltas.items():
+                new_balance = customers.c.points_balance + points
+                conn.execute(
+                    update(customers)
+                    .where(customers.c.id == customer_id)
+                    .values(points_balance=new_balance, tier=_tier_for(new_balance))
+                )
+        for transaction in new_transactions:
+            self.events.publish(transaction["customer_id"], "transaction", transaction)
+        for customer_id in point_deltas:
+            self.events.publish(customer_id, "balance")
+        return results
+
+    def get_customer_transactions(self, customer_id, newest_first=False):
+        order = transactions.c.timestamp.desc() if newest_first else transactions.c.timestamp
+        query = select(transactions).where(transactions.c.customer_id == customer_id).order_by(order)
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query)]
+
+    def get_latest_transactions(self, customer_id, limit=5):
+        if limit <= 0:
+            return []
+        query = (
+            select(transactions)
+            .where(transactions.c.customer_id == customer_id)
+            .order_by(transactions.c.timestamp.desc())
+            .limit(limit)
+        )
+        with self.engine.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(query)]
+        rows.reverse()
+        return rows
+
+    def count_customer_transactions(self, customer_id):
+        query = select(func.count()).select_from(transactions).where(transactions.c.customer_id == customer_id)
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar()
+
+    def get_transaction_version(self, customer_id):
+        # History is append-only, so its length is a version
+        return self.count_customer_transactions(customer_id)
+
+    def get_transaction_totals(self, customer_id):
+        query = (
+            select(
+                func.count(),
+                func.coalesce(func.sum(transactions.c.amount), 0),
+                func.coalesce(func.sum(transactions.c.points_earned), 0),
+            )
+            .where(transactions.c.customer_id == customer_id)
+        )
+        with self.engine.connect() as conn:
+            count, amount, points_earned = conn.execute(query).one()
+        return {"count": count, "amount": amount, "points_earned": points_earned}
+
+    def get_transactions_page(self, customer_id, limit=20, cursor=None):
+        query = (
+            select(transactions)
+            .where(transactions.c.customer_id == customer_id)
+            .order_by(transactions.c.timestamp.desc(), transactions.c.id.desc())
+            .limit(limit + 1)
+        )
+        position = decode_cursor(cursor)
+        if position:
+            timestamp, transaction_id = position
+            # Keyset pagination: rows strictly after the cursor in (timestamp, id) order
+            query = query.where(or_(
+                transactions.c.timestamp < timestamp,
+                and_(transactions.c.timestamp == timestamp, transactions.c.id < transaction_id),
+            ))
+        with self.engine.connect() as conn:
+            page = [dict(row._mapping) for row in conn.execute(query)]
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return page[:limit], next_cursor
+
+    def iter_customer_transactions(self, customer_id, newest_first=True):
+        order = transactions.c.timestamp.desc() if newest_first else transactions.c.timestamp
+        query = select(transactions).where(transactions.c.customer_id == customer_id).order_by(order)
+        with self.engine.connect() as conn:
+            # Server-side cursor where the driver supports it, so memory stays flat
+            result = conn.execution_options(stream_results=True, yield_per=500).execute(query)
+            for row in result:
+                yield dict(row._mapping)
+
+    def get_leaderboard_page(self, offset=0, limit=50):
+        query = (
+            select(*customer_columns)
+            .order_by(customers.c.points_balance.desc(), customers.c.id)
+            .offset(offset)
+            .limit(limit)
+        )
+        with self.engine.connect() as conn:
+            return [
+                dict(row._mapping, rank=offset + i + 1)
+                for i, row in enumerate(conn.execute(query))
+            ]
+
+    def get_customer_rank(self, customer_id):
+        with self.engine.connect() as conn:
+            customer = self._fetch_customer(conn, customer_id)
+            if not customer:
+                return None
+            balance = customer["points_balance"]
+            ahead = conn.execute(
+                select(func.count()).select_from(customers).where(or_(
+                    customers.c.points_balance > balance,
+                    and_(customers.c.points_balance == balance, customers.c.id < customer_id),
+                ))
+            ).scalar()
+            return ahead + 1
+
+    def get_leaderboard_version(self):
+        # Other workers change rankings without telling this one, so there is no cheap version
+        return None
+
+    def get_catalog_version(self):
+        with self.engine.connect() as conn:
+            return conn.execute(select(catalog_meta.c.version).where(catalog_meta.c.id == 1)).scalar() or 0
+
+    def get_stats(self, days=30, top=5):
+        # Several workers write here, so aggregate in the database rather than keep counters
+        since = (datetime.now().date() - timedelta(days=days - 1)).isoformat()
+        transaction_day = func.substr(transactions.c.timestamp, 1, 10)
+        redemption_day = func.substr(redemptions.c.timestamp, 1, 10)
+        with self.engine.connect() as conn:
+            issued = conn.execute(
+                select(transaction_day, func.sum(transactions.c.points_earned))
+                .where(transactions.c.timestamp >= since)
+                .group_by(transaction_day).order_by(transaction_day)
+            ).all()
+            redeemed = conn.execute(
+                select(redemption_day, func.sum(redemptions.c.points_used))
+                .where(and_(redemptions.c.timestamp >= since, redemptions.c.status != "refunded"))
+                .group_by(redemption_day).order_by(redemption_day)
+            ).all()
+            tiers = conn.execute(select(customers.c.tier, func.count()).group_by(customers.c.tier)).all()
+            volume = conn.execute(
+                select(transactions.c.destination_country, func.count(), func.sum(transactions.c.amount))
+                .group_by(transactions.c.destination_country)
+            ).all()
+        countries = {country or "": {"count": count, "amount": round(amount, 2)} for country, count, amount in volume}
+        corridors = sorted(countries.items(), key=lambda item: item[1]["amount"], reverse=True)[:top]
+        return {
+            "points_issued_by_day": dict(issued),
+            "points_redeemed_by_day": dict(redeemed),
+            "customers_by_tier": dict({"Bronze": 0, "Silver": 0, "Gold": 0}, **dict(tiers)),
+            "volume_by_country": countries,
+            "top_corridors": [dict(destination_country=country, **totals) for country, totals in corridors],
+        }
+
+    def _bump_catalog_version(self, conn):
+        result = conn.execute(
+            update(catalog_meta).where(catalog_meta.c.id == 1).values(version=catalog_meta.c.version + 1)
+        )
+        if result.rowcount == 0:
+            conn.execute(insert(catalog_meta), {"id": 1, "version": 1})
+
+    def get_all_gifts(self):
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(select(gifts))]
+
+    def get_gift(self, gift_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(gifts).where(gifts.c.id == gift_id)).first()
+            return dict(row._mapping) if row else None
+
+    def add_reward(self, name, description, points_cost, category, image_url=None, available=True):
+        reward = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "description": description,
+            "points_cost": points_cost,
+            "category": category,
+            "image_url": image_url,
+            "available": available
+        }
+        with self.engine.begin() as conn:
+            conn.execute(insert(rewards), reward)
+            self._bump_catalog_version(conn)
+        return reward
+
+    def update_reward(self, reward_id, **fields):
+        values = {key: value for key, value in fields.items() if key in rewards.c and key != "id"}
+        with self.engine.begin() as conn:
+            if values:
+                result = conn.execute(update(rewards).where(rewards.c.id == reward_id).values(**values))
+                if result.rowcount != 1:
+                    return None
+                self._bump_catalog_version(conn)
+            row = conn.execute(select(rewards).where(rewards.c.id == reward_id)).first()
+            return dict(row._mapping) if row else None
+
+    def get_all_rewards(self):
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(select(rewards))]
+
+    def get_reward(self, reward_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(rewards).where(rewards.c.id == reward_id)).first()
+            return dict(row._mapping) if row else None
+
+    def redeem_reward(self, customer_id, reward_id):
+        reward = self.get_reward(reward_id)
+        if not reward:
+            return None, "Customer or reward not found"
+        return self._reserve(customer_id, reward_id, reward["points_cost"], "Reward redeemed successfully")
+
+    def redeem_gift(self, customer_id, gift_id):
+        gift = self.get_gift(gift_id)
+        if not gift:
+            return None, "Customer or gift not found"
+        return self._reserve(customer_id, gift_id, gift["points_cost"], "Gift sent successfully")
+
+    def _reserve(self, customer_id, item_id, points, message):
+        with self.engine.begin() as conn:
+            if not self._fetch_customer(conn, customer_id):
+                return None, "Customer or reward not found"
+
+            if not self._deduct(conn, customer_id, points):
+                return None, "Insufficient points"
+
+            # Pending until the fulfilment worker completes or refunds it
+            redemption = {
+                "id": str(uuid.uuid4()),
+                "customer_id": customer_id,
+                "reward_id": item_id,
+                "points_used": points,
+                "timestamp": datetime.now().isoformat(),
+                "status": "pending"
+            }
+            conn.execute(insert(redemptions), redemption)
+
+        self.events.publish(customer_id, "balance")
+        return redemption, message
+
+    def get_redemption(self, redemption_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(redemptions).where(redemptions.c.id == redemption_id)).first()
+            return dict(row._mapping) if row else None
+
+    def get_pending_redemptions(self, created_before_us=None):
+        query = select(redemptions).where(redemptions.c.status == "pending").order_by(redemptions.c.timestamp)
+        if created_before_us is not None:
+            query = query.where(redemptions.c.timestamp < iso_from_us(created_before_us))
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query)]
+
+    def claim_redemption(self, redemption_id, owner, lease_seconds):
+        if (self.get_redemption(redemption_id) or {}).get("status") != "pending":
+            return False
+        now = time.time()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(redemption_leases),
+                             {"id": redemption_id, "owner": owner, "lease_until": now + lease_seconds})
+            return True
+        except IntegrityError:
+            pass
+        # Someone has leased it before: take it over only if it's ours or the lease has run out
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(redemption_leases)
+                .where(and_(redemption_leases.c.id == redemption_id,
+                            or_(redemption_leases.c.owner == owner, redemption_leases.c.lease_until < now)))
+                .values(owner=owner, lease_until=now + lease_seconds)
+            )
+            return result.rowcount == 1
+
+    def complete_redemption(self, redemption_id):
+        return self._settle_redemption(redemption_id, "completed")
+
+    def refund_redemption(self, redemption_id):
+        return self._settle_redemption(redemption_id, "refunded")
+
+    def _settle_redemption(self, redemption_id, status):
+        with self.engine.begin() as conn:
+            # Only a pending redemption can settle, and only once
+            result = conn.execute(
+                update(redemptions)
+                .where(and_(redemptions.c.id == redemption_id, redemptions.c.status == "pending"))
+                .values(status=status)
+            )
+            if result.rowcount != 1:
+                return None
+            conn.execute(delete(redemption_leases).where(redemption_leases.c.id == redemption_id))
+            row = dict(conn.execute(select(redemptions).where(redemptions.c.id == redemption_id)).first()._mapping)
+            if status == "refunded":
+                conn.execute(
+                    update(customers)
+                    .where(customers.c.id == row["customer_id"])
+                    .values(points_balance=customers.c.points_balance + row["points_used"])
+                )
+                # A refunded gift never arrives, so the recipient can no longer claim it
+                conn.execute(
+                    update(collections)
+                    .where(and_(collections.c.redemption_id == redemption_id, collections.c.status == "pending"))
+                    .values(status="cancelled")
+                )
+        if status == "refunded":
+            self.events.publish(row["customer_id"], "balance")
+        return row
+
+    def add_collection(self, recipient_mukuru_id, kind, sender_name, amount=0, item_name=None, sender_id=None,
+                       recipient_name=None, collection_method=None, verification_method=None, message=None,
+                       redemption_id=None, ttl=None):
+        created = datetime.now()
+        entry = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "recipient_key": normalize_mukuru_id(recipient_mukuru_id),
+            "sender_id": sender_id,
+            "sender_name": sender_name,
+            "recipient_name": recipient_name,
+            "amount": amount,
+            "item_name": item_name,
+            "collection_method": collection_method,
+            "verification_method": verification_method,
+            "message": message,
+            "redemption_id": redemption_id,
+            "timestamp": created.isoformat(),
+            "expires_at": (created + timedelta(seconds=DEFAULT_TTL if ttl is None else ttl)).isoformat(),
+            "status": "pending",
+        }
+        with self.engine.begin() as conn:
+            conn.execute(insert(collections), entry)
+        entry["reference"] = collection_reference(entry["id"])
+        return entry
+
+    def get_collection(self, collection_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(collections).where(collections.c.id == collection_id)).first()
+            return _collection_row(row) if row else None
+
+    def get_pending_collections(self, mukuru_ids, offset=0, limit=20):
+        where = and_(collections.c.recipient_key.in_(list(mukuru_ids)), collections.c.status == "pending")
+        with self.engine.connect() as conn:
+            total = conn.execute(select(func.count()).select_from(collections).where(where)).scalar()
+            rows = conn.execute(
+                select(collections).where(where)
+                .order_by(collections.c.timestamp, collections.c.id)
+                .offset(offset).limit(limit)
+            )
+            return [_collection_row(row) for row in rows], total
+
+    def claim_collection(self, collection_id, mukuru_ids):
+        with self.engine.begin() as conn:
+            # Only the recipient can claim, and only once
+            result = conn.execute(
+                update(collections)
+                .where(and_(collections.c.id == collection_id, collections.c.status == "pending",
+                            collections.c.recipient_key.in_(list(mukuru_ids))))
+                .values(status="collected")
+            )
+            if result.rowcount != 1:
+                return None
+            return _collection_row(conn.execute(select(collections).where(collections.c.id == collection_id)).first())
+
+    def expire_collections(self, now=None):
+        cutoff = datetime.now().isoformat() if now is None else iso_from_us(now)
+        with self.engine.begin() as conn:
+            return conn.execute(
+                update(collections)
+                .where(and_(collections.c.status == "pending", collections.c.expires_at <= cutoff))
+                .values(status="expired")
+            ).rowcount
+
+    def get_recent_gifts(self, customer_id, mukuru_ids, limit=5):
+        gift = collections.c.kind == "gift"
+        with self.engine.connect() as conn:
+            sent = conn.execute(
+                select(collections).where(and_(gift, collections.c.sender_id == customer_id))
+                .order_by(collections.c.timestamp.desc()).limit(limit)
+            )
+            rows = [dict(_collection_row(row), type="sent") for row in sent]
+            received = conn.execute(
+                select(collections)
+                .where(and_(gift, collections.c.recipient_key.in_(list(mukuru_ids)),
+                            collections.c.status != "cancelled"))
+                .order_by(collections.c.timestamp.desc()).limit(limit)
+            )
+            rows += [dict(_collection_row(row), type="received") for row in received]
+        rows.sort(key=lambda row: row["timestamp"], reverse=True)
+        return rows[:limit]
+
+
+class SQLBucketStore:
+    """Rate-limit token buckets shared by every worker through one SQL table.
+
+    A request that can be served is a single conditional UPDATE that
+    refills and spends in place, so concurrent workers never over-spend.
+    """
+
+    def __init__(self, url):
+        self.engine = create_store_engine(url)
+        rate_buckets.create(self.engine, checkfirst=True)
+
+    def take(self, key, rate, burst, now=None):
+        """Spend one token; returns 0 when allowed, else seconds until a token is available"""
+        now = time.time() if now is None else now
+        refilled = rate_buckets.c.tokens + (now - rate_buckets.c.updated) * rate
+        level = case((refilled > burst, burst), else_=refilled)
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(rate_buckets)
+                .where(and_(rate_buckets.c.key == key, level >= 1))
+                .values(tokens=level - 1, updated=now)
+            )
+            if result.rowcount == 1:
+                return 0.0
+            row = conn.execute(select(level).where(rate_buckets.c.key == key)).first()
+            if row is not None:
+                return (1 - row[0]) / rate
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(rate_buckets).values(key=key, tokens=burst - 1, updated=now))
+            except IntegrityError:
+                pass   # another worker created the bucket first; let this one through
+            return 0.0
@@ -0,0 +1,53 @@
+"""What the app does while it imports, and the lean profile that does less.
+
+By default startup does its preparation up front, so no request pays for
+it later. It builds static assets, compiles every template, imports
+NumPy and seeds the demo customers. STARTUP_PROFILE=lean suits
+deployments that prebuild assets (`python assets.py`) and load real data
+from DATA_DIR or DATABASE_URL. It skips the build and the demo
+customers, and leaves templates and optional modules to load on first
+use. Each step can still be set on its own:
+
+    ASSETS_BUILD_ON_STARTUP, PRECOMPILE_TEMPLATES, SAMPLE_DATA
+"""
+import importlib.util
+import os
+import sys
+
+LEAN = os.environ.get("STARTUP_PROFILE", "").lower() == "lean"
+
+
+def flag(name):
+    """An on/off environment flag: on by default, off by default under the lean profile"""
+    value = os.environ.get(name)
+    if value is None:
+        return not LEAN
+    return value.lower() not in ("0", "false", "no", "off")
+
+
+def optional_import(name):
+    """The named module, or None if it isn't installed.
+
+    Under the lean profile the module is returned unloaded and runs on
+    first attribute access, so `np is None` checks stay free.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if not LEAN:
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            return None
+    try:
+        # For a submodule this imports the parent package (normally small)
+        spec = importlib.util.find_spec(name)
+    except ModuleNotFoundError:
+        spec = None
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -14,6 +14,7 @@ class MukuruApp {
         this.setupUIInteractions();
         this.setupRippleEffects();
         this.initializeCounters();
+        this.connectLiveUpdates();
     }
 
     // Setup global event listeners
@@ -475,6 +476,113 @@ class MukuruApp {
         counters.forEach(counter => observer.observe(counter));
     }
 
+    // Live balance, tier and rank updates pushed by the server
+    connectLiveUpdates() {
+        const { eventsUrl, eventsPollUrl } = document.body.dataset;
+        if (!eventsUrl) return;
+
+        // Long-poll fallback; when the server is holding too many connections it answers
+        // at once with retry_after, and the next poll waits that long
+        const poll = (cursor) => {
+            const url = cursor === undefined ? eventsPollUrl : `${eventsPollUrl}?after=${cursor}`;
+            fetch(url, { credentials: 'same-origin' })
+                .then(response => response.ok ? response.json() : Promise.reject(response.status))
+                .then(data => {
+                    data.events.filter(event => event.event === 'transaction')
+                        .forEach(event => this.handleLiveEvent('transaction', event.data));
+                    this.handleLiveEvent('snapshot', data.state);
+                    setTimeout(() => poll(data.cursor), (data.retry_after || 0) * 1000);
+                })
+                .catch(() => setTimeout(() => poll(cursor), 5000));
+        };
+
+        if (window.EventSource) {
+            // EventSource reconnects by itself and resumes after the last transaction it saw
+            const source = new EventSource(eventsUrl);
+            ['snapshot', 'balance', 'tier', 'rank', 'transaction'].forEach(name => {
+                source.addEventListener(name, (e) => this.handleLiveEvent(name, JSON.parse(e.data)));
+            });
+            // A refused stream (503 when the server is full) isn't retried by the browser
+            source.addEventListener('error', () => {
+                if (source.readyState === EventSource.CLOSED) poll();
+            });
+            return;
+        }
+        poll();
+    }
+
+    handleLiveEvent(name, data) {
+        if (name === 'snapshot' || name === 'balance') {
+            document.querySelectorAll('[data-points-balance]').forEach(el => {
+                el.textContent = data.points_balance;
+            });
+            document.querySelectorAll('[data-tier]').forEach(el => {
+                el.textContent = data.tier;
+                el.className = el.className.replace(/\btier-\w+/, `tier-${data.tier.toLowerCase()}`);
+            });
+        }
+        if ((name === 'snapshot' || name === 'rank') && data.rank) {
+            document.querySelectorAll('[data-rank]').forEach(el => {
+                el.textContent = data.rank;
+            });
+        }
+        if (name === 'tier') {
+            this.showToast(`Congratulations! You've reached ${data.tier} tier`, 'success');
+        }
+        if (name === 'transaction') {
+            this.addRecentTransaction(data);
+        }
+        document.dispatchEvent(new CustomEvent('liveUpdate', { detail: { name, data } }));
+    }
+
+    // Put a pushed transaction at the top of the dashboard's recent list (same markup as the template)
+    addRecentTransaction(transaction) {
+        const list = document.querySelector('[data-recent-transactions]');
+        if (!list || list.querySelector(`[data-transaction-id="${CSS.escape(transaction.id)}"]`)) return;
+
+        let timeline = list.querySelector('.transaction-timeline');
+        if (!timeline) {
+            // First transaction: replaces the empty state
+            timeline = document.createElement('div');
+            timeline.className = 'transaction-timeline';
+            list.replaceChildren(timeline);
+        }
+        const item = document.createElement('div');
+        item.className = 'timeline-item';
+        item.dataset.transactionId = transaction.id;
+        item.innerHTML = `
+            <div class="timeline-marker">
+                <i class="fas fa-paper-plane"></i>
+            </div>
+            <div class="timeline-content">
+                <div class="d-flex justify-content-between align-items-start">
+                    <div>
+                        <h6 class="mb-1"></h6>
+                        <p class="text-muted mb-1"></p>
+                        <small class="text-muted"></small>
+                    </div>
+                    <div class="points-earned">
+                        <span class="badge bg-success">
+                            <i class="fas fa-plus me-1"></i>
+                            <span></span>
+                        </span>
+                    </div>
+                </div>
+            </div>
+        `;
+        // Filled in as text, so a recipient name can't inject markup
+        item.querySelector('h6').textContent = `Sent to ${transaction.recipient}`;
+        item.querySelector('p').textContent = `R${Number(transaction.amount).toFixed(2)}`;
+        item.querySelector('small').textContent = transaction.timestamp.slice(0, 10);
+        item.querySelector('.badge span').textContent = `${transaction.points_earned} pts`;
+        timeline.prepend(item);
+        timeline.querySelectorAll('.timeline-item:nth-child(n+6)').forEach(el => el.remove());
+
+        document.querySelectorAll('[data-total-transactions]').forEach(el => {
+            el.textContent = Number(el.textContent) + 1;
+        });
+    }
+
     // Handle scroll events
     handleScroll() {
         const scrollTop = window.pageYOffset;
@@ -0,0 +1,175 @@
+"""Running operational stats for the in-memory store.
+
+DataStore feeds every change into a Stats as it happens: points issued per
+day (from transactions), points redeemed per day (reservations, less
+refunds), customers per tier, and remittance count/amount per destination
+country. Reading them is a dict copy, cached until the next change, so
+/api/stats costs the same however much history there is.
+
+Days are local calendar dates, the same as the first ten characters of a
+record's ISO timestamp. Per-day buckets older than `retention_days` are
+dropped. Country and tier totals cover all time.
+
+Stats.build() recomputes everything from records, e.g. after a journal
+replay or a backfill. With NumPy installed, large inputs are grouped with
+vectorized operations instead of a Python loop.
+"""
+from datetime import date, datetime, timedelta
+import functools
+import threading
+
+from points_rules import TIERS
+import startup
+
+# Optional: build() falls back to the Python loop
+np = startup.optional_import("numpy")
+
+# Grouping with NumPy only pays off once the arrays are big enough
+NUMPY_MIN_ROWS = 10000
+# Every UTC offset in use is a multiple of 15 minutes, so a slot never straddles local midnight
+US_PER_SLOT = 15 * 60 * 1_000_000
+
+
+@functools.lru_cache(maxsize=8192)
+def _slot_day(slot):
+    return datetime.fromtimestamp(slot * US_PER_SLOT / 1_000_000).date().isoformat()
+
+
+def day_of(created_us):
+    """Local ISO date for an epoch-microsecond timestamp"""
+    return _slot_day(created_us // US_PER_SLOT)
+
+
+class Stats:
+    def __init__(self, retention_days=90):
+        self.retention_days = retention_days
+        self.points_issued = {}     # day -> points
+        self.points_redeemed = {}   # day -> points
+        self.tiers = dict.fromkeys(reversed(TIERS), 0)   # lowest tier first
+        self.countries = {}         # destination_country -> [count, amount]
+        self.version = 0
+        self._newest_day = ""
+        self._snapshots = {}        # (date, days, top) -> snapshot at self.version
+        self._lock = threading.Lock()
+
+    def add_transaction(self, created_us, destination_country, amount, points_earned):
+        with self._lock:
+            self._add_day(self.points_issued, day_of(created_us), points_earned)
+            totals = self.countries.setdefault(destination_country or "", [0, 0])
+            totals[0] += 1
+            totals[1] += amount
+            self._changed()
+
+    def add_redemption(self, created_us, points):
+        """Count points redeemed on the redemption's day; pass a negative amount for a refund"""
+        with self._lock:
+            self._add_day(self.points_redeemed, day_of(created_us), points)
+            self._changed()
+
+    def add_customer(self, tier):
+        with self._lock:
+            self.tiers[tier] = self.tiers.get(tier, 0) + 1
+            self._changed()
+
+    def change_tier(self, old, new):
+        if old == new:
+            return
+        with self._lock:
+            self.tiers[old] = self.tiers.get(old, 0) - 1
+            self.tiers[new] = self.tiers.get(new, 0) + 1
+            self._changed()
+
+    def _add_day(self, buckets, day, value):
+        buckets[day] = buckets.get(day, 0) + value
+        if day > self._newest_day:
+            self._newest_day = day
+            self._prune()
+
+    def _prune(self):
+        cutoff = (date.fromisoformat(self._newest_day) - timedelta(days=self.retention_days)).isoformat()
+        for buckets in (self.points_issued, self.points_redeemed):
+            for day in [day for day in buckets if day <= cutoff]:
+                del buckets[day]
+
+    def _changed(self):
+        self.version += 1
+        self._snapshots.clear()
+
+    def snapshot(self, days=30, top=5):
+        """Stats for the last `days` days and the `top` corridors by amount sent"""
+        today = date.today()
+        with self._lock:
+            # The window ends today, so a snapshot cached yesterday is stale even with no writes since
+            cached = self._snapshots.get((today, days, top))
+            if cached is None:
+                if any(key[0] != today for key in self._snapshots):
+                    self._snapshots.clear()
+                cached = self._snapshots[(today, days, top)] = self._snapshot(today, days, top)
+            return cached
+
+    def _snapshot(self, today, days, top):
+        since = (today - timedelta(days=days - 1)).isoformat()
+        countries = {
+            country: {"count": count, "amount": round(amount, 2)}
+            for country, (count, amount) in self.countries.items()
+        }
+        corridors = sorted(countries.items(), key=lambda item: item[1]["amount"], reverse=True)[:top]
+        return {
+            "points_issued_by_day": {day: points for day, points in sorted(self.points_issued.items()) if day >= since},
+            "points_redeemed_by_day": {day: points for day, points in sorted(self.points_redeemed.items()) if day >= since},
+            "customers_by_tier": dict(self.tiers),
+            "volume_by_country": countries,
+            "top_corridors": [dict(destination_country=country, **totals) for country, totals in corridors],
+        }
+
+    @classmethod
+    def build(cls, customers, transactions, redemptions, retention_days=90, use_numpy=None):
+        """Stats recomputed from records; refunded redemptions don't count as redeemed"""
+        stats = cls(retention_days)
+        for customer in customers:
+            stats.tiers[customer["tier"]] = stats.tiers.get(customer["tier"], 0) + 1
+        transactions = list(transactions)
+        redemptions = [redemption for redemption in redemptions if redemption.status != "refunded"]
+        if use_numpy is None:
+            use_numpy = np is not None and len(transactions) >= NUMPY_MIN_ROWS
+        if use_numpy:
+            _build_numpy(stats, transactions, redemptions)
+        else:
+            for transaction in transactions:
+                stats._add_day(stats.points_issued, day_of(transaction.created_us), transaction.points_earned)
+                totals = stats.countries.setdefault(transaction.destination_country or "", [0, 0])
+                totals[0] += 1
+                totals[1] += transaction.amount
+            for redemption in redemptions:
+                stats._add_day(stats.points_redeemed, day_of(redemption.created_us), redemption.points_used)
+        return stats
+
+
+def _sum_by_day(stats, buckets, created_us, values):
+    if not len(created_us):
+        return
+    slots, inverse = np.unique(created_us // US_PER_SLOT, return_inverse=True)
+    sums = np.bincount(inverse, weights=values)
+    for slot, value in zip(slots.tolist(), sums.tolist()):
+        stats._add_day(buckets, _slot_day(slot), int(value))
+
+
+def _build_numpy(stats, transactions, redemptions):
+    count = len(transactions)
+    created = np.fromiter((t.created_us for t in transactions), dtype=np.int64, count=count)
+    points = np.fromiter((t.points_earned for t in transactions), dtype=np.int64, count=count)
+    amounts = np.fromiter((t.amount for t in transactions), dtype=np.float64, count=count)
+    _sum_by_day(stats, stats.points_issued, created, points)
+
+    if count:
+        countries = np.array([t.destination_country or "" for t in transactions])
+        names, inverse = np.unique(countries, return_inverse=True)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=amounts)
+        for name, n, amount in zip(names.tolist(), counts.tolist(), sums.tolist()):
+            stats.countries[name] = [n, amount]
+
+    count = len(redemptions)
+    _sum_by_day(stats, stats.points_redeemed,
+                np.fromiter((r.created_us for r in redemptions), dtype=np.int64, count=count),
+                np.fromiter((r.points_used for r in redemptions), dtype=np.int64, count=count))
@@ -0,0 +1,292 @@
+from abc import ABC, abstractmethod
+import base64
+import math
+import re
+
+from points_rules import base_points
+
+
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+
+def normalize_phone(phone):
+    """Digits only, keeping a leading + so '+27 12-345' and '+2712345' match"""
+    phone = (phone or "").strip()
+    digits = re.sub(r"\D", "", phone)
+    return "+" + digits if phone.startswith("+") else digits
+
+
+def normalize_mukuru_id(mukuru_id):
+    """Ledger key for a Mukuru ID as typed: phone numbers as normalize_phone, anything else case-insensitive"""
+    mukuru_id = (mukuru_id or "").strip()
+    if re.fullmatch(r"\+?[\d\s()-]+", mukuru_id):
+        return normalize_phone(mukuru_id)
+    return mukuru_id.casefold()
+
+
+def customer_mukuru_ids(customer):
+    """Every Mukuru ID a customer can be sent to: their customer id and their phone number"""
+    ids = [normalize_mukuru_id(customer["id"])]
+    if customer.get("phone"):
+        ids.append(normalize_phone(customer["phone"]))
+    return ids
+
+
+def encode_cursor(transaction):
+    """Opaque history cursor pointing at a transaction (timestamp + id)"""
+    raw = f"{transaction['timestamp']}|{transaction['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor, or None if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, transaction_id = raw.split("|", 1)
+    except ValueError:
+        return None
+    return timestamp, transaction_id
+
+
+def calculate_points(amount):
+    """Base points before campaigns: 1 point per R100 sent"""
+    return base_points(amount)
+
+
+def validate_remittance(row):
+    """Check one remittance row; returns (cleaned_row, None) or (None, error message)"""
+    if not isinstance(row, dict):
+        return None, "Row must be an object"
+    try:
+        amount = float(row.get("amount", 0))
+    except (TypeError, ValueError):
+        return None, "Invalid amount format"
+    # float() accepts "nan" and "inf", which no points rule can price
+    if not math.isfinite(amount) or amount <= 0:
+        return None, "Invalid amount"
+    recipient = str(row.get("recipient") or "").strip()
+    if not recipient:
+        return None, "Recipient name is required"
+    destination_country = str(row.get("destination_country") or "").strip()
+    if not destination_country:
+        return None, "Please select a destination country"
+
+    verification_method = None
+    verification_value = None
+    mukuru_card = str(row.get("mukuru_card") or "").strip()
+    id_number = str(row.get("id_number") or "").strip()
+    if mukuru_card:
+        verification_method = "mukuru_card"
+        verification_value = mukuru_card
+    elif id_number:
+        verification_method = "id_number"
+        verification_value = id_number
+
+    return {
+        "customer_id": str(row.get("customer_id") or ""),
+        "amount": amount,
+        "recipient": recipient,
+        "destination_country": destination_country,
+        "verification_method": verification_method,
+        "verification_value": verification_value,
+        "points_earned": calculate_points(amount),
+    }, None
+
+
+class Storage(ABC):
+    """Interface shared by the in-memory DataStore and the SQL-backed store.
+
+    Records read like dicts in both implementations: the SQL store returns
+    plain dicts and DataStore returns slotted records.Record mappings, so
+    routes and templates don't care which backend is active.
+    """
+
+    @abstractmethod
+    def get_customer(self, customer_id):
+        pass
+
+    @abstractmethod
+    def get_all_customers(self):
+        pass
+
+    @abstractmethod
+    def count_customers(self):
+        pass
+
+    @abstractmethod
+    def find_customer_by_email(self, email):
+        pass
+
+    @abstractmethod
+    def find_customer_by_phone(self, phone):
+        pass
+
+    @abstractmethod
+    def add_customer(self, name, email, phone=None):
+        """Create a Bronze customer with no points; returns None if the email is taken"""
+
+    @abstractmethod
+    def update_customer(self, customer_id, name=None, email=None, phone=None):
+        """Change contact details; returns None if not found or the email is taken"""
+
+    @abstractmethod
+    def update_customer_points(self, customer_id, points_to_add):
+        """Add points and recompute tier; returns the customer or None"""
+
+    @abstractmethod
+    def deduct_customer_points(self, customer_id, points):
+        """Deduct points if the customer can afford them; returns the customer or None"""
+
+    @abstractmethod
+    def add_transaction(self, customer_id, amount, recipient, points_earned, destination_country=None, verification_method=None, verification_value=None):
+        pass
+
+    @abstractmethod
+    def add_transactions_bulk(self, rows, score=None):
+        """Validate and record many remittances, awarding points once per customer.
+
+        `score(amount, destination_country, tier)` prices each row (e.g.
+        RuleSet.points); without it rows earn base points. Returns one result
+        dict per input row, in order.
+        """
+
+    @abstractmethod
+    def get_customer_transactions(self, customer_id, newest_first=False):
+        pass
+
+    @abstractmethod
+    def get_latest_transactions(self, customer_id, limit=5):
+        """Last `limit` transactions for a customer, oldest first"""
+
+    @abstractmethod
+    def count_customer_transactions(self, customer_id):
+        pass
+
+    @abstractmethod
+    def get_transaction_totals(self, customer_id):
+        """{'count', 'amount', 'points_earned'} over all of a customer's transactions"""
+
+    @abstractmethod
+    def get_transactions_page(self, customer_id, limit=20, cursor=None):
+        """Newest-first page of transactions older than `cursor`.
+
+        Returns (transactions, next_cursor); next_cursor is None on the last page.
+        """
+
+    @abstractmethod
+    def iter_customer_transactions(self, customer_id, newest_first=True):
+        """Yield a customer's transactions one at a time, for streaming exports"""
+
+    @abstractmethod
+    def get_leaderboard_page(self, offset=0, limit=50):
+        """Ranked customer rows; each row is a copy with a `rank` key added"""
+
+    @abstractmethod
+    def get_customer_rank(self, customer_id):
+        pass
+
+    @abstractmethod
+    def get_leaderboard_version(self):
+        """Changes whenever ranked rows do; None if the backend can't tell cheaply"""
+
+    @abstractmethod
+    def get_transaction_version(self, customer_id):
+        """Changes whenever the customer's transaction history does"""
+
+    @abstractmethod
+    def get_catalog_version(self):
+        """Changes whenever rewards or gifts change; used to invalidate catalog caches"""
+
+    @abstractmethod
+    def get_stats(self, days=30, top=5):
+        """Operational stats for /api/stats.
+
+        Points issued and redeemed per day over the last `days` days, customers
+        per tier, remittance count and amount per destination country, and the
+        `top` corridors by amount.
+        """
+
+    @abstractmethod
+    def get_all_gifts(self):
+        pass
+
+    @abstractmethod
+    def get_gift(self, gift_id):
+        pass
+
+    @abstractmethod
+    def add_reward(self, name, description, points_cost, category, image_url=None, available=True):
+        pass
+
+    @abstractmethod
+    def update_reward(self, reward_id, **fields):
+        """Change reward fields (not the id); returns the reward or None"""
+
+    @abstractmethod
+    def get_all_rewards(self):
+        pass
+
+    @abstractmethod
+    def get_reward(self, reward_id):
+        pass
+
+    @abstractmethod
+    def redeem_reward(self, customer_id, reward_id):
+        """Returns (redemption, message); redemption is None on failure"""
+
+    @abstractmethod
+    def redeem_gift(self, customer_id, gift_id):
+        """Returns (redemption, message); redemption is None on failure"""
+
+    @abstractmethod
+    def get_redemption(self, redemption_id):
+        pass
+
+    @abstractmethod
+    def get_pending_redemptions(self, created_before_us=None):
+        """Redemptions still pending, oldest first; with created_before_us, only those created before it"""
+
+    @abstractmethod
+    def claim_redemption(self, redemption_id, owner, lease_seconds):
+        """Take or renew the fulfilment lease on a pending redemption for `owner`.
+
+        Returns False if it isn't pending or another owner holds a lease
+        that hasn't expired.
+        """
+
+    @abstractmethod
+    def complete_redemption(self, redemption_id):
+        """Mark a pending redemption fulfilled; returns it, or None if it wasn't pending"""
+
+    @abstractmethod
+    def refund_redemption(self, redemption_id):
+        """Cancel a pending redemption and return its points; returns it, or None if it wasn't pending"""
+
+    @abstractmethod
+    def add_collection(self, recipient_mukuru_id, kind, sender_name, amount=0, item_name=None, sender_id=None,
+                       recipient_name=None, collection_method=None, verification_method=None, message=None,
+                       redemption_id=None, ttl=None):
+        """Record money or a gift ("money" / "gift") waiting for a Mukuru ID, pending for `ttl` seconds"""
+
+    @abstractmethod
+    def get_collection(self, collection_id):
+        pass
+
+    @abstractmethod
+    def get_pending_collections(self, mukuru_ids, offset=0, limit=20):
+        """(entries, total): a page of pending entries for any of the recipient's Mukuru IDs, oldest first"""
+
+    @abstractmethod
+    def claim_collection(self, collection_id, mukuru_ids):
+        """Mark a pending entry for one of `mukuru_ids` collected; returns it, or None if it wasn't"""
+
+    @abstractmethod
+    def expire_collections(self, now=None):
+        """Mark pending entries past their expiry (epoch microseconds) expired; returns how many"""
+
+    @abstractmethod
+    def get_recent_gifts(self, customer_id, mukuru_ids, limit=5):
+        """Latest gifts the customer sent or received, newest first; each dict's type is sent or received"""
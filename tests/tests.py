@@ -1,6 +1,44 @@
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from flask import Flask
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import Flask, render_template_string, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
 from app import *
+from models import DataStore
+from leaderboard import Leaderboard
+from journal import JournalError
+from sql_store import SQLDataStore
+from records import Customer, now_us
+from catalog import CatalogCache
+import instrumentation
+from fulfilment import FulfilmentQueue, ProviderError
+from idempotency import IdempotencyCache, idempotent
+import ratelimit
+import fragments
+import assets
+from sql_store import SQLBucketStore
+import stats
+from events import EventBus
+from auth import TokenAuth
+from points_rules import Campaign, RuleSet, back_apply
+from velocity import VelocityChecker, VelocityExceeded
+import multiprocessing
+import shared_balances
+from shared_balances import BalanceTable
+import io
+import logging
+import logging_setup
+import startup
+from storage import customer_mukuru_ids
+from ledger import CollectionSweeper
 
 class TestAppConfig(unittest.TestCase):
     def setUp(self):
@@ -24,5 +62,1384 @@ class TestAppConfig(unittest.TestCase):
         response = self.client.get("/")
         self.assertIn(response.status_code, [200, 302, 404])  # Accepts 404 if no route defined
 
+class TestCustomerTransactionIndex(unittest.TestCase):
+    def setUp(self):
+        self.store = DataStore()
+
+    def test_latest_and_count(self):
+        for i in range(7):
+            self.store.add_transaction("1", 100 * (i + 1), "Recipient", i + 1)
+        self.store.add_transaction("2", 500, "Other", 5)
+
+        self.assertEqual(self.store.count_customer_transactions("1"), 7)
+        self.assertEqual(self.store.count_customer_transactions("3"), 0)
+        latest = self.store.get_latest_transactions("1", 5)
+        self.assertEqual([t["points_earned"] for t in latest], [3, 4, 5, 6, 7])
+
+    def test_newest_first(self):
+        first = self.store.add_transaction("1", 100, "A", 1)
+        second = self.store.add_transaction("1", 200, "B", 2)
+        history = self.store.get_customer_transactions("1", newest_first=True)
+        self.assertEqual([t["id"] for t in history], [second["id"], first["id"]])
+
+class TestRecords(unittest.TestCase):
+    def test_mapping_view(self):
+        store = DataStore()
+        transaction = store.add_transaction("1", 250.0, "Gogo", 2, "MW")
+        as_dict = dict(transaction)
+        self.assertEqual(set(as_dict), {"id", "customer_id", "amount", "recipient", "points_earned",
+                                        "destination_country", "verification_method",
+                                        "verification_value", "timestamp", "type"})
+        self.assertEqual(len(transaction["id"]), 36)
+        self.assertEqual(transaction["timestamp"][:4], str(datetime.now().year))
+        self.assertEqual(transaction.get("type"), "remittance")
+        with app.app_context():
+            self.assertEqual(json.loads(app.json.dumps(transaction))["recipient"], "Gogo")
+
+    def test_customer_fields_are_writable(self):
+        customer = Customer(id="9", name="Test", email="t@email.com")
+        customer["points_balance"] += 5
+        self.assertEqual(customer.points_balance, 5)
+        with self.assertRaises(KeyError):
+            customer["joined_date"] = "never"
+        self.assertFalse(hasattr(customer, "__dict__"))
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def reopen(self, store):
+        store.close()
+        return DataStore.open(self.directory, snapshot_interval=0)
+
+    def test_recovers_from_snapshot_and_tail(self):
+        store = DataStore.open(self.directory, snapshot_interval=0)
+        store.update_customer_points("1", 700)
+        first = store.add_transaction("1", 70000, "Mum", 700, "ZW")
+        store.snapshot()
+
+        store.redeem_reward("1", "5")
+        store.deduct_customer_points("1", 50)
+        second = store.add_transaction("2", 1000, "Dad", 10, "KE")
+        new = store.add_customer("Thandi", "thandi@email.com")
+        store.add_reward("R20 Data Bundle", "1GB mobile data", 20, "Airtime")
+
+        store = self.reopen(store)
+        self.assertEqual(store.get_customer("1")["points_balance"], 150)
+        self.assertEqual(store.get_customer("1")["tier"], "Silver")
+        self.assertEqual([t["id"] for t in store.get_customer_transactions("1")], [first["id"]])
+        self.assertEqual(store.get_latest_transactions("2", 1)[0]["id"], second["id"])
+        self.assertEqual(len(store.redemptions), 1)
+        self.assertEqual(store.find_customer_by_email("thandi@email.com")["id"], new["id"])
+        self.assertEqual(len(store.get_all_rewards()), 7)
+        self.assertEqual(store.get_customer_rank("1"), 1)
+        store.close()
+
+    def test_profile_edit_logs_in_balance_order(self):
+        store = DataStore.open(self.directory, snapshot_interval=0)
+        # A balance change in progress: the edit must not log the row (and its balance) around it
+        with store._balance_lock("1"):
+            editor = threading.Thread(target=store.update_customer, args=("1",), kwargs={"name": "Johnny"})
+            editor.start()
+            editor.join(timeout=0.2)
+            self.assertTrue(editor.is_alive())
+            store._add_points("1", 30)
+        editor.join(timeout=5)
+        store = self.reopen(store)
+        self.assertEqual(store.get_customer("1")["points_balance"], 30)
+        self.assertEqual(store.get_customer("1")["name"], "Johnny")
+        store.close()
+
+    def test_write_failure_fails_fast(self):
+        store = DataStore.open(self.directory, snapshot_interval=0)
+
+        def disk_full(first_lsn):
+            raise OSError(28, "No space left on device")
+
+        store.journal._open_segment = disk_full
+        with self.assertLogs(level="ERROR"):
+            with self.assertRaises(JournalError):
+                store.update_customer_points("1", 10)
+        with self.assertRaises(JournalError):
+            store.update_customer_points("1", 10)
+        store.close()
+
+    def test_forked_worker_journals(self):
+        # The way gunicorn --preload runs it: the parent loads the store and a forked worker writes
+        store = DataStore.open(self.directory, snapshot_interval=60)
+        ctx = multiprocessing.get_context("fork")
+        worker = ctx.Process(target=store.update_customer_points, args=("1", 25))
+        worker.start()
+        worker.join(timeout=10)
+        self.assertEqual(worker.exitcode, 0)
+        store.close()
+        self.assertEqual(DataStore.open(self.directory, snapshot_interval=0).get_customer("1")["points_balance"], 25)
+
+    def test_one_writer_per_directory(self):
+        store = DataStore.open(self.directory, snapshot_interval=0)
+        store.update_customer_points("1", 5)
+        with self.assertRaises(JournalError):
+            DataStore.open(self.directory, snapshot_interval=0)
+        # A worker forked from a process that is already writing fails instead of colliding with it
+        ctx = multiprocessing.get_context("fork")
+        worker = ctx.Process(target=store.update_customer_points, args=("1", 5))
+        worker.start()
+        worker.join(timeout=10)
+        self.assertNotEqual(worker.exitcode, 0)
+        self.assertIsNotNone(worker.exitcode)
+        store.close()
+        DataStore.open(self.directory, snapshot_interval=0).close()
+
+    def test_torn_tail_is_ignored(self):
+        store = DataStore.open(self.directory, snapshot_interval=0)
+        store.update_customer_points("3", 40)
+        store.close()
+        segment = sorted(os.listdir(self.directory))[-1]
+        with open(os.path.join(self.directory, segment), "a") as f:
+            f.write('{"op":"balance","customer_id":"3","bal')
+
+        store = DataStore.open(self.directory, snapshot_interval=0)
+        self.assertEqual(store.get_customer("3")["points_balance"], 40)
+        store.update_customer_points("3", 2)
+        store = self.reopen(store)
+        self.assertEqual(store.get_customer("3")["points_balance"], 42)
+        store.close()
+
+class TestInstrumentation(unittest.TestCase):
+    def make_app(self, store):
+        test_app = Flask("instrumented")
+
+        @test_app.route("/points/<customer_id>")
+        def points(customer_id):
+            return str(store.get_customer(customer_id)["points_balance"])
+
+        return test_app
+
+    def test_disabled_is_a_no_op(self):
+        store = DataStore()
+        test_app = self.make_app(store)
+        self.assertIsNone(instrumentation.init_app(test_app, store, enabled=False))
+        self.assertNotIn("get_customer", vars(store))
+        self.assertEqual(test_app.test_client().get("/metrics").status_code, 404)
+
+    def test_metrics_endpoint(self):
+        store = DataStore()
+        test_app = self.make_app(store)
+        instrumentation.init_app(test_app, store, enabled=True, profile=False)
+        client = test_app.test_client()
+        client.get("/points/1")
+        client.get("/points/2")
+
+        text = client.get("/metrics").get_data(as_text=True)
+        self.assertIn('mukuru_request_duration_seconds_count{endpoint="points",method="GET"} 2', text)
+        self.assertIn('mukuru_requests_total{endpoint="points",method="GET",status="200"} 2', text)
+        self.assertIn('mukuru_store_call_duration_seconds_bucket{method="get_customer",le="+Inf"} 2', text)
+
+class TestCatalogCache(unittest.TestCase):
+    def test_rebuilds_only_on_catalog_change(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            cache = CatalogCache(store)
+            first = cache.get()
+            self.assertIs(cache.get(), first)
+            self.assertEqual(first.gift_costs["fuel200"], 200)
+            self.assertEqual(list(first.categories), ["Airtime", "Grocery", "Fuel", "Entertainment", "Shopping", "Travel"])
+
+            store.add_reward("R20 Data Bundle", "1GB mobile data", 20, "Airtime")
+            second = cache.get()
+            self.assertIsNot(second, first)
+            self.assertNotEqual(second.etag, first.etag)
+            self.assertEqual(len(second.categories["Airtime"]), 2)
+
+    def test_etag_revalidation(self):
+        client = app.test_client()
+        response = client.get("/api/catalog")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json["gifts"]), 4)
+        etag = response.headers["ETag"]
+        self.assertEqual(client.get("/api/catalog", headers={"If-None-Match": etag}).status_code, 304)
+
+class _FlakyProvider:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def fulfil(self, job):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ProviderError("timeout")
+        return "VCH-TEST"
+
+class TestFulfilment(unittest.TestCase):
+    def test_retries_then_completes(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            store.update_customer_points("2", 100)
+            redemption, _ = store.redeem_reward("2", "1")
+            self.assertEqual(redemption["status"], "pending")
+
+            provider = _FlakyProvider(failures=2)
+            queue = FulfilmentQueue(store, provider, workers=2, max_attempts=3, backoff=0)
+            queue.submit(redemption["id"], "reward")
+            self.assertTrue(queue.join(timeout=5))
+            queue.close()
+            self.assertEqual(provider.calls, 3)
+            self.assertEqual(store.get_redemption(redemption["id"])["status"], "completed")
+            self.assertEqual(store.get_customer("2")["points_balance"], 50)
+
+    def test_worker_survives_a_failed_settlement(self):
+        store = DataStore()
+        store.update_customer_points("2", 100)
+        first, _ = store.redeem_reward("2", "1")
+        second, _ = store.redeem_reward("2", "1")
+        complete = store.complete_redemption
+        failures = [JournalError("disk full")]
+
+        def flaky_complete(redemption_id):
+            if failures:
+                raise failures.pop()
+            return complete(redemption_id)
+
+        store.complete_redemption = flaky_complete
+        queue = FulfilmentQueue(store, _FlakyProvider(failures=0), workers=1, backoff=0)
+        with self.assertLogs(level="ERROR"):
+            queue.submit(first["id"], "reward")
+            self.assertTrue(queue.join(timeout=5))
+        queue.submit(second["id"], "reward")
+        self.assertTrue(queue.join(timeout=5))
+        queue.close()
+        self.assertEqual(store.get_redemption(first["id"])["status"], "pending")
+        self.assertEqual(store.get_redemption(second["id"])["status"], "completed")
+
+    def test_refunds_when_provider_keeps_failing(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            store.update_customer_points("2", 100)
+            redemption, _ = store.redeem_gift("2", "airtime50")
+            self.assertEqual(store.get_customer("2")["points_balance"], 50)
+
+            queue = FulfilmentQueue(store, _FlakyProvider(failures=10), max_attempts=2, backoff=0)
+            queue.submit(redemption["id"], "gift", recipient="Gogo")
+            self.assertTrue(queue.join(timeout=5))
+            queue.close()
+            self.assertEqual(store.get_redemption(redemption["id"])["status"], "refunded")
+            self.assertEqual(store.get_customer("2")["points_balance"], 100)
+            # Settling is one-way
+            self.assertIsNone(store.complete_redemption(redemption["id"]))
+
+    def test_pending_redemptions_resume_after_restart(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = DataStore.open(directory, snapshot_interval=0)
+        store.update_customer_points("3", 200)
+        reward, _ = store.redeem_reward("3", "1")
+        gift, _ = store.redeem_gift("3", "airtime50")
+        store.close()   # the process died before its jobs ran
+
+        store = DataStore.open(directory, snapshot_interval=0)
+        provider = _FlakyProvider(failures=0)
+        queue = FulfilmentQueue(store, provider, backoff=0, resume_after=0)
+        queue.start()
+        deadline = time.time() + 5
+        while store.get_pending_redemptions() and time.time() < deadline:
+            time.sleep(0.01)
+        queue.close()
+        self.assertEqual(provider.calls, 2)
+        self.assertEqual(store.get_redemption(reward["id"])["status"], "completed")
+        self.assertEqual(store.get_redemption(gift["id"])["status"], "completed")
+        store.close()
+
+    def test_resume_skips_recent_and_in_flight(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            store.update_customer_points("2", 100)
+            redemption, _ = store.redeem_reward("2", "1")
+            started, release = threading.Event(), threading.Event()
+            provider = _FlakyProvider(failures=0)
+            provider.fulfil = lambda job: started.set() or release.wait(5) and "VCH-TEST"
+            queue = FulfilmentQueue(store, provider, backoff=0)
+            queue.start()   # without a resume thread: the passes below are run by hand
+            queue.resume_after = 3600
+            self.assertEqual(queue.resume_stalled(), 0)   # too recent to count as stalled
+            queue.submit(redemption["id"], "reward")
+            self.assertTrue(started.wait(5))
+            queue.resume_after = -1
+            self.assertEqual(queue.resume_stalled(), 0)   # a job here already holds it
+            release.set()
+            self.assertTrue(queue.join(timeout=5))
+            queue.close()
+            self.assertEqual(store.get_pending_redemptions(), [])
+
+    def test_resume_leaves_jobs_leased_by_another_worker(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            store.update_customer_points("2", 100)
+            redemption, _ = store.redeem_reward("2", "1")
+            started, release = threading.Event(), threading.Event()
+            provider = _FlakyProvider(failures=0)
+            provider.fulfil = lambda job: started.set() or release.wait(5) and "VCH-TEST"
+            running = FulfilmentQueue(store, provider, backoff=0, owner="worker-a")
+            running.submit(redemption["id"], "reward")
+            self.assertTrue(started.wait(5))
+
+            other = FulfilmentQueue(store, _FlakyProvider(failures=0), resume_after=-1, owner="worker-b")
+            self.assertEqual(other.resume_stalled(), 0)   # worker-a's lease hasn't run out
+            release.set()
+            self.assertTrue(running.join(timeout=5))
+            running.close()
+            other.close()
+            self.assertEqual(store.get_redemption(redemption["id"])["status"], "completed")
+
+            # A lapsed lease can be taken over
+            redemption, _ = store.redeem_reward("2", "1")
+            self.assertTrue(store.claim_redemption(redemption["id"], "worker-a", 0))
+            self.assertTrue(store.claim_redemption(redemption["id"], "worker-b", 60))
+            self.assertFalse(store.claim_redemption(redemption["id"], "worker-a", 60))
+
+    def test_refund_survives_restart(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = DataStore.open(directory, snapshot_interval=0)
+        store.update_customer_points("3", 80)
+        redemption, _ = store.redeem_reward("3", "1")
+        store.refund_redemption(redemption["id"])
+        store.close()
+
+        store = DataStore.open(directory, snapshot_interval=0)
+        self.assertEqual(store.get_redemption(redemption["id"])["status"], "refunded")
+        self.assertEqual(store.get_customer("3")["points_balance"], 80)
+        store.close()
+
+    def test_status_poll_and_stream(self):
+        data_store.update_customer_points("1", 50)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "1"
+        response = client.post("/redeem_reward", data={"reward_id": "1"}).get_json()
+        self.assertEqual(response["status"], "pending")
+
+        lines = client.get(response["status_url"] + "/stream").get_data(as_text=True).splitlines()
+        events = [json.loads(line[len("data: "):]) for line in lines if line.startswith("data: ")]
+        self.assertEqual(events[-1]["status"], "completed")
+        polled = client.get(response["status_url"]).get_json()["redemption"]
+        self.assertEqual(polled["status"], "completed")
+
+        with client.session_transaction() as session:
+            session["customer_id"] = "2"
+        self.assertEqual(client.get(response["status_url"]).status_code, 404)
+
+class TestIdempotency(unittest.TestCase):
+    def test_retry_replays_original_remittance(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "2"
+        form = {"amount": "300", "recipient": "Gogo", "destination_country": "ZW"}
+        headers = {"Idempotency-Key": "retry-test-1"}
+        before = data_store.count_customer_transactions("2")
+
+        first = client.post("/process_remittance", data=form, headers=headers)
+        second = client.post("/process_remittance", data=form, headers=headers)
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(data_store.count_customer_transactions("2"), before + 1)
+
+        changed = client.post("/process_remittance", data=dict(form, amount="400"), headers=headers)
+        self.assertEqual(changed.status_code, 422)
+        client.post("/process_remittance", data=form)
+        self.assertEqual(data_store.count_customer_transactions("2"), before + 2)
+
+    def test_failed_remittance_is_not_replayed(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "3"
+        form = {"amount": "200", "recipient": "Tendai", "destination_country": "ZW"}
+        headers = {"Idempotency-Key": "retry-test-transient"}
+
+        def unavailable(customer_id, points):
+            raise ConnectionError("database went away")
+
+        data_store.update_customer_points = unavailable
+        try:
+            with self.assertLogs(level="ERROR"):
+                failed = client.post("/process_remittance", data=form, headers=headers)
+        finally:
+            del data_store.update_customer_points
+        self.assertEqual(failed.status_code, 500)
+        retried = client.post("/process_remittance", data=form, headers=headers)
+        self.assertTrue(retried.json["success"], retried.json)
+        self.assertNotIn("Idempotent-Replayed", retried.headers)
+
+    def login_new_customer(self, points):
+        customer = data_store.add_customer("Retry Tester", f"retry-{random.random()}@example.com")
+        data_store.update_customer_points(customer["id"], points)
+        # Off the leaderboard's top again afterwards, so other tests' ranks don't move
+        self.addCleanup(lambda: data_store.deduct_customer_points(
+            customer["id"], data_store.get_customer(customer["id"])["points_balance"]))
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = customer["id"]
+        return client, customer["id"]
+
+    def test_failure_after_points_awarded_is_replayed(self):
+        client, customer_id = self.login_new_customer(0)
+        form = {"amount": "1000", "recipient": "Rudo", "destination_country": "ZW"}
+        headers = {"Idempotency-Key": "retry-after-points"}
+
+        def unavailable(*args):
+            raise ConnectionError("database went away")
+
+        data_store.add_transaction = unavailable
+        try:
+            with self.assertLogs(level="ERROR"):
+                failed = client.post("/process_remittance", data=form, headers=headers)
+        finally:
+            del data_store.add_transaction
+        self.assertEqual(failed.status_code, 500)
+        retried = client.post("/process_remittance", data=form, headers=headers)
+        self.assertEqual(retried.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(data_store.get_customer(customer_id)["points_balance"], 10)
+        self.assertEqual(data_store.count_customer_transactions(customer_id), 0)
+
+    def test_failure_after_points_spent_is_replayed(self):
+        client, customer_id = self.login_new_customer(100)
+        headers = {"Idempotency-Key": "retry-after-redeem"}
+
+        def unavailable(*args, **kwargs):
+            raise ConnectionError("queue went away")
+
+        fulfilment.submit = unavailable
+        try:
+            with self.assertLogs(level="ERROR"):
+                failed = client.post("/redeem_reward", data={"reward_id": "1"}, headers=headers)
+        finally:
+            del fulfilment.submit
+        self.assertEqual(failed.status_code, 500)
+        retried = client.post("/redeem_reward", data={"reward_id": "1"}, headers=headers)
+        self.assertEqual(retried.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(data_store.get_customer(customer_id)["points_balance"], 50)
+
+    def test_gift_without_collection_is_refunded(self):
+        client, customer_id = self.login_new_customer(100)
+        form = {"gift_id": "airtime50", "gift_recipient": "Nyasha", "recipient_mukuru_id": "MK-RETRY-1"}
+        headers = {"Idempotency-Key": "retry-gift"}
+
+        def unavailable(*args, **kwargs):
+            raise ConnectionError("database went away")
+
+        data_store.add_collection = unavailable
+        try:
+            with self.assertLogs(level="ERROR"):
+                failed = client.post("/send_gift", data=form, headers=headers)
+        finally:
+            del data_store.add_collection
+        self.assertEqual(failed.status_code, 500)
+        self.assertEqual(data_store.get_customer(customer_id)["points_balance"], 100)
+        retried = client.post("/send_gift", data=form, headers=headers)
+        self.assertTrue(retried.json["success"], retried.json)
+        self.assertNotIn("Idempotent-Replayed", retried.headers)
+        cost = data_store.get_gift("airtime50")["points_cost"]
+        self.assertEqual(data_store.get_customer(customer_id)["points_balance"], 100 - cost)
+
+    def test_concurrent_duplicates_run_once(self):
+        test_app = Flask("idempotent")
+        test_app.secret_key = "test"
+        calls = []
+
+        @test_app.route("/charge", methods=["POST"])
+        @idempotent(IdempotencyCache())
+        def charge():
+            calls.append(1)
+            time.sleep(0.05)
+            return {"charge": len(calls)}
+
+        def post(_):
+            response = test_app.test_client().post("/charge", data={"amount": "5"}, headers={"Idempotency-Key": "k"})
+            return response.get_json()["charge"]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(post, range(8)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [1] * 8)
+
+    def test_cache_is_bounded_and_failures_are_not_stored(self):
+        cache = IdempotencyCache(max_entries=2)
+        for key in "abc":
+            state, claim = cache.begin(key, "f")
+            cache.complete(claim, (200, b"ok", "text/plain"))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.begin("a", "f")[0], "run")
+
+        state, claim = cache.begin("x", "f")
+        cache.abandon("x", claim)
+        self.assertEqual(cache.begin("x", "f")[0], "run")
+
+class TestRateLimit(unittest.TestCase):
+    def make_app(self, **kwargs):
+        test_app = Flask("limited")
+        test_app.secret_key = "test"
+
+        @test_app.route("/write", methods=["POST"])
+        def write():
+            return {"success": True}
+
+        limiter = ratelimit.init_app(test_app, enabled=True, limits={"write": (1.0, 2)}, **kwargs)
+        return test_app, limiter
+
+    def test_buckets_refill(self):
+        for store in (ratelimit.MemoryBucketStore(), SQLBucketStore("sqlite://")):
+            self.assertEqual([store.take("k", 2.0, 2, now=10.0) for _ in range(3)], [0.0, 0.0, 0.5])
+            self.assertEqual(store.take("k", 2.0, 2, now=10.5), 0.0)
+            self.assertEqual(store.take("other", 2.0, 2, now=10.5), 0.0)
+
+    def test_over_limit_gets_429_per_customer(self):
+        test_app, limiter = self.make_app()
+        client = test_app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "1"
+        statuses = [client.post("/write").status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(client.post("/write").headers["Retry-After"], "1")
+
+        with client.session_transaction() as session:
+            session["customer_id"] = "2"
+        self.assertEqual(client.post("/write").status_code, 200)
+        self.assertEqual(limiter.shedder.in_flight, 0)
+
+    def test_anonymous_callers_keyed_on_forwarded_address(self):
+        test_app, _ = self.make_app()
+        test_app.wsgi_app = ProxyFix(test_app.wsgi_app, x_for=1)
+        client = test_app.test_client()
+        statuses = [client.post("/write", headers={"X-Forwarded-For": "203.0.113.7"}).status_code
+                    for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(client.post("/write", headers={"X-Forwarded-For": "203.0.113.8"}).status_code, 200)
+
+    def test_in_flight_limit_is_below_thread_count(self):
+        os.environ["GUNICORN_THREADS"] = "8"
+        self.addCleanup(os.environ.pop, "GUNICORN_THREADS")
+        limiter = ratelimit.init_app(Flask("shed"), enabled=True)
+        self.assertEqual(limiter.shedder.max_in_flight, 6)
+        limiter.shedder.in_flight = 7
+        self.assertEqual(limiter.shedder.check(), 1.0)
+
+    def test_sheds_requests_that_queued_too_long(self):
+        test_app, limiter = self.make_app(shedder=ratelimit.LoadShedder(max_queue_wait=0.5))
+        client = test_app.test_client()
+        queued_at = f"t={int((time.time() - 2) * 1000)}"
+        response = client.post("/write", headers={"X-Request-Start": queued_at})
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response.headers["Retry-After"]), 2)
+        self.assertEqual(limiter.shed, 1)
+        self.assertEqual(client.post("/write").status_code, 200)
+
+class TestFragmentCache(unittest.TestCase):
+    TEMPLATE = "{% cache 'rows', version %}{{ render() }}{% endcache %}"
+
+    def setUp(self):
+        self.app = Flask("fragments")
+        fragments.init_app(self.app)
+        self.renders = []
+
+    def render(self, version):
+        def render():
+            self.renders.append(version)
+            return f"v{version}"
+        with self.app.test_request_context():
+            return render_template_string(self.TEMPLATE, version=version, render=render)
+
+    def test_block_renders_once_per_version(self):
+        self.assertEqual(self.render(1), "v1")
+        self.assertEqual(self.render(1), "v1")
+        self.assertEqual(self.render(2), "v2")
+        self.assertEqual(self.renders, [1, 2])
+
+    def test_unknown_version_is_not_cached(self):
+        self.render(None)
+        self.render(None)
+        self.assertEqual(self.renders, [None, None])
+
+    def test_pages_use_store_versions(self):
+        store = DataStore()
+        version = store.get_leaderboard_version()
+        store.update_customer("2", name="Jane Smith-Dube")
+        self.assertGreater(store.get_leaderboard_version(), version)
+        version = store.get_transaction_version("2")
+        store.add_transaction("2", 500, "Gogo", 5)
+        self.assertGreater(store.get_transaction_version("2"), version)
+
+    def test_cached_page_revalidates(self):
+        client = app.test_client()
+        first = client.get("/demo")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(client.get("/demo").get_data(), first.get_data())
+        self.assertEqual(client.get("/demo", headers={"If-None-Match": first.headers["ETag"]}).status_code, 304)
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static)
+        os.makedirs(os.path.join(self.static, "css"))
+        os.makedirs(os.path.join(self.static, "img"))
+        with open(os.path.join(self.static, "img", "bg.png"), "wb") as f:
+            f.write(b"\x89PNG fake image")
+        with open(os.path.join(self.static, "css", "site.css"), "w") as f:
+            f.write("/* theme */\n.hero {\n    background: url('../img/bg.png');\n}\n"
+                    ".card :hover { content: 'a  b'; }\n" * 20)
+
+    def test_minifiers(self):
+        self.assertEqual(assets.minify_css("a  >  b { color : red ; }\n/* x */ p:hover{x: 'a ; b'}"),
+                         "a>b{color :red}p:hover{x:'a ; b'}")
+        self.assertEqual(assets.minify_js("/**\n * doc\n */\nfunction f() {\n    // note\n    return 1;\n}\n"),
+                         "function f() {\nreturn 1;\n}\n")
+
+    def test_build_and_serve(self):
+        test_app = Flask("assets", static_folder=self.static, static_url_path="/static")
+        manifest = assets.init_app(test_app, enabled=True, build_on_startup=True)
+        built_css = manifest["files"]["css/site.css"]
+        self.assertRegex(built_css, r"^css/site\.[0-9a-f]{10}\.css$")
+        with open(os.path.join(self.static, "dist", built_css)) as f:
+            css = f.read()
+        self.assertIn(f"url('../{manifest['files']['img/bg.png']}')", css)
+        self.assertIn(".card :hover{content:'a  b'}", css)
+
+        with test_app.test_request_context():
+            url = url_for("static", filename="css/site.css")
+        self.assertEqual(url, f"/static/dist/{built_css}")
+        client = test_app.test_client()
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertEqual(response.mimetype, "text/css")
+        response.close()
+        response = client.get(url)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_data(as_text=True), css)
+        response.close()
+
+class TestStats(unittest.TestCase):
+    def exercise(self, store):
+        store.add_transaction("1", 2500, "Gogo", 25, "ZW")
+        store.add_transaction("2", 800, "Sipho", 8, "MW")
+        store.update_customer_points("3", 1000)
+        for customer_id in ("1", "2"):
+            store.update_customer_points(customer_id, 2000)
+        redemption, _ = store.redeem_reward("1", store.get_all_rewards()[0]["id"])
+        refunded, _ = store.redeem_reward("2", store.get_all_rewards()[0]["id"])
+        store.complete_redemption(redemption["id"])
+        store.refund_redemption(refunded["id"])
+        return redemption["points_used"]
+
+    def test_incremental_matches_rebuild(self):
+        store = DataStore()
+        before = store.get_stats()
+        points_used = self.exercise(store)
+        live = store.get_stats()
+        today = datetime.now().date().isoformat()
+        self.assertEqual(live["points_issued_by_day"][today] - before["points_issued_by_day"].get(today, 0), 33)
+        self.assertEqual(live["points_redeemed_by_day"][today] - before["points_redeemed_by_day"].get(today, 0), points_used)
+        self.assertEqual(live["volume_by_country"]["ZW"]["count"], before["volume_by_country"].get("ZW", {"count": 0})["count"] + 1)
+        self.assertEqual(sum(live["customers_by_tier"].values()), store.count_customers())
+        self.assertIs(store.get_stats(), live)   # unchanged: served from the cached snapshot
+        rebuilt = stats.Stats.build(store.customers.values(), store.transactions.values(), store.redemptions.values())
+        self.assertEqual(rebuilt.snapshot(), live)
+
+    def test_window_moves_at_midnight(self):
+        tracker = stats.Stats()
+        tracker.add_transaction(now_us(), "ZW", 100, 10)
+        today = stats.date.today()
+        self.assertEqual(list(tracker.snapshot(days=1)["points_issued_by_day"]), [today.isoformat()])
+
+        class Tomorrow(stats.date):
+            @classmethod
+            def today(cls):
+                return today + stats.timedelta(days=1)
+
+        saved = stats.date
+        stats.date = Tomorrow
+        self.addCleanup(setattr, stats, "date", saved)
+        self.assertEqual(tracker.snapshot(days=1)["points_issued_by_day"], {})
+
+    @unittest.skipUnless(stats.np is not None, "NumPy not installed")
+    def test_numpy_rebuild_matches(self):
+        store = DataStore()
+        self.exercise(store)
+        args = (store.customers.values(), store.transactions.values(), store.redemptions.values())
+        self.assertEqual(stats.Stats.build(*args, use_numpy=True).snapshot(),
+                         stats.Stats.build(*args, use_numpy=False).snapshot())
+
+    def test_sql_store_agrees(self):
+        memory, sql = DataStore(), SQLDataStore("sqlite://")
+        for store in (memory, sql):
+            self.exercise(store)
+        for key in ("customers_by_tier", "volume_by_country", "top_corridors"):
+            self.assertEqual(sql.get_stats()[key], memory.get_stats()[key])
+
+    def test_endpoint_requires_key(self):
+        client = app.test_client()
+        os.environ["STATS_API_KEY"] = "stats-key"
+        try:
+            self.assertEqual(client.get("/api/stats").status_code, 403)
+            response = client.get("/api/stats?days=7&top=2", headers={"X-API-Key": "stats-key"})
+        finally:
+            del os.environ["STATS_API_KEY"]
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.json["stats"]["top_corridors"]), 2)
+
+class TestLiveEvents(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["customer_id"] = "1"
+
+    def test_bus_keeps_events_only_for_listeners(self):
+        bus = EventBus()
+        bus.publish("1", "balance")
+        channel = bus.open("1")
+        self.assertEqual(bus.wait(channel, 0, timeout=0), [])
+        bus.publish("1", "balance")
+        bus.publish("2", "balance")
+        self.assertEqual([name for _, name, _ in bus.wait(channel, 0, timeout=0)], ["balance"])
+        bus.close(channel)
+
+    def test_stream_pushes_balance_and_transactions(self):
+        response = self.client.get("/api/events/stream", buffered=False)
+        chunks = iter(response.response)
+        try:
+            self.assertIn("event: snapshot", next(chunks).decode())
+            data_store.update_customer_points("1", 7)
+            self.assertIn("event: balance", next(chunks).decode())
+            data_store.add_transaction("1", 300, "Gogo", 3, "ZW")
+            self.assertIn("event: transaction", next(chunks).decode())
+        finally:
+            response.close()
+
+    def test_long_poll(self):
+        first = self.client.get("/api/events").json
+        self.assertEqual(first["events"], [])
+        data_store.update_customer_points("1", 7)
+        second = self.client.get(f"/api/events?after={first['cursor']}").json
+        self.assertEqual([event["event"] for event in second["events"]], ["balance"])
+        self.assertEqual(second["state"]["points_balance"], data_store.get_customer("1")["points_balance"])
+        self.assertGreater(second["cursor"], first["cursor"])
+
+    def test_full_server_refuses_streams_and_answers_polls_at_once(self):
+        import routes
+        saved = routes.event_slots
+        routes.event_slots = threading.BoundedSemaphore(1)
+        self.addCleanup(setattr, routes, "event_slots", saved)
+        held = self.client.get("/api/events/stream", buffered=False)
+        try:
+            self.assertEqual(self.client.get("/api/events/stream").status_code, 503)
+            cursor = self.client.get("/api/events").json["cursor"]
+            started = time.monotonic()
+            polled = self.client.get(f"/api/events?after={cursor}").json
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(polled["retry_after"], routes.EVENT_POLL_SECONDS)
+        finally:
+            held.close()
+        # Closing the stream gives its slot back
+        again = self.client.get("/api/events/stream", buffered=False)
+        self.assertEqual(again.status_code, 200)
+        again.close()
+
+    def test_stream_only_on_live_pages(self):
+        self.assertIn(b"data-events-url", self.client.get("/dashboard").data)
+        self.assertNotIn(b"data-events-url", self.client.get("/rewards").data)
+
+class TestTokenAuth(unittest.TestCase):
+    def test_verify(self):
+        auth = TokenAuth(DataStore(), "secret")
+        token, _ = auth.issue("1")
+        self.assertEqual(auth.verify(token), "1")
+        self.assertEqual(auth.verify(token), "1")   # from the verified-token cache
+        self.assertIsNone(auth.verify(token[:-2] + "xx"))
+        self.assertIsNone(auth.verify("2" + token[1:]))
+        self.assertIsNone(TokenAuth(DataStore(), "other").verify(token))
+        expired = TokenAuth(DataStore(), "secret", ttl=-1)
+        self.assertIsNone(expired.verify(expired.issue("1")[0]))
+
+    def test_json_endpoints_with_bearer_token(self):
+        client = app.test_client()
+        self.assertEqual(client.post("/api/token", json={"email": "john.doe@email.com", "password": "x"}).status_code, 401)
+        token = client.post("/api/token", json={"email": "john.doe@email.com", "password": "demo123"}).json["token"]
+        remittance = {"amount": 1000, "recipient": "Gogo", "destination_country": "ZW"}
+        self.assertEqual(client.post("/process_remittance", json=remittance).status_code, 401)
+        response = client.post("/process_remittance", json=remittance, headers={"Authorization": f"Bearer {token}"})
+        self.assertTrue(response.json["success"])
+        self.assertEqual(response.json["points_earned"], 10)
+        self.assertEqual(data_store.get_latest_transactions("1", 1)[0]["id"], response.json["transaction_id"])
+
+class TestPointsRules(unittest.TestCase):
+    DAY_US = 86400 * 1_000_000
+
+    def rules(self, start):
+        return RuleSet.from_dicts([
+            {"name": "Zim double", "countries": ["ZW"], "multiplier": 2, "starts": start, "ends": start + self.DAY_US},
+            {"name": "Gold bonus", "tiers": ["Gold"], "bonus": 5},
+            {"name": "Kenya 15%", "countries": ["KE"], "multiplier": 1.15},
+        ])
+
+    def test_campaigns_stack_and_expire(self):
+        start = 1_800_000_000_000_000
+        rules = self.rules(start)
+        self.assertEqual(rules.points(1000, "MW", "Bronze", at_us=start), 10)
+        self.assertEqual(rules.points(1000, "ZW", "Bronze", at_us=start), 20)
+        self.assertEqual(rules.points(1000, "ZW", "Gold", at_us=start), 25)
+        self.assertEqual(rules.points(10000, "KE", "Silver", at_us=start), 115)
+        self.assertEqual(rules.points(1000, "ZW", "Bronze", at_us=start + self.DAY_US), 10)
+        self.assertEqual(rules.points(1000, "ZW", "Bronze", at_us=start - 1), 10)
+        with self.assertRaises(ValueError):
+            Campaign.from_dict({"name": "typo", "multipler": 2})
+
+    def test_batch_matches_request_path(self):
+        start = 1_800_000_000_000_000
+        rules = self.rules(start)
+        rng = random.Random(4)
+        rows = [(rng.randrange(1, 20000) + rng.random(), rng.choice(["ZW", "KE", "MW", None]),
+                 rng.choice(["Bronze", "Silver", "Gold"]), start + rng.randrange(-self.DAY_US, 2 * self.DAY_US))
+                for _ in range(2000)]
+        expected = [rules.points(*row) for row in rows]
+        columns = list(zip(*rows))
+        self.assertEqual(rules.score_batch(*columns, use_numpy=False), expected)
+        if stats.np is not None:
+            self.assertEqual(rules.score_batch(*columns, use_numpy=True), expected)
+
+    def test_back_apply_and_bulk(self):
+        campaign = Campaign("Everything x2", multiplier=2)
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            store.add_transaction("1", 1500, "Gogo", 15, "ZW")
+            earned = sum(int(t["amount"] // 100) for t in store.get_customer_transactions("1"))
+            balance = store.get_customer("1")["points_balance"]
+            self.assertEqual(back_apply(store, campaign, dry_run=True)["1"], earned)
+            self.assertEqual(store.get_customer("1")["points_balance"], balance)
+            back_apply(store, campaign)
+            self.assertEqual(store.get_customer("1")["points_balance"], balance + earned)
+
+            rules = RuleSet([campaign])
+            results = store.add_transactions_bulk(
+                [{"customer_id": "1", "amount": 1000, "recipient": "Gogo", "destination_country": "ZW"}],
+                score=rules.points)
+            self.assertEqual(results[0]["points_earned"], 20)
+
+class TestVelocity(unittest.TestCase):
+    LIMITS = {"remittance": {
+        "customer": {60: (3, 1000), 86400: (5, 10**6)},
+        "recipient": {60: (2, 10**6)},
+    }}
+
+    def test_windows_slide(self):
+        checker = VelocityChecker(self.LIMITS)
+        now = 1_000_000.0
+        for i in range(3):
+            checker.admit("remittance", "c1", 100, now=now + i)
+        with self.assertRaises(VelocityExceeded) as raised:
+            checker.admit("remittance", "c1", 100, now=now + 3)
+        self.assertIn("per minute", raised.exception.message)
+        # Room comes back when the first of the three leaves the minute window
+        self.assertEqual(raised.exception.retry_after, 57)
+        # A minute later the minute window has emptied but the day window still counts them
+        checker.admit("remittance", "c1", 100, now=now + 61)
+        checker.admit("remittance", "c1", 100, now=now + 62)
+        with self.assertRaises(VelocityExceeded):
+            checker.admit("remittance", "c1", 100, now=now + 130)
+        self.assertEqual(checker.totals("remittance", "customer", "c1", now=now + 130)[86400], (5, 500.0))
+
+    def test_value_recipient_and_release(self):
+        checker = VelocityChecker(self.LIMITS)
+        with self.assertRaises(VelocityExceeded):
+            checker.admit("remittance", "c1", 1001, now=0)
+        checker.admit("remittance", "c1", 10, recipient="ZW:gogo", now=0)
+        reservation = checker.admit("remittance", "c2", 10, recipient="ZW:gogo", now=0)
+        with self.assertRaises(VelocityExceeded):
+            checker.admit("remittance", "c3", 10, recipient="ZW:gogo", now=0)
+        reservation.release()
+        checker.admit("remittance", "c3", 10, recipient="ZW:gogo", now=1)
+        self.assertEqual(checker.totals("remittance", "customer", "c2", now=1)[60], (0, 0.0))
+
+    def test_oversized_value_is_not_retryable(self):
+        checker = VelocityChecker(self.LIMITS)
+        with self.assertRaises(VelocityExceeded) as raised:
+            checker.admit("remittance", "c1", 1001, now=0)
+        self.assertIsNone(raised.exception.retry_after)
+        self.assertIn("per-transaction", raised.exception.message)
+
+    def test_retry_after_waits_for_room(self):
+        checker = VelocityChecker(self.LIMITS)
+        checker.admit("remittance", "c1", 600, now=1000.0)
+        for i in range(1, 3):
+            checker.admit("remittance", "c1", 100, now=1030.0 + i)
+        # 800 of 1000 used: 300 more only fits once the 600 leaves the minute window
+        with self.assertRaises(VelocityExceeded) as raised:
+            checker.admit("remittance", "c1", 300, now=1040.0)
+        wait = raised.exception.retry_after
+        self.assertGreater(wait, 5)
+        with self.assertRaises(VelocityExceeded):
+            checker.admit("remittance", "c1", 300, now=1040.0 + wait - 5)
+        checker.admit("remittance", "c1", 300, now=1040.0 + wait)
+
+    def test_memory_is_bounded(self):
+        checker = VelocityChecker(self.LIMITS, max_keys=10)
+        for i in range(50):
+            checker.admit("remittance", f"c{i}", 10, now=0)
+        self.assertEqual(len(checker), 10)
+
+    def test_route_returns_429(self):
+        import routes
+        saved = routes.velocity
+        routes.velocity = VelocityChecker({"remittance": {"customer": {60: (1, 10**9)}}})
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "2"
+        form = {"amount": "500", "recipient": "Sipho", "destination_country": "MW"}
+        try:
+            first = client.post("/process_remittance", data=form)
+            self.assertTrue(first.json["success"], first.json)
+            response = client.post("/process_remittance", data=form)
+        finally:
+            routes.velocity = saved
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response.headers)
+
+    def test_route_refuses_oversized_remittance_for_good(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "2"
+        response = client.post("/process_remittance", data={"amount": "30000", "recipient": "Sipho",
+                                                             "destination_country": "MW"})
+        self.assertEqual(response.status_code, 422)
+        self.assertNotIn("Retry-After", response.headers)
+
+def _credit_shared(path, customer_id, times):
+    store = DataStore(balances=BalanceTable(path))
+    for _ in range(times):
+        store.update_customer_points(customer_id, 1)
+
+
+class TestSharedBalances(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "balances")
+
+    def open_store(self):
+        store = DataStore(balances=BalanceTable(self.path, capacity=1024))
+        self.addCleanup(store.close)
+        return store
+
+    def test_workers_see_one_balance(self):
+        first, second = self.open_store(), self.open_store()
+        first.update_customer_points("1", 600)
+        self.assertEqual(second.get_customer("1")["points_balance"], 600)
+        self.assertEqual(second.get_customer("1")["tier"], "Silver")
+        redemption, _ = second.redeem_reward("1", "5")
+        self.assertIsNotNone(redemption)
+        self.assertIsNone(first.deduct_customer_points("1", 200))
+        self.assertEqual(first.get_customer("1").stored()[4], 100)
+        # A worker that starts later adopts the table's balances over its own seed data
+        self.assertEqual(self.open_store().get_customer("1")["points_balance"], 100)
+
+    def test_updates_are_atomic_across_processes(self):
+        store = self.open_store()
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=_credit_shared, args=(self.path, "2", 500)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(store.get_customer("2")["points_balance"], 2000)
+
+    def test_read_recovers_from_a_crashed_writer(self):
+        store = self.open_store()
+        store.update_customer_points("1", 40)
+        table = store.balances
+        offset = table._offset(table.slot("1"))
+        # A writer that died between its two seq stores leaves the seq odd
+        shared_balances.SEQ.pack_into(table._map, offset, 7)
+        self.assertEqual(table.get("1"), (40, "Bronze"))
+        self.assertEqual(shared_balances.SEQ.unpack_from(table._map, offset)[0], 8)
+        shared_balances.SEQ.pack_into(table._map, offset, 9)
+        table.set("1", balance=45)
+        self.assertEqual(shared_balances.SEQ.unpack_from(table._map, offset)[0], 10)
+        self.assertEqual(table.get("1"), (45, "Bronze"))
+
+    def test_leaderboard_ranks_shared_balances(self):
+        first, second = self.open_store(), self.open_store()
+        newcomer = first.add_customer("Thandi", "thandi@example.com")
+        first.update_customer_points(newcomer["id"], 50)
+        second.update_customer_points("3", 70)
+        second.update_customer_points("2", 50)
+        # Ties keep the order customers entered the table in
+        expected = [(1, "3", 70), (2, "2", 50), (3, newcomer["id"], 50), (4, "1", 0)]
+        for use_numpy in (True, False):
+            with self.subTest(use_numpy=use_numpy):
+                saved = shared_balances.np
+                shared_balances.np = saved if use_numpy else None
+                try:
+                    self.assertEqual(second.leaderboard.page(0, 10), expected)
+                    self.assertEqual(second.leaderboard.page(1, 2), expected[1:3])
+                    self.assertEqual(second.get_customer_rank(newcomer["id"]), 3)
+                    self.assertEqual(first.get_customer_rank("1"), 4)
+                finally:
+                    shared_balances.np = saved
+
+class TestLoggingSetup(unittest.TestCase):
+    def setUp(self):
+        root = logging.getLogger()
+        saved = (root.handlers[:], root.level)
+        def restore():
+            logging_setup._flush()
+            root.handlers[:], root.level = saved
+        self.addCleanup(restore)
+
+    def test_json_lines_through_the_queue(self):
+        stream = io.StringIO()
+        logging_setup.configure("INFO", "json", stream=stream)
+        logging.debug("not at this level")
+        logging.info("Redeemed %s", "airtime", extra={"customer_id": "1"})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logging.exception("Fulfilment crashed")
+        logging_setup._flush()
+        entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([entry["message"] for entry in entries], ["Redeemed airtime", "Fulfilment crashed"])
+        self.assertEqual(entries[0]["level"], "INFO")
+        self.assertEqual(entries[0]["customer_id"], "1")
+        self.assertIn("ZeroDivisionError", entries[1]["exc"])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        listener = logging_setup.configure("INFO", "json", stream=io.StringIO(), queue_size=2)
+        listener.stop()   # nothing drains the queue now
+        logging_setup._listener = None
+        for i in range(5):
+            logging.info("line %d", i)
+        handler = logging.getLogger().handlers[0]
+        self.assertEqual(handler.dropped, 3)
+
+
+class TestStartupProfile(unittest.TestCase):
+    def test_lean_profile_flips_flag_defaults(self):
+        saved = startup.LEAN
+        self.addCleanup(setattr, startup, "LEAN", saved)
+        os.environ.pop("PRECOMPILE_TEMPLATES", None)
+        startup.LEAN = False
+        self.assertTrue(startup.flag("PRECOMPILE_TEMPLATES"))
+        startup.LEAN = True
+        self.assertFalse(startup.flag("PRECOMPILE_TEMPLATES"))
+        os.environ["PRECOMPILE_TEMPLATES"] = "1"
+        self.addCleanup(os.environ.pop, "PRECOMPILE_TEMPLATES")
+        self.assertTrue(startup.flag("PRECOMPILE_TEMPLATES"))
+
+    def test_store_without_sample_customers(self):
+        for store in (DataStore(sample_customers=False), SQLDataStore("sqlite://", sample_customers=False)):
+            self.assertEqual(store.count_customers(), 0)
+            self.assertTrue(store.get_all_rewards())
+
+    def test_missing_optional_module(self):
+        self.assertIsNone(startup.optional_import("no_such_module_here"))
+        self.assertIsNone(startup.optional_import("no_such_package.submodule"))
+
+class TestCollections(unittest.TestCase):
+    def test_pages_claims_and_expiry(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            ids = customer_mukuru_ids(store.get_customer("3"))
+            for i in range(5):
+                store.add_collection("+27 555 666 777", "money", f"Sender {i}", amount=100 + i)
+                time.sleep(0.001)
+            store.add_collection("3", "money", "Soon gone", amount=1, ttl=0)
+            page, total = store.get_pending_collections(ids, 0, 4)
+            self.assertEqual(total, 6)
+            self.assertEqual([row["sender_name"] for row in page], ["Sender 0", "Sender 1", "Sender 2", "Sender 3"])
+            rest, _ = store.get_pending_collections(ids, 4, 4)
+            self.assertEqual(len(rest), 2)
+
+            first = page[0]["id"]
+            self.assertIsNone(store.claim_collection(first, customer_mukuru_ids(store.get_customer("1"))))
+            self.assertEqual(store.claim_collection(first, ids)["status"], "collected")
+            self.assertIsNone(store.claim_collection(first, ids))
+            self.assertIsNone(store.claim_collection("not-a-uuid", ids))
+
+            self.assertEqual(store.expire_collections(), 1)
+            self.assertEqual(store.expire_collections(), 0)
+            self.assertEqual(store.get_pending_collections(ids)[1], 4)
+
+    def test_failed_sweep_is_retried(self):
+        store = DataStore(sample_customers=False)
+        entries = [store.add_collection("3", "money", f"Sender {i}", amount=1, ttl=0) for i in range(3)]
+        store.add_collection("3", "money", "Later", amount=1)
+        # Nothing moved yet, so the same entries are due again
+        self.assertEqual(len(store.ledger.due(time.time_ns() // 1000)), 3)
+        self.assertEqual(len(store.ledger.due(time.time_ns() // 1000)), 3)
+
+        calls = []
+        real = store.expire_collections
+
+        def flaky(now=None):
+            calls.append(now)
+            if len(calls) == 1:
+                raise OSError("disk full")
+            return real(now)
+
+        store.expire_collections = flaky
+        sweeper = CollectionSweeper(store, interval=0.01)
+        with self.assertLogs(level="ERROR"):
+            sweeper.ensure_started()
+            deadline = time.time() + 5
+            while sweeper.expired < 3 and time.time() < deadline:
+                time.sleep(0.01)
+        sweeper.stop()
+        self.assertEqual(sweeper.expired, 3)
+        self.assertTrue(all(store.get_collection(entry["id"])["status"] == "expired" for entry in entries))
+        self.assertEqual(store.ledger.due(time.time_ns() // 1000), [])
+
+    def test_refunded_gift_is_cancelled(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            store.update_customer_points("1", 500)
+            redemption, _ = store.redeem_gift("1", "airtime50")
+            store.add_collection("+27987654321", "gift", "John Doe", amount=50, item_name="R50 Airtime",
+                                 sender_id="1", recipient_name="Sarah", redemption_id=redemption["id"])
+            sarah = customer_mukuru_ids(store.get_customer("2"))
+            self.assertEqual(store.get_recent_gifts("1", [])[0]["type"], "sent")
+            self.assertEqual(store.get_recent_gifts("2", sarah)[0]["type"], "received")
+            self.assertEqual(store.get_pending_collections(sarah)[1], 2)
+            store.refund_redemption(redemption["id"])
+            pending, total = store.get_pending_collections(sarah)
+            self.assertEqual(total, 1)
+            self.assertEqual(pending[0]["kind"], "money")
+
+    def test_ledger_survives_reopen(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = DataStore.open(directory, snapshot_interval=0)
+        kept = store.add_collection("3", "money", "Kept", amount=10)
+        claimed = store.add_collection("3", "money", "Claimed", amount=20)
+        store.snapshot()
+        store.claim_collection(claimed["id"], ["3"])
+        store.add_collection("3", "money", "Late", amount=30, ttl=0)
+        store.expire_collections()
+        store.close()
+
+        store = DataStore.open(directory, snapshot_interval=0)
+        self.assertEqual([row["id"] for row in store.get_pending_collections(["3"])[0]], [kept["id"]])
+        self.assertEqual(store.get_collection(claimed["id"])["status"], "collected")
+        store.close()
+
+    def test_claimed_demo_collection_stays_claimed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = DataStore.open(directory, snapshot_interval=0)
+        demo = store.get_pending_collections(["1"])[0][0]
+        self.assertTrue(store.claim_collection(demo["id"], ["1"]))
+        store.close()
+
+        store = DataStore.open(directory, snapshot_interval=0)
+        self.assertEqual(store.get_collection(demo["id"])["status"], "collected")
+        self.assertEqual(store.get_pending_collections(["1"])[1], 0)
+        store.close()
+
+    def test_gift_route_reaches_recipient(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "1"
+        data_store.update_customer_points("1", 100)
+        sent = client.post("/send_gift", data={"gift_id": "airtime50", "gift_recipient": "Michael",
+                                               "recipient_mukuru_id": "+27 555 666 777"})
+        self.assertTrue(sent.json["success"], sent.json)
+
+        with client.session_transaction() as session:
+            session["customer_id"] = "3"
+        pending = client.get("/api/collections").json
+        gift = next(row for row in pending["collections"] if row["kind"] == "gift")
+        self.assertEqual(gift["item_name"], "R50 Airtime")
+        self.assertIn(b"Gift from John Doe", client.get("/receive_collect").data)
+        self.assertTrue(client.post("/collect_money", data={"collection_id": gift["id"]}).json["success"])
+        self.assertEqual(client.post("/collect_money", data={"collection_id": gift["id"]}).status_code, 404)
+
+class TestTransactionPaging(unittest.TestCase):
+    def test_cursor_walks_full_history(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            for i in range(23):
+                store.add_transaction("1", 100 + i, "Recipient", 1)
+            expected = [t["id"] for t in store.iter_customer_transactions("1")]
+            self.assertEqual(len(expected), 23)
+
+            seen, cursor = [], None
+            while True:
+                page, cursor = store.get_transactions_page("1", 10, cursor)
+                seen.extend(t["id"] for t in page)
+                if not cursor:
+                    break
+            self.assertEqual(seen, expected)
+            totals = store.get_transaction_totals("1")
+            self.assertEqual((totals["count"], totals["amount"]), (23, sum(range(100, 123))))
+
+    def test_export_streams_csv_and_ndjson(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["customer_id"] = "3"
+        client.post("/process_remittance", data={"amount": "250", "recipient": "Gogo", "destination_country": "MW"})
+
+        response = client.get("/transaction_history/export")
+        self.assertTrue(response.is_streamed)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertTrue(lines[0].startswith("id,timestamp,amount"))
+        self.assertIn("Gogo", lines[1])
+        response = client.get("/transaction_history/export?format=ndjson")
+        self.assertEqual(json.loads(response.get_data(as_text=True).splitlines()[0])["recipient"], "Gogo")
+        self.assertEqual(client.get("/transaction_history").status_code, 200)
+
+class TestBulkRemittances(unittest.TestCase):
+    ROWS = [
+        {"customer_id": "1", "amount": 30000, "recipient": "Mum", "destination_country": "ZW"},
+        {"customer_id": "1", "amount": 30000, "recipient": "Dad", "destination_country": "ZW", "id_number": "123"},
+        {"customer_id": "1", "amount": -5, "recipient": "Bad", "destination_country": "ZW"},
+        {"customer_id": "404", "amount": 100, "recipient": "Ghost", "destination_country": "KE"},
+    ]
+
+    def test_store_groups_points(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            results = store.add_transactions_bulk(self.ROWS)
+            self.assertEqual([r["success"] for r in results], [True, True, False, False])
+            self.assertEqual(results[2]["message"], "Invalid amount")
+            self.assertEqual(results[3]["message"], "Customer not found")
+            customer = store.get_customer("1")
+            self.assertEqual((customer["points_balance"], customer["tier"]), (600, "Silver"))
+            self.assertEqual(store.count_customer_transactions("1"), 2)
+
+    def test_non_finite_amounts_are_row_errors(self):
+        rows = [{"customer_id": "1", "amount": 50000, "recipient": "Mum", "destination_country": "ZW"},
+                {"customer_id": "1", "amount": "nan", "recipient": "Mum", "destination_country": "ZW"},
+                {"customer_id": "1", "amount": "inf", "recipient": "Mum", "destination_country": "ZW"}]
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            results = store.add_transactions_bulk(rows)
+            self.assertEqual([r["success"] for r in results], [True, False, False])
+            self.assertEqual(results[1]["message"], "Invalid amount")
+            self.assertEqual(store.get_customer("1")["points_balance"], 500)
+            self.assertEqual(store.count_customer_transactions("1"), 1)
+
+    def test_endpoint_accepts_ndjson(self):
+        client = app.test_client()
+        os.environ["PARTNER_API_KEY"] = "test-key"
+        try:
+            self.assertEqual(client.post("/api/remittances/bulk", json=self.ROWS).status_code, 403)
+            body = "\n".join(json.dumps(row) for row in self.ROWS) + "\nnot json\n"
+            response = client.post("/api/remittances/bulk", data=body,
+                                   content_type="application/x-ndjson",
+                                   headers={"X-API-Key": "test-key"})
+        finally:
+            del os.environ["PARTNER_API_KEY"]
+        self.assertEqual(response.json["processed"], 2)
+        self.assertEqual(response.json["failed"], 3)
+        self.assertEqual(response.json["results"][4]["message"], "Row must be an object")
+
+class TestCustomerLookup(unittest.TestCase):
+    def test_memory_and_sql_stores(self):
+        for store in (DataStore(), SQLDataStore("sqlite://")):
+            self.assertEqual(store.find_customer_by_email("  Sarah.Smith@Email.com ")["id"], "2")
+            self.assertEqual(store.find_customer_by_phone("+27 98-765-4321")["id"], "2")
+            self.assertIsNone(store.find_customer_by_email("nobody@email.com"))
+
+            self.assertIsNone(store.add_customer("Dup", "JOHN.DOE@email.com"))
+            new = store.add_customer("Thandi", "thandi@email.com", "+27111222333")
+            self.assertEqual(store.find_customer_by_email("thandi@email.com")["id"], new["id"])
+
+            self.assertIsNone(store.update_customer(new["id"], email="john.doe@email.com"))
+            store.update_customer(new["id"], email="thandi.m@email.com", phone="+27444555666")
+            self.assertIsNone(store.find_customer_by_email("thandi@email.com"))
+            self.assertIsNone(store.find_customer_by_phone("+27111222333"))
+            self.assertEqual(store.find_customer_by_phone("+27444555666")["id"], new["id"])
+
+class TestLeaderboard(unittest.TestCase):
+    def test_matches_full_sort(self):
+        board = Leaderboard()
+        board._LOAD = 4  # force plenty of bucket splits
+        points = {}
+        rng = random.Random(42)
+        for _ in range(2000):
+            customer_id = str(rng.randrange(300))
+            points[customer_id] = rng.randrange(50)
+            board.update(customer_id, points[customer_id])
+        order = {}
+        for customer_id in points:
+            order.setdefault(customer_id, board._keys[customer_id][1])
+        expected = sorted(points, key=lambda c: (-points[c], order[c]))
+
+        self.assertEqual([row[1] for row in board.page(0, len(expected))], expected)
+        self.assertEqual([row[1] for row in board.page(37, 20)], expected[37:57])
+        for rank, customer_id in enumerate(expected, start=1):
+            self.assertEqual(board.rank_of(customer_id), rank)
+
+    def test_store_does_not_mutate_customers(self):
+        store = DataStore()
+        store.update_customer_points("2", 300)
+        store.update_customer_points("3", 250)
+        store.redeem_reward("2", "3")
+        rows = store.get_leaderboard_page(0, 10)
+        self.assertEqual([row["id"] for row in rows], ["3", "2", "1"])
+        self.assertEqual(rows[0]["rank"], 1)
+        self.assertNotIn("rank", store.get_customer("3"))
+        self.assertEqual(store.get_customer_rank("2"), 2)
+
+class _YieldingDict(dict):
+    """Gives up the GIL inside every write to widen read-modify-write races"""
+    def __setitem__(self, key, value):
+        time.sleep(0)
+        super().__setitem__(key, value)
+
+class TestConcurrentRedemptions(unittest.TestCase):
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # make thread interleavings as likely as possible
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def test_no_double_spend(self):
+        store = DataStore()
+        for customer_id in ("1", "2", "3"):
+            store.customers[customer_id] = _YieldingDict(store.customers[customer_id])
+            store.update_customer_points(customer_id, 5000)
+
+        def attempt(i):
+            customer_id = str(i % 3 + 1)
+            if i % 2:
+                return store.redeem_reward(customer_id, "1")[0] is not None  # 50 points
+            return store.deduct_customer_points(customer_id, 50) is not None
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(attempt, range(6000)))
+
+        # 5000 points per customer covers exactly 100 deductions of 50
+        self.assertEqual(sum(results), 300)
+        for customer_id in ("1", "2", "3"):
+            self.assertEqual(store.get_customer(customer_id)["points_balance"], 0)
+        self.assertEqual([row["points_balance"] for row in store.get_leaderboard_page()], [0, 0, 0])
+
+class TestSQLDataStore(unittest.TestCase):
+    def setUp(self):
+        self.store = SQLDataStore("sqlite://")
+
+    def test_seeded_like_memory_store(self):
+        self.assertEqual(self.store.count_customers(), 3)
+        self.assertEqual(self.store.get_reward("1")["points_cost"], 50)
+        self.assertEqual(self.store.get_customer("1")["email"], "john.doe@email.com")
+
+    def test_points_tiers_and_redemption(self):
+        customer = self.store.update_customer_points("2", 600)
+        self.assertEqual((customer["points_balance"], customer["tier"]), (600, "Silver"))
+        self.assertEqual(self.store.get_customer_rank("2"), 1)
+
+        redemption, _ = self.store.redeem_reward("2", "5")
+        self.assertEqual(redemption["points_used"], 500)
+        redemption, message = self.store.redeem_reward("2", "5")
+        self.assertIsNone(redemption)
+        self.assertEqual(message, "Insufficient points")
+        self.assertIsNone(self.store.deduct_customer_points("2", 101))
+        self.assertEqual(self.store.get_customer("2")["points_balance"], 100)
+
+    def test_transactions(self):
+        for i in range(7):
+            self.store.add_transaction("1", 100, "Recipient", i)
+        self.assertEqual(self.store.count_customer_transactions("1"), 7)
+        self.assertEqual(len(self.store.get_latest_transactions("1", 5)), 5)
+        history = self.store.get_customer_transactions("1", newest_first=True)
+        self.assertEqual(history, sorted(history, key=lambda t: t["timestamp"], reverse=True))
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""Sliding-window velocity limits on money and points moved.
+
+Each customer, and each recipient, has a count and a sum of the value
+moved over the last minute, hour and day. Each window is a ring of
+time buckets (5s buckets for the minute, 5m for the hour, 1h for the
+day) with running totals. Recording a value and checking a limit
+therefore cost O(1), and every tracked key uses the same small, fixed
+amount of memory. The window slides one bucket at a time, so a value
+drops out of a window between (window - bucket) and (window) seconds
+after it was recorded.
+
+Keys are kept in an LRU bounded by max_keys. A key that is pushed out
+has been idle longer than anything still tracked.
+
+The counters live in the process. Under N gunicorn workers a customer
+can move up to N times each limit, one share through each worker. Run
+one worker, or pick limits with that in mind (gunicorn.conf.py warns
+when WEB_CONCURRENCY > 1).
+
+A single movement larger than a window's value limit can never pass.
+It is refused with retry_after None, so callers can answer with a
+non-retryable error. For anything else, retry_after is the number of
+seconds until enough of the window has slid out for it to fit.
+
+    reservation = velocity.admit("remittance", customer_id, amount, recipient=key)
+    ...                         # raises VelocityExceeded when over a limit
+    reservation.release()       # if the write then fails
+"""
+from collections import OrderedDict
+import math
+import threading
+import time
+
+# window seconds -> buckets in its ring
+WINDOWS = {60: 12, 3600: 12, 86400: 24}
+WINDOW_NAMES = {60: "minute", 3600: "hour", 86400: "day"}
+
+# kind -> scope -> window seconds -> (max count, max total value)
+# Remittances are valued in rand, redemptions and gifts in points.
+DEFAULT_LIMITS = {
+    "remittance": {
+        "customer": {60: (5, 25000), 3600: (20, 100000), 86400: (50, 250000)},
+        "recipient": {60: (3, 25000), 3600: (10, 100000), 86400: (20, 250000)},
+    },
+    "redemption": {
+        "customer": {60: (5, 5000), 3600: (30, 20000), 86400: (100, 50000)},
+    },
+    "gift": {
+        "customer": {60: (3, 3000), 3600: (10, 10000), 86400: (30, 30000)},
+        "recipient": {60: (3, 3000), 3600: (10, 10000), 86400: (20, 30000)},
+    },
+}
+
+
+class VelocityExceeded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Window:
+    """Count and sum over one sliding window, as a ring of time buckets"""
+
+    __slots__ = ("width", "head", "counts", "sums", "count", "total")
+
+    def __init__(self, seconds, buckets):
+        self.width = seconds / buckets
+        self.head = None            # newest bucket number seen
+        self.counts = [0] * buckets
+        self.sums = [0.0] * buckets
+        self.count = 0
+        self.total = 0.0
+
+    def advance(self, now):
+        """Slide forward to `now`, dropping buckets that fell out of the window"""
+        bucket = int(now // self.width)
+        if self.head is None:
+            self.head = bucket
+        # One step per elapsed bucket, at most a full lap
+        for stale in range(self.head + 1, min(bucket, self.head + len(self.counts)) + 1):
+            i = stale % len(self.counts)
+            self.count -= self.counts[i]
+            self.total -= self.sums[i]
+            self.counts[i] = 0
+            self.sums[i] = 0.0
+        if bucket > self.head:
+            self.head = bucket
+            if self.count == 0:
+                self.total = 0.0    # don't let float residue accumulate
+        return bucket
+
+    def room_at(self, max_count, max_total, value):
+        """Earliest time (epoch seconds) the window has room for one more `value`"""
+        size = len(self.counts)
+        count, total = self.count, self.total
+        # Bucket b leaves the window when the clock reaches bucket b + size
+        for bucket in range(self.head - size + 1, self.head + 1):
+            i = bucket % size
+            count -= self.counts[i]
+            total -= self.sums[i]
+            if count + 1 <= max_count and total + value <= max_total:
+                return (bucket + size) * self.width
+        return (self.head + size) * self.width
+
+    def add(self, bucket, value, count=1):
+        if bucket <= self.head - len(self.counts):
+            return                  # already outside the window
+        i = bucket % len(self.counts)
+        self.counts[i] += count
+        self.sums[i] += value
+        self.count += count
+        self.total += value
+
+
+class Reservation:
+    """What admit() recorded, so a failed write can give it back"""
+
+    def __init__(self, checker, entries, buckets, value):
+        self._checker = checker
+        self._entries = entries
+        self._buckets = buckets
+        self._value = value
+
+    def release(self):
+        if self._entries:
+            self._checker._undo(self._entries, self._buckets, self._value)
+            self._entries = None
+
+
+class VelocityChecker:
+    def __init__(self, limits=None, max_keys=100000):
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        self.max_keys = max_keys
+        self._keys = OrderedDict()   # (kind, scope, id) -> {window seconds: _Window}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _windows(self, key):
+        windows = self._keys.pop(key, None)
+        if windows is None:
+            windows = {seconds: _Window(seconds, buckets) for seconds, buckets in WINDOWS.items()}
+        self._keys[key] = windows
+        if len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+        return windows
+
+    def admit(self, kind, customer_id, value, recipient=None, now=None):
+        """Check every limit for this movement and, if all pass, record it.
+
+        Returns a Reservation; raises VelocityExceeded naming the first limit
+        that would be broken. Check and record happen under one lock, so
+        concurrent requests can't both slip under a limit.
+        """
+        now = time.time() if now is None else now
+        scopes = self.limits.get(kind, {})
+        ids = {"customer": customer_id, "recipient": recipient}
+        ceiling = min((max_total for scope, limits in scopes.items() if ids.get(scope) is not None
+                       for _, max_total in limits.values()), default=None)
+        with self._lock:
+            if ceiling is not None and value > ceiling:
+                # No amount of waiting lets this one through
+                self.rejected += 1
+                raise VelocityExceeded(self._too_large(kind, ceiling), None)
+            entries = [(self._windows((kind, scope, ids[scope])), limits)
+                       for scope, limits in scopes.items() if ids.get(scope) is not None]
+            buckets = {}
+            blocked = None   # (seconds until it fits, message) for the limit that frees up last
+            for windows, limits in entries:
+                for seconds, (max_count, max_total) in limits.items():
+                    window = windows[seconds]
+                    buckets[seconds] = window.advance(now)
+                    if window.count + 1 > max_count or window.total + value > max_total:
+                        wait = max(math.ceil(window.room_at(max_count, max_total, value) - now), 1)
+                        if blocked is None or wait > blocked[0]:
+                            blocked = (wait, self._message(kind, seconds, max_count, max_total))
+            if blocked:
+                self.rejected += 1
+                raise VelocityExceeded(blocked[1], blocked[0])
+            for windows, limits in entries:
+                for seconds in limits:
+                    windows[seconds].add(buckets[seconds], value)
+        return Reservation(self, entries, buckets, value)
+
+    def _undo(self, entries, buckets, value):
+        with self._lock:
+            for windows, limits in entries:
+                for seconds in limits:
+                    windows[seconds].add(buckets[seconds], -value, count=-1)
+
+    def _message(self, kind, seconds, max_count, max_total):
+        unit = "points" if kind != "remittance" else "rand"
+        return (f"Limit reached: at most {max_count} {kind}s or {max_total:,} {unit} "
+                f"per {WINDOW_NAMES.get(seconds, f'{seconds}s')}. Please try again later.")
+
+    def _too_large(self, kind, max_total):
+        unit = "points" if kind != "remittance" else "rand"
+        return f"Exceeds the per-transaction limit of {max_total:,} {unit} for a {kind}."
+
+    def totals(self, kind, scope, key_id, now=None):
+        """{window seconds: (count, total)} for one key, e.g. for support tooling"""
+        now = time.time() if now is None else now
+        with self._lock:
+            windows = self._keys.get((kind, scope, key_id))
+            if windows is None:
+                return {seconds: (0, 0.0) for seconds in WINDOWS}
+            for window in windows.values():
+                window.advance(now)
+            return {seconds: (window.count, window.total) for seconds, window in windows.items()}
+
+    def __len__(self):
+        return len(self._keys)